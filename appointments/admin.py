@@ -1,19 +1,139 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
+from .bulk_booking import ACCEPTED, book_batch
+from .exports import export_response, export_values
+from .forms import BulkBookingFormSet
+from .importers import ScheduleImportError, import_schedule_file
 from .models import Service, Master
 
-from .models import Appointment
-# Register your models here.
-admin.site.register(Appointment)
+from .models import Appointment, ArchivedAppointment
+
+
+# The export actions of the appointments and the archive: the selected rows are streamed
+# in the order of their dates.
+class ExportActionsMixin:
+
+    @admin.action(description='Выгрузить в CSV')
+    def export_csv(self, request, queryset):
+        return export_response(export_values(queryset), 'csv')
+
+    @admin.action(description='Выгрузить в XLSX')
+    def export_xlsx(self, request, queryset):
+        return export_response(export_values(queryset), 'xlsx')
+
+
+# Admin configuration for the Appointment model. The service and the master are joined
+# in the list query, so __str__ does not issue two queries per row.
+@admin.register(Appointment)
+class AppointmentAdmin(ExportActionsMixin, admin.ModelAdmin):
+    list_display = ('date', 'time', 'master', 'service', 'client')
+    list_filter = ('date', 'master')
+    list_select_related = ('service', 'master', 'client')
+    raw_id_fields = ('client',)
+    actions = ['export_csv', 'export_xlsx']
+    date_hierarchy = 'date'
+    ordering = ('-date', 'time')
+    change_list_template = 'admin/appointments/appointment/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('bulk/', self.admin_site.admin_view(self.bulk_booking_view), name='appointments_appointment_bulk'),
+        ] + super().get_urls()
+
+    # The bulk booking screen: receptionists enter many phone bookings at once and get
+    # a report of the accepted and the rejected rows.
+    def bulk_booking_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        report = None
+        formset = BulkBookingFormSet(request.POST or None)
+        if request.method == 'POST' and formset.is_valid():
+            filled = [form for form in formset if form.booking_row()]
+            report = book_batch([form.booking_row() for form in filled])
+            for form, line in zip(filled, report):
+                line['booking'] = form.booking_row()
+                line['master'] = form.cleaned_data['master']
+                line['service'] = form.cleaned_data['service']
+            accepted = sum(1 for line in report if line['status'] == ACCEPTED)
+            self.message_user(request, f'Записано {accepted} из {len(report)}.',
+                              messages.SUCCESS if accepted == len(report) else messages.WARNING)
+            formset = BulkBookingFormSet()
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Пакетная запись',
+            formset=formset,
+            report=report,
+        )
+        return TemplateResponse(request, 'admin/appointments/appointment/bulk_booking.html', context)
+
+
+# Admin configuration for the archived appointments: read-only, they are written by the archive_appointments command.
+@admin.register(ArchivedAppointment)
+class ArchivedAppointmentAdmin(ExportActionsMixin, admin.ModelAdmin):
+    list_display = ('date', 'time', 'master', 'service', 'client')
+    list_filter = ('master',)
+    list_select_related = ('service', 'master', 'client')
+    date_hierarchy = 'date'
+    ordering = ('-date', 'time')
+    actions = ['export_csv', 'export_xlsx']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# Deletion in the admin is soft as well: the rows are hidden at once and purged later
+# by the purge_deleted command. A deleted row can be restored until then.
+class SoftDeleteAdmin(admin.ModelAdmin):
+    readonly_fields = ('deleted_at',)
+
+    def delete_model(self, request, obj):
+        obj.soft_delete()
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            obj.soft_delete()
+
+    @admin.action(description='Восстановить')
+    def restore(self, request, queryset):
+        for obj in queryset.filter(is_active=False):
+            obj.is_active = True
+            obj.deleted_at = None
+            obj.save(update_fields=['is_active', 'deleted_at'])
+
 
 # Admin configuration for the Service model
 @admin.register(Service)
-class ServiceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'duration', 'price')
-    list_filter = ('name', 'duration', 'price')
+class ServiceAdmin(SoftDeleteAdmin):
+    list_display = ('name', 'duration', 'price', 'is_active')
+    list_filter = ('is_active', 'name', 'duration', 'price')
     search_fields = ('name',)
-    pass
+    actions = ['restore']
 
 # Admin configuration for the Master model
 @admin.register(Master)
-class MasterAdmin(admin.ModelAdmin):
-    pass
\ No newline at end of file
+class MasterAdmin(SoftDeleteAdmin):
+    list_display = ('name', 'is_active')
+    list_filter = ('is_active',)
+    actions = ['import_schedule', 'restore']
+
+    # Imports the uploaded schedule files of the selected masters into their availability.
+    @admin.action(description='Импортировать график из файла')
+    def import_schedule(self, request, queryset):
+        for master in queryset.exclude(schedule=''):
+            try:
+                with master.schedule.open('rb') as schedule:
+                    result = import_schedule_file(schedule, name=schedule.name, master=master)
+            except (OSError, ScheduleImportError) as error:
+                self.message_user(request, f'{master}: {error}', messages.ERROR)
+                continue
+            level = messages.WARNING if result.errors else messages.SUCCESS
+            message = f'{master}: {result}'
+            if result.errors:
+                message += '. ' + '; '.join(f'запись {number}: {error}' for number, error in result.errors[:10])
+            self.message_user(request, message, level)
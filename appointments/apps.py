@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AppointmentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'appointments'
+
+    # Connects the signal handlers that keep the slot inventory up to date.
+    def ready(self):
+        from . import signals  # noqa: F401
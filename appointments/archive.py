@@ -0,0 +1,74 @@
+import contextvars
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .batches import iter_batches
+from .models import Appointment, ArchivedAppointment
+
+# Archival of the past appointments. The appointments older than the cutoff are moved to
+# ArchivedAppointment in batches (see appointments.batches), so the booking path keeps a small
+# Appointment table. Every batch is copied and deleted atomically, and the next run goes on from
+# the oldest appointment left. The moved rows keep their ids, their rollups and their calendar events; the
+# deletion signals are muted while a batch is moved (see appointments.signals).
+#
+# The history of the clients, the rollups and the exports read both tables through history().
+
+ARCHIVE_BATCH_SIZE = 500
+DEFAULT_ARCHIVE_AFTER_DAYS = 365
+
+ARCHIVED_FIELDS = ['id', 'service_id', 'master_id', 'date', 'time', 'start', 'end', 'event_id', 'client_id']
+
+_archiving = contextvars.ContextVar('appointments_archiving', default=False)
+
+
+# True while appointments are being moved to the archive.
+def is_archiving():
+    return _archiving.get()
+
+
+# The first date that stays in the Appointment table: `days` (APPOINTMENTS_ARCHIVE_AFTER_DAYS) before today.
+def archive_cutoff(days=None, today=None):
+    if days is None:
+        days = getattr(settings, 'APPOINTMENTS_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    return (today or timezone.localdate()) - timedelta(days=days)
+
+
+# Moves one batch of the oldest appointments before the cutoff to the archive.
+# Returns the number of moved appointments, 0 when nothing is left. Only the past days are moved
+# whatever the cutoff: an archived appointment no longer keeps its slot busy.
+def archive_batch(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    cutoff = min(cutoff, timezone.localdate())
+    ids = list(Appointment.objects.filter(date__lt=cutoff).order_by('pk').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    token = _archiving.set(True)
+    try:
+        with transaction.atomic():
+            rows = Appointment.objects.filter(pk__in=ids).values(*ARCHIVED_FIELDS)
+            ArchivedAppointment.objects.bulk_create(
+                [ArchivedAppointment(**row) for row in rows], ignore_conflicts=True,
+            )
+            Appointment.objects.filter(pk__in=ids).delete()
+    finally:
+        _archiving.reset(token)
+    return len(ids)
+
+
+# Moves the appointments before the cutoff batch by batch and yields the size of every moved batch.
+def iter_archive(cutoff, batch_size=ARCHIVE_BATCH_SIZE):
+    return iter_batches(lambda: archive_batch(cutoff, batch_size))
+
+
+# The querysets of the appointments matching the filters in the Appointment table and in the archive.
+def history_querysets(**filters):
+    return [model.objects.filter(**filters) for model in (Appointment, ArchivedAppointment)]
+
+
+# The rows (values_list of `fields`) of the appointments matching the filters in both tables,
+# as one UNION ALL query ordered by `ordering`; the ordering fields must be among the fields.
+def history(fields, ordering=('date', 'time', 'id'), **filters):
+    hot, archived = (queryset.values_list(*fields) for queryset in history_querysets(**filters))
+    return hot.union(archived, all=True).order_by(*ordering)
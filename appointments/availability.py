@@ -0,0 +1,391 @@
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+
+# Default schedule parameters. They can be overridden in settings.py
+# (APPOINTMENTS_SCHEDULE_DAYS, APPOINTMENTS_START_HOUR, APPOINTMENTS_END_HOUR,
+# APPOINTMENTS_SLOT_MINUTES) or passed directly to build_schedule_dict.
+DEFAULT_SCHEDULE_DAYS = 10
+DEFAULT_START_HOUR = 9
+DEFAULT_END_HOUR = 19
+DEFAULT_SLOT_MINUTES = 60
+# The slot inventory and the bookings reach three schedule windows ahead (APPOINTMENTS_INVENTORY_DAYS).
+DEFAULT_INVENTORY_DAYS = DEFAULT_SCHEDULE_DAYS * 3
+
+AVAILABLE = 'available'
+UNAVAILABLE = 'unavailable'
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+# Returns the slot step as a timedelta.
+def slot_step(step=None):
+    if step is None:
+        step = timedelta(minutes=get_setting('APPOINTMENTS_SLOT_MINUTES', DEFAULT_SLOT_MINUTES))
+    return step
+
+
+# Returns the default working day as a list with one (start, end) interval in minutes.
+def default_working_intervals(start_hour=None, end_hour=None):
+    if start_hour is None:
+        start_hour = get_setting('APPOINTMENTS_START_HOUR', DEFAULT_START_HOUR)
+    if end_hour is None:
+        end_hour = get_setting('APPOINTMENTS_END_HOUR', DEFAULT_END_HOUR)
+    return [(start_hour * 60, end_hour * 60)]
+
+
+# Returns the list of slot start times between start_hour and end_hour with the given step.
+def slot_times(start_hour=None, end_hour=None, step=None):
+    (start, end), = default_working_intervals(start_hour, end_hour)
+    step = slot_step(step)
+
+    day = datetime(2000, 1, 1)
+    current = day + timedelta(minutes=start)
+    end = day + timedelta(minutes=end)
+    times = []
+    while current < end:
+        times.append(current.time())
+        current += step
+    return times
+
+
+# Returns the list of dates of the schedule window starting at start_date.
+def schedule_dates(days=None, start_date=None):
+    if days is None:
+        days = get_setting('APPOINTMENTS_SCHEDULE_DAYS', DEFAULT_SCHEDULE_DAYS)
+    if start_date is None:
+        start_date = timezone.localdate()
+    return [start_date + timedelta(days=i) for i in range(days)]
+
+
+# Returns the first and the last date that can be looked at and booked: today and the end of the horizon
+# of the slot inventory.
+def horizon_dates(today=None):
+    today = today or timezone.localdate()
+    return today, today + timedelta(days=get_setting('APPOINTMENTS_INVENTORY_DAYS', DEFAULT_INVENTORY_DAYS) - 1)
+
+
+# Checks whether the date lies within the booking horizon.
+def in_horizon(date, today=None):
+    first, last = horizon_dates(today)
+    return first <= date <= last
+
+
+# Intervals are (start, end) pairs of minutes from midnight, the end is not included.
+
+def to_minutes(value):
+    if isinstance(value, timedelta):
+        return int(value.total_seconds() // 60)
+    return value.hour * 60 + value.minute
+
+
+def to_time(minutes):
+    return time(minutes // 60, minutes % 60)
+
+
+# Formats minutes from midnight as HH:MM; the end of the day (1440) is "24:00", which has no time().
+def format_minutes(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+# Returns the length in minutes of a service with the given duration. No duration takes one slot.
+def duration_minutes(duration, step=None):
+    if not duration:
+        return to_minutes(slot_step(step))
+    return max(to_minutes(duration), 1)
+
+
+# Returns the length of a service in minutes. Services without a duration take one slot.
+def service_minutes(service=None, step=None):
+    return duration_minutes(service.duration if service is not None else None, step)
+
+
+# Returns the aware (start, end) datetimes of an appointment of the service at the given date and time.
+def appointment_bounds(date, start_time, service=None):
+    start = timezone.make_aware(datetime.combine(date, start_time))
+    return start, start + timedelta(minutes=service_minutes(service))
+
+
+# Checks whether the given date and time has already come.
+def has_started(date, start_time, now=None):
+    return appointment_bounds(date, start_time)[0] <= (now or timezone.now())
+
+
+# Sorts the intervals and merges the overlapping ones in one pass.
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# The total length of the intervals in minutes, the overlapping parts counted once.
+def total_minutes(intervals):
+    return sum(end - start for start, end in merge_intervals(intervals))
+
+
+# The booked share of the working minutes in percent, at most 100.
+def occupancy_percent(booked_minutes, available_minutes):
+    if not available_minutes:
+        return 0
+    return round(min(booked_minutes, available_minutes) * 100 / available_minutes)
+
+
+# Subtracts the busy intervals from the working intervals with a sweep line
+# over both sorted lists, so the cost is O(n log n) instead of comparing every pair.
+def subtract_intervals(working, busy):
+    working = merge_intervals(working)
+    busy = merge_intervals(busy)
+    free = []
+    i = 0
+    for start, end in working:
+        cursor = start
+        while i < len(busy) and busy[i][1] <= cursor:
+            i += 1
+        j = i
+        while j < len(busy) and busy[j][0] < end:
+            if busy[j][0] > cursor:
+                free.append((cursor, busy[j][0]))
+            cursor = max(cursor, busy[j][1])
+            j += 1
+        if cursor < end:
+            free.append((cursor, end))
+    return free
+
+
+# Returns the candidate start times (in minutes, sorted) at which `duration` minutes
+# fit entirely into one of the sorted free intervals. Two pointers, one pass.
+def bookable_starts(free, duration, candidates):
+    starts = []
+    k = 0
+    for start in candidates:
+        while k < len(free) and free[k][1] < start + duration:
+            k += 1
+        if k == len(free):
+            break
+        if free[k][0] <= start:
+            starts.append(start)
+    return starts
+
+
+# The free intervals of one master-day with the starts kept aside for bisect lookups.
+class FreeDay:
+
+    def __init__(self, free):
+        self.free = free
+        self.starts = [start for start, _ in free]
+        self.longest = max((end - start for start, end in free), default=0)
+        self.latest_end = free[-1][1] if free else 0
+
+    # Checks whether [start, start + duration) lies inside one free interval.
+    def fits(self, start, duration):
+        position = bisect_right(self.starts, start) - 1
+        return position >= 0 and start + duration <= self.free[position][1]
+
+
+# Loads the active slot holds of the given master-days as
+# {(master_id, date): [(start, end, expires_at)]}. The hold with the token `ignore_hold`
+# (the client's own hold) is left out.
+def load_holds(master_days, step=None, ignore_hold=None, now=None):
+    from .models import SlotHold
+
+    holds = defaultdict(list)
+    master_days = set(master_days)
+    if not master_days:
+        return holds
+    master_ids = {master_id for master_id, _ in master_days}
+    dates = sorted({date for _, date in master_days})
+    step_minutes = to_minutes(slot_step(step))
+    queryset = SlotHold.objects.filter(
+        master_id__in=master_ids, date__range=(dates[0], dates[-1]), expires_at__gt=now or timezone.now(),
+    )
+    if ignore_hold:
+        queryset = queryset.exclude(token=ignore_hold)
+    for master_id, date, start, duration, expires_at in queryset.values_list(
+            'master_id', 'date', 'time', 'service__duration', 'expires_at'):
+        if (master_id, date) in master_days:
+            start = to_minutes(start)
+            length = to_minutes(duration) if duration else step_minutes
+            holds[(master_id, date)].append((start, start + max(length, 1), expires_at))
+    return holds
+
+
+# Loads the Availability rows of the given master-days as {(master_id, date): {service_id: [(start, end)]}}.
+# The master-days without rows are left out.
+def load_availability(master_days):
+    from .models import Availability
+
+    master_days = set(master_days)
+    rows = defaultdict(lambda: defaultdict(list))
+    if not master_days:
+        return rows
+    master_ids = {master_id for master_id, _ in master_days}
+    dates = sorted({date for _, date in master_days})
+    for master_id, date, service_id, start, end in (
+        Availability.objects
+        .filter(master_id__in=master_ids, date__range=(dates[0], dates[-1]))
+        .values_list('master_id', 'date', 'service_id', 'start_time', 'end_time')
+    ):
+        if (master_id, date) in master_days:
+            rows[(master_id, date)][service_id].append((to_minutes(start), to_minutes(end)))
+    return rows
+
+
+# Returns the working intervals of a master-day with Availability rows ({service_id: intervals}).
+# An Availability row is given for one service, so with a service only its rows count and the day is closed
+# for a service without rows; without a service the master works whenever any of the rows says so.
+def availability_hours(day_rows, service=None):
+    if service is None:
+        return merge_intervals(interval for intervals in day_rows.values() for interval in intervals)
+    return merge_intervals(day_rows.get(service.pk, ()))
+
+
+# Returns the parts of the intervals that lie inside the working intervals.
+def intersect_intervals(intervals, working):
+    outside = subtract_intervals([(0, 24 * 60)], working)
+    return subtract_intervals(intervals, outside)
+
+
+# Loads the working and busy intervals of the given master-days.
+# Working hours come from the Availability rows of the day (only the rows of `service` when it is given),
+# then from the weekly template of the master (Master.availability), then from the default working day.
+# Appointments are busy from their start to their end (derived from the service duration when they
+# are saved), and the active slot holds of other clients are busy as well unless `holds` is False.
+# The Availability rows already loaded with load_availability can be passed as `availability`.
+# Returns {(master_id, date): (working, busy)}.
+def load_day_intervals(master_days, step=None, start_hour=None, end_hour=None, holds=True, ignore_hold=None,
+                       service=None, availability=None):
+    from .models import Appointment, Master
+    from .working_hours import compiled_working_hours
+
+    master_days = list(master_days)
+    if not master_days:
+        return {}
+    master_ids = {master_id for master_id, _ in master_days}
+    dates = sorted({date for _, date in master_days})
+    intervals = {key: ([], []) for key in master_days}
+    templates = {
+        master_id: compiled_working_hours(availability)
+        for master_id, availability in Master.objects.filter(pk__in=master_ids).values_list('pk', 'availability')
+    }
+    rows = load_availability(master_days) if availability is None else availability
+
+    # the appointments are read by their start and end through the (master, start) index
+    window_start = timezone.make_aware(datetime.combine(dates[0], time.min))
+    window_end = timezone.make_aware(datetime.combine(dates[-1] + timedelta(days=1), time.min))
+    for master_id, start, end in (
+        Appointment.objects
+        .overlapping(master_ids, window_start, window_end)
+        .values_list('master_id', 'start', 'end')
+    ):
+        start = timezone.localtime(start)
+        if (master_id, start.date()) in intervals:
+            begin = to_minutes(start.time())
+            length = int((end - start).total_seconds() // 60)
+            intervals[(master_id, start.date())][1].append((begin, begin + max(length, 1)))
+
+    if holds:
+        for key, day_holds in load_holds(master_days, step, ignore_hold).items():
+            intervals[key][1].extend((start, end) for start, end, _ in day_holds)
+
+    default = default_working_intervals(start_hour, end_hour)
+    result = {}
+    for (master_id, date), (_, busy) in intervals.items():
+        if (master_id, date) in rows:
+            working = availability_hours(rows[(master_id, date)], service)
+        else:
+            template = templates.get(master_id)
+            working = template.intervals_for(date) if template else default
+        result[(master_id, date)] = (working, busy)
+    return result
+
+
+# Returns the free intervals of one master-day for the service.
+def day_free_intervals(master, date, ignore_hold=None, service=None):
+    key = (master.pk, date)
+    working, busy = load_day_intervals([key], ignore_hold=ignore_hold, service=service)[key]
+    return subtract_intervals(working, busy)
+
+
+# Checks whether the service can start at the given date and time without overlapping
+# another appointment or another client's hold and without leaving the working hours.
+# A time that has already come or a date beyond the horizon is never bookable.
+def is_bookable(master, service, date, start_time, ignore_hold=None):
+    if not in_horizon(date) or has_started(date, start_time):
+        return False
+    free = day_free_intervals(master, date, ignore_hold, service)
+    return bool(bookable_starts(free, service_minutes(service), [to_minutes(start_time)]))
+
+
+# Turns the slot statuses of one day into free intervals: consecutive free slots are joined.
+def free_intervals_from_slots(statuses, free_status, step=None):
+    step_minutes = to_minutes(slot_step(step))
+    return merge_intervals(
+        (to_minutes(slot), to_minutes(slot) + step_minutes)
+        for slot, status in statuses.items()
+        if status == free_status
+    )
+
+
+# Returns True when the parameters describe the default grid that is kept in the slot inventory.
+def is_default_grid(start_hour=None, end_hour=None, step=None):
+    return start_hour is None and end_hour is None and step is None
+
+
+# Builds the schedule dictionary of the master:
+# {'2023-04-06': {'09:00:00': 'available', '10:00:00': 'unavailable', ...}, ...}
+# A slot is available when the whole service (one slot if no service is given) fits into the free
+# time of the master starting at it. The default grid is read from the slot inventory (the days outside
+# the booking horizon are unavailable), other grids are computed from the appointments.
+def build_schedule_dict(master, service=None, days=None, start_hour=None, end_hour=None, step=None,
+                        start_date=None):
+    from .inventory import read_inventory
+    from .models import SlotInventory
+
+    dates = schedule_dates(days, start_date)
+    duration = service_minutes(service, step)
+    schedule_dict = {}
+
+    if is_default_grid(start_hour, end_hour, step):
+        inventory = read_inventory(master, [date for date in dates if in_horizon(date)])
+        closed = dict.fromkeys(slot_times(), UNAVAILABLE)
+        # the inventory follows all the working hours of the master; the Availability rows of other services
+        # are cut off here
+        rows = load_availability([(master.pk, date) for date in dates]) if service is not None else {}
+        for date in dates:
+            if date not in inventory:
+                schedule_dict[str(date)] = {str(slot): status for slot, status in closed.items()}
+                continue
+            statuses = inventory[date]
+            free = free_intervals_from_slots(statuses, SlotInventory.FREE)
+            if (master.pk, date) in rows:
+                free = intersect_intervals(free, availability_hours(rows[(master.pk, date)], service))
+            starts = set(bookable_starts(free, duration, [to_minutes(slot) for slot in statuses]))
+            schedule_dict[str(date)] = {
+                str(slot): AVAILABLE if to_minutes(slot) in starts else UNAVAILABLE
+                for slot in statuses
+            }
+        return schedule_dict
+
+    times = slot_times(start_hour, end_hour, step)
+    candidates = [to_minutes(slot) for slot in times]
+    intervals = load_day_intervals([(master.pk, date) for date in dates], step, start_hour, end_hour,
+                                   service=service)
+    for date in dates:
+        working, busy = intervals[(master.pk, date)]
+        starts = set(bookable_starts(subtract_intervals(working, busy), duration, candidates))
+        schedule_dict[str(date)] = {
+            str(slot): AVAILABLE if to_minutes(slot) in starts else UNAVAILABLE
+            for slot in times
+        }
+    return schedule_dict
@@ -0,0 +1,13 @@
+# Batched maintenance jobs (the archive, the purge and the rebuild of the rollups). SQLite locks
+# the whole database for a write, so a large job is split into batches, each committed in its own
+# short transaction: the bookings get through between the batches, the database is never write-locked
+# for longer than one batch, and a stopped run loses only the batch in progress.
+
+
+# Runs `run_batch` until it returns 0 (nothing left) and yields what every batch returned.
+def iter_batches(run_batch):
+    while True:
+        done = run_batch()
+        if not done:
+            return
+        yield done
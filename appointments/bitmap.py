@@ -0,0 +1,114 @@
+from django.utils import timezone
+
+from .availability import (availability_hours, bookable_starts, load_availability, schedule_dates, service_minutes,
+                           slot_step, slot_times, to_minutes)
+from .inventory import read_inventory_bulk
+from .models import SlotInventory
+
+
+# AvailabilityIndex keeps one integer bitmask per master-day: bit i is set when the i-th slot
+# of the default grid is free. The masks are built in bulk from one range read of the slot
+# inventory, and the questions "who is free at T" and "what is the earliest slot for a service"
+# are answered with bitwise operations instead of one schedule computation per master.
+class AvailabilityIndex:
+
+    def __init__(self, masks, dates, times, availability=None):
+        self.masks = masks
+        self.dates = dates
+        self.times = times
+        self.availability = availability or {}
+        self.positions = {slot: position for position, slot in enumerate(times)}
+        self.step = to_minutes(slot_step())
+
+    # Builds the index for the masters and the dates (the default schedule window if not given).
+    @classmethod
+    def build(cls, master_ids, dates=None):
+        dates = dates or schedule_dates()
+        times = slot_times()
+        positions = {slot: position for position, slot in enumerate(times)}
+        masks = {}
+        for key, day in read_inventory_bulk(master_ids, dates).items():
+            mask = 0
+            for slot, status in day.items():
+                if status == SlotInventory.FREE and slot in positions:
+                    mask |= 1 << positions[slot]
+            masks[key] = mask
+        return cls(masks, dates, times, load_availability(masks))
+
+    # Returns the number of consecutive slots needed by the service.
+    def slots_needed(self, service=None):
+        return max(1, -(-service_minutes(service) // self.step))
+
+    # Returns the mask of the slots at which `length` consecutive free slots start.
+    @staticmethod
+    def start_mask(mask, length):
+        result = mask
+        for shift in range(1, length):
+            result &= mask >> shift
+        return result
+
+    # Returns the free slots of the master-day for the service. The inventory follows all the working
+    # hours of the master, so the slots outside the Availability rows of the service are cleared.
+    def service_mask(self, master_id, date, service=None):
+        mask = self.masks.get((master_id, date), 0)
+        day_rows = self.availability.get((master_id, date))
+        if service is None or not day_rows:
+            return mask
+        candidates = [to_minutes(slot) for slot in self.times]
+        working = 0
+        for start in bookable_starts(availability_hours(day_rows, service), self.step, candidates):
+            working |= 1 << candidates.index(start)
+        return mask & working
+
+    # Clears the slots of today that have already started.
+    def _future_only(self, date, mask, now):
+        if date != now.date():
+            return mask
+        current = now.time()
+        for position, slot in enumerate(self.times):
+            if slot <= current:
+                mask &= ~(1 << position)
+        return mask
+
+    def _starts(self, master_id, date, length, now, service=None):
+        mask = self.start_mask(self.service_mask(master_id, date, service), length)
+        return self._future_only(date, mask, now)
+
+    # Returns the masters (ids) that can start the service at the given date and time.
+    def free_masters(self, date, slot, service=None):
+        position = self.positions.get(slot)
+        if position is None:
+            return []
+        length = self.slots_needed(service)
+        return [
+            master_id
+            for master_id, day in self.masks
+            if day == date and self.start_mask(self.service_mask(master_id, day, service), length) >> position & 1
+        ]
+
+    # Returns the earliest (date, time) at which the master can start the service, or None.
+    def next_free(self, master_id, service=None, now=None):
+        now = timezone.localtime(now)
+        length = self.slots_needed(service)
+        for date in self.dates:
+            starts = self._starts(master_id, date, length, now, service)
+            if starts:
+                return date, self.times[(starts & -starts).bit_length() - 1]
+        return None
+
+    # Returns the earliest slot for the service across the masters as (date, time, [master ids]),
+    # or None when nobody is free inside the window.
+    def earliest(self, master_ids, service=None, now=None):
+        now = timezone.localtime(now)
+        length = self.slots_needed(service)
+        for date in self.dates:
+            starts = {master_id: self._starts(master_id, date, length, now, service) for master_id in master_ids}
+            combined = 0
+            for mask in starts.values():
+                combined |= mask
+            if combined:
+                lowest = combined & -combined
+                position = lowest.bit_length() - 1
+                masters = [master_id for master_id, mask in starts.items() if mask & lowest]
+                return date, self.times[position], masters
+        return None
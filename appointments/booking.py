@@ -0,0 +1,181 @@
+import heapq
+import random
+import time as clock
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.utils import timezone
+
+from .availability import (AVAILABLE, FreeDay, get_setting, has_started, in_horizon, is_bookable, load_day_intervals,
+                           service_minutes, subtract_intervals, to_minutes)
+from .inventory import release_expired_slots, schedule_changed
+from .models import Appointment, Master, SlotHold
+
+# A slot hold lasts 10 minutes by default (APPOINTMENTS_HOLD_TTL in seconds).
+DEFAULT_HOLD_TTL = 10 * 60
+
+
+# Raised when none of the masters providing the service can take the requested slot.
+class NoMasterAvailable(Exception):
+    pass
+
+
+# Raised when the requested slot was taken by somebody else. `alternatives` holds
+# the nearest free (date, time) pairs of the same master for the same service.
+class SlotTaken(Exception):
+
+    def __init__(self, master, service, date, time):
+        super().__init__(f'{master} is not free for {service} on {date} at {time}')
+        self.master = master
+        self.service = service
+        self.date = date
+        self.time = time
+        self.alternatives = []
+
+
+# Returns up to `limit` free (date, time) pairs of the master for the service, starting from the date
+# (from today when the date lies outside the booking horizon).
+def nearest_alternatives(master, service, date, limit=5):
+    alternatives = []
+    if not in_horizon(date):
+        date = timezone.localdate()
+    for day, slots in master.get_schedule_dict(service=service, start_date=date).items():
+        for slot, status in slots.items():
+            if status == AVAILABLE:
+                alternatives.append((day, slot[:5]))
+                if len(alternatives) == limit:
+                    return alternatives
+    return alternatives
+
+
+# Runs the function again when the database reports a lock conflict (SQLite answers concurrent
+# writers with "database is locked" instead of waiting). The pause grows with every attempt.
+def retry_on_lock(function, *args, **kwargs):
+    attempts = get_setting('APPOINTMENTS_BOOKING_ATTEMPTS', 10)
+    for attempt in range(1, attempts + 1):
+        try:
+            return function(*args, **kwargs)
+        except OperationalError as error:
+            if attempt == attempts or 'locked' not in str(error):
+                raise
+            clock.sleep(random.uniform(0, 0.02 * attempt))
+
+
+def _insert_appointment(master, service, date, time, hold_token, fields):
+    with transaction.atomic():
+        Master.objects.select_for_update().filter(pk=master.pk).exists()
+        if not is_bookable(master, service, date, time, ignore_hold=hold_token):
+            raise SlotTaken(master, service, date, time)
+        if hold_token:
+            SlotHold.objects.filter(token=hold_token).delete()
+        return Appointment.objects.create(service=service, master=master, date=date, time=time, **fields)
+
+
+# Books the service with the master at the given date and time.
+# The master row is locked while the overlap check and the insert run in one transaction,
+# and the unique constraint on (master, date, time) catches whatever still slips through.
+# Raises SlotTaken with fresh alternatives instead of letting the IntegrityError through.
+# The client's own slot hold (hold_token) does not block the booking and is released by it.
+def book_appointment(master, service, date, time, hold_token=None, **fields):
+    try:
+        return retry_on_lock(_insert_appointment, master, service, date, time, hold_token, fields)
+    except IntegrityError:
+        error = SlotTaken(master, service, date, time)
+    except SlotTaken as taken:
+        error = taken
+    error.alternatives = retry_on_lock(nearest_alternatives, master, service, date)
+    raise error
+
+
+# Books the service at the given date and time with any qualifying master.
+# The masters are kept in a heap ordered by the minutes already booked on that day,
+# and the least loaded master who is free for the whole service gets the appointment.
+# The choice and the insert happen in the same transaction.
+def book_any_master(service, date, start_time, **fields):
+    if not in_horizon(date) or has_started(date, start_time):
+        raise NoMasterAvailable(f'{date} {start_time} cannot be booked any more or yet')
+    appointment = retry_on_lock(_insert_any_master, service, date, start_time, fields)
+    if appointment is None:
+        raise NoMasterAvailable(f'No master is free for {service} on {date} at {start_time}')
+    return appointment
+
+
+def _insert_any_master(service, date, start_time, fields):
+    start = to_minutes(start_time)
+    duration = service_minutes(service)
+    with transaction.atomic():
+        master_ids = list(
+            Master.objects.active().select_for_update()
+            .filter(services=service)
+            .values_list('pk', flat=True)
+        )
+        intervals = load_day_intervals([(master_id, date) for master_id in master_ids], service=service)
+
+        heap = []
+        for master_id in master_ids:
+            working, busy = intervals[(master_id, date)]
+            load = sum(end - begin for begin, end in busy)
+            heap.append((load, master_id, working, busy))
+        heapq.heapify(heap)
+
+        while heap:
+            _, master_id, working, busy = heapq.heappop(heap)
+            if not FreeDay(subtract_intervals(working, busy)).fits(start, duration):
+                continue
+            try:
+                # a savepoint, so a concurrent insert for this master only moves us to the next one
+                with transaction.atomic():
+                    return Appointment.objects.create(
+                        service=service, master_id=master_id, date=date, time=start_time, **fields,
+                    )
+            except IntegrityError:
+                continue
+    return None
+
+
+def hold_ttl():
+    return timedelta(seconds=get_setting('APPOINTMENTS_HOLD_TTL', DEFAULT_HOLD_TTL))
+
+
+def _insert_hold(master, service, date, time, previous_token):
+    with transaction.atomic():
+        Master.objects.select_for_update().filter(pk=master.pk).exists()
+        if previous_token:
+            previous = SlotHold.objects.filter(token=previous_token).values_list('master_id', 'date').first()
+            SlotHold.objects.filter(token=previous_token).delete()
+            if previous and previous != (master.pk, date):
+                schedule_changed(*previous)
+        if not is_bookable(master, service, date, time):
+            raise SlotTaken(master, service, date, time)
+        return SlotHold.objects.create(
+            master=master, service=service, date=date, time=time,
+            token=uuid.uuid4().hex, expires_at=timezone.now() + hold_ttl(),
+        )
+
+
+# Holds the slot for the client while the booking form is being filled in.
+# The previous hold of the same client (previous_token) is replaced. Raises SlotTaken
+# when the slot is already booked or held by somebody else; the previous hold is kept then.
+def hold_slot(master, service, date, time, previous_token=None):
+    try:
+        return retry_on_lock(_insert_hold, master, service, date, time, previous_token)
+    except IntegrityError:
+        raise SlotTaken(master, service, date, time)
+
+
+# Releases the hold of the client, e.g. when the booking page is left.
+def release_hold(token):
+    hold = SlotHold.objects.filter(token=token).values_list('master_id', 'date').first()
+    if hold:
+        SlotHold.objects.filter(token=token).delete()
+        schedule_changed(*hold)
+
+
+# Deletes all expired holds and frees their inventory slots in bulk: two queries
+# no matter how many holds have expired. Returns the number of deleted holds.
+def sweep_expired_holds(now=None):
+    now = now or timezone.now()
+    deleted, _ = SlotHold.objects.filter(expires_at__lte=now).delete()
+    release_expired_slots(now)
+    return deleted
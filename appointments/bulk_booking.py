@@ -0,0 +1,137 @@
+from datetime import date as date_type, time as time_type
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_time
+
+from .availability import (FreeDay, appointment_bounds, availability_hours, has_started, in_horizon,
+                           load_availability, load_day_intervals, service_minutes, subtract_intervals, to_minutes)
+from .booking import retry_on_lock
+from .inventory import schedule_changed
+from .models import Appointment, Master, Service
+from .rollups import refresh_rollups
+from .scheduler_sync import sync_created_appointments
+from .staff_grid import invalidate_grid_day
+
+# Batch booking for receptionists: many (master, service, date, time) rows are checked against
+# the availability in one pass and inserted with one bulk_create. The busy intervals of all the
+# master-days in the batch are loaded at once; every accepted row is added to them in memory,
+# so the rows of the same batch are checked against each other as well.
+
+ACCEPTED = 'accepted'
+REJECTED = 'rejected'
+
+
+def _parse(value, parser, kind):
+    if isinstance(value, kind):
+        return value
+    parsed = parser(str(value).strip()) if value not in (None, '') else None
+    if parsed is None:
+        raise ValueError
+    return parsed
+
+
+def _to_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rejected(number, error):
+    return {'row': number, 'status': REJECTED, 'error': error}
+
+
+# Books the rows in one transaction and returns the report: one dict per row with
+# the row number, the status (accepted or rejected) and the appointment id or the error.
+# A row is a dict with master and service (ids), date (YYYY-MM-DD) and time (HH:MM).
+def book_batch(rows):
+    report, appointments = retry_on_lock(_book_batch, list(rows))
+    days = {(appointment.master_id, appointment.date) for appointment in appointments}
+    for master_id, date in sorted(days):
+        schedule_changed(master_id, date)
+    refresh_rollups(days)
+    for date in {date for _, date in days}:
+        invalidate_grid_day(date)
+    if appointments:
+        sync_created_appointments(appointments)
+    return report
+
+
+def _book_batch(rows):
+    master_ids = {_to_id(row.get('master')) for row in rows} - {None}
+    service_ids = {_to_id(row.get('service')) for row in rows} - {None}
+    services = Service.objects.active().in_bulk(service_ids)
+    now = timezone.now()
+
+    parsed = []
+    report = [None] * len(rows)
+    for index, row in enumerate(rows):
+        number = index + 1
+        master_id, service_id = _to_id(row.get('master')), _to_id(row.get('service'))
+        try:
+            date = _parse(row.get('date'), parse_date, date_type)
+            start_time = _parse(row.get('time'), parse_time, time_type)
+        except ValueError:
+            report[index] = _rejected(number, 'Некорректная дата или время.')
+            continue
+        if has_started(date, start_time, now):
+            report[index] = _rejected(number, 'Это время уже прошло.')
+            continue
+        if not in_horizon(date):
+            report[index] = _rejected(number, 'На эту дату запись ещё не открыта.')
+            continue
+        parsed.append((index, master_id, service_id, date, start_time))
+
+    with transaction.atomic():
+        # the masters are locked, so nobody books them between the check and the insert
+        masters = Master.objects.active().select_for_update().in_bulk(master_ids)
+        provided = set(
+            Master.services.through.objects
+            .filter(master_id__in=masters, service_id__in=services)
+            .values_list('master_id', 'service_id')
+        )
+        master_days = {(master_id, date) for _, master_id, _, date, _ in parsed if master_id in masters}
+        # the Availability rows are given per service, so the working hours of such days depend on the row
+        rows = load_availability(master_days)
+        days = load_day_intervals(master_days, availability=rows)
+        free_days = {}
+        appointments = []
+        for index, master_id, service_id, date, start_time in parsed:
+            number = index + 1
+            if master_id not in masters:
+                report[index] = _rejected(number, 'Мастер не найден.')
+                continue
+            if service_id not in services:
+                report[index] = _rejected(number, 'Услуга не найдена.')
+                continue
+            if (master_id, service_id) not in provided:
+                report[index] = _rejected(number, 'Мастер не оказывает эту услугу.')
+                continue
+            service = services[service_id]
+            start, duration = to_minutes(start_time), service_minutes(service)
+            key = (master_id, date)
+            day_free = free_days.setdefault(key, {})
+            if service_id not in day_free:
+                working, busy = days[key]
+                if key in rows:
+                    working = availability_hours(rows[key], service)
+                day_free[service_id] = FreeDay(subtract_intervals(working, busy))
+            if not day_free[service_id].fits(start, duration):
+                report[index] = _rejected(number, 'Это время недоступно для выбранной услуги.')
+                continue
+            # the accepted row makes its time busy for the next rows of the batch
+            days[key][1].append((start, start + duration))
+            del free_days[key]
+            begin, end = appointment_bounds(date, start_time, service)
+            appointments.append(Appointment(
+                master=masters[master_id], service=service, date=date, time=start_time, start=begin, end=end,
+            ))
+            report[index] = {'row': number, 'status': ACCEPTED}
+        Appointment.objects.bulk_create(appointments)
+
+    accepted = iter(appointments)
+    for line in report:
+        if line['status'] == ACCEPTED:
+            line['appointment'] = next(accepted).pk
+    return report, appointments
@@ -0,0 +1,95 @@
+import hashlib
+from datetime import datetime, time, timezone as dt_timezone
+
+from django.db.models import Q
+from django.utils import timezone
+from icalendar import Calendar, Event
+
+from .archive import history, history_querysets
+from .models import Master
+
+# The iCalendar feed of a master: one VEVENT per appointment, the archived ones included. The feed is
+# streamed, the events are read with .iterator() in chunks (one UNION ALL query over the appointments
+# and the archive) and serialized one by one, so the memory used does not depend on the length of the history.
+
+FEED_CHUNK_SIZE = 500
+
+FEED_FIELDS = ('id', 'start', 'end', 'service__name')
+
+
+# Returns the (ETag, Last-Modified) of the feed of the master for the range. Both follow
+# Master.schedule_changed_at (the ETag the name of the master too), so an unchanged feed is answered
+# after one query without a row scan. A changed service bumps schedule_changed_at, see touch_service_feeds.
+# With a token the version is only found for the master with that calendar token: (None, None) otherwise.
+def feed_version(master_id, start=None, end=None, token=None):
+    masters = Master.objects.filter(pk=master_id)
+    if token is not None:
+        masters = masters.filter(calendar_token=token)
+    row = masters.values_list('schedule_changed_at', 'name').first()
+    if row is None and token is not None:
+        return None, None
+    changed_at, name = row or (None, None)
+    digest = hashlib.md5(f'{master_id}:{start}:{end}:{changed_at}:{name}'.encode()).hexdigest()
+    return f'"{digest}"', changed_at
+
+
+# Marks the feeds of the masters with appointments (current or archived) of the service as changed,
+# e.g. after the service was renamed.
+def touch_service_feeds(service_id):
+    hot, archived = (queryset.values('master_id') for queryset in history_querysets(service_id=service_id))
+    Master.objects.filter(Q(pk__in=hot) | Q(pk__in=archived)).update(schedule_changed_at=timezone.now())
+
+
+def _utc(moment):
+    return moment.astimezone(dt_timezone.utc)
+
+
+def _header(master):
+    calendar = Calendar()
+    calendar.add('prodid', '-//Mysite//Appointments//RU')
+    calendar.add('version', '2.0')
+    calendar.add('calscale', 'GREGORIAN')
+    calendar.add('x-wr-calname', f'Записи: {master.name}')
+    lines = calendar.to_ical()
+    return lines[:lines.rindex(b'END:VCALENDAR')]
+
+
+def _event(row, stamp, domain):
+    pk, start, end, service = row
+    event = Event()
+    event.add('uid', f'appointment-{pk}@{domain}')
+    event.add('dtstamp', stamp)
+    event.add('dtstart', _utc(start))
+    event.add('dtend', _utc(end))
+    event.add('summary', service)
+    return event.to_ical()
+
+
+# Returns the filters of the appointments from start_date to end_date inclusive; either may be None.
+# Raises ValueError for a date whose start or end of day is out of the datetime range.
+def feed_filters(master, start_date=None, end_date=None):
+    filters = {'master': master}
+    try:
+        if start_date:
+            filters['start__gte'] = _utc(timezone.make_aware(datetime.combine(start_date, time.min)))
+        if end_date:
+            filters['start__lte'] = _utc(timezone.make_aware(datetime.combine(end_date, time.max)))
+    except OverflowError:
+        raise ValueError('The date is out of range')
+    return filters
+
+
+# Returns the feed of the master as an iterator of chunks of bytes. start_date and end_date limit
+# the appointments to the dates from start_date to end_date inclusive; either may be None.
+# The dates are checked before the iterator is returned, so a wrong one never breaks a started stream.
+def iter_feed(master, start_date=None, end_date=None, domain='localhost'):
+    rows = history(FEED_FIELDS, ordering=('start', 'id'), **feed_filters(master, start_date, end_date))
+    stamp = _utc(master.schedule_changed_at or timezone.now())
+    return _chunks(master, rows, stamp, domain)
+
+
+def _chunks(master, rows, stamp, domain):
+    yield _header(master)
+    for row in rows.iterator(chunk_size=FEED_CHUNK_SIZE):
+        yield _event(row, stamp, domain)
+    yield b'END:VCALENDAR\r\n'
@@ -0,0 +1,230 @@
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+from django.utils import timezone
+
+from .archive import history_querysets
+from .availability import default_working_intervals, occupancy_percent, service_minutes, total_minutes
+from .models import Master, Service
+from .working_hours import compiled_working_hours
+
+# Capacity planning: a Monte Carlo simulation of the weekly bookings with a roster of masters and
+# their working hours. The demand is the mean number of bookings per week of every service, weekday and
+# hour over the last weeks of history (both the appointments and the archive), aggregated by the database
+# into a NumPy array [service, weekday, hour]. Every simulated week draws Poisson arrivals from it and
+# gives them, hour by hour, to the masters providing the service: a master takes a client when they are
+# free within the hour and the whole service fits into their working interval. A client who finds
+# nobody in the hour they wanted is lost. All the simulated weeks are computed at once, as arrays
+# [week, weekday]; the Python loops only run over the hours, the services and the masters.
+#
+# The history holds the served bookings only, so it is a lower bound of the demand of busy hours;
+# `growth` scales it to test the roster against more clients.
+
+DEFAULT_SIMULATIONS = 2000
+DEFAULT_HISTORY_WEEKS = 12
+
+DAYS = 7
+HOURS = 24
+# the open minute of an hour in which the master does not work: after the end of any day
+NOT_WORKING = 2 * HOURS * 60
+
+
+# A master of a roster: the services they provide and their working intervals of every weekday.
+class PlannedMaster:
+
+    def __init__(self, name, service_ids, week, pk=None):
+        self.pk = pk
+        self.name = name
+        self.service_ids = frozenset(service_ids)
+        self.week = week
+
+    @property
+    def available_minutes(self):
+        return sum(total_minutes(intervals) for intervals in self.week)
+
+
+# The dates of the history: the `weeks` (APPOINTMENTS_CAPACITY_HISTORY_WEEKS) whole weeks before today.
+def history_window(weeks=None, today=None):
+    if weeks is None:
+        weeks = getattr(settings, 'APPOINTMENTS_CAPACITY_HISTORY_WEEKS', DEFAULT_HISTORY_WEEKS)
+    today = today or timezone.localdate()
+    return today - timedelta(weeks=weeks), today - timedelta(days=1)
+
+
+# Returns the mean bookings per week as an array [service, weekday, hour] in the order of `services`.
+# Each table is aggregated by the database and the counts are added up here.
+def load_demand(services, start_date, end_date):
+    index = {service.pk: position for position, service in enumerate(services)}
+    counts = np.zeros((len(services), DAYS, HOURS))
+    for queryset in history_querysets(service_id__in=list(index), date__range=(start_date, end_date)):
+        rows = (
+            queryset
+            .annotate(weekday=ExtractIsoWeekDay('date'), hour=ExtractHour('time'))
+            .values_list('service_id', 'weekday', 'hour')
+            .annotate(bookings=Count('pk'))
+            .order_by()
+        )
+        for service_id, weekday, hour, bookings in rows:
+            counts[index[service_id], weekday - 1, hour] += bookings
+    weeks = ((end_date - start_date).days + 1) / DAYS
+    return counts / weeks
+
+
+# The active masters with their active services and the working hours of their weekly template
+# (the default working day when they have none). One-off changes (Availability rows, exceptions) are left out.
+def current_roster(services):
+    service_ids = {service.pk for service in services}
+    provided = {}
+    for master_id, service_id in Master.services.through.objects.filter(
+            master__is_active=True, service_id__in=service_ids).values_list('master_id', 'service_id'):
+        provided.setdefault(master_id, set()).add(service_id)
+    default = default_working_intervals()
+    roster = []
+    for master_id, name, availability in Master.objects.active().order_by('name', 'pk').values_list(
+            'pk', 'name', 'availability'):
+        template = compiled_working_hours(availability)
+        week = [list(template.weekly[day]) if template else list(default) for day in range(DAYS)]
+        roster.append(PlannedMaster(name, provided.get(master_id, ()), week, master_id))
+    return roster
+
+
+# Changes the roster: the masters with the ids in `without` leave, a new master providing the services
+# is added for every set of service ids in `extra`, and with `hours` = (start_hour, end_hour) every
+# working day (of every new master too) lasts from start_hour to end_hour; the days off stay off.
+def plan_roster(roster, without=(), extra=(), hours=None):
+    without = set(without)
+    planned = [master for master in roster if master.pk not in without]
+    for number, service_ids in enumerate(extra, start=1):
+        planned.append(PlannedMaster(f'Новый мастер {number}', service_ids, [default_working_intervals()] * DAYS))
+    if hours is not None:
+        start_hour, end_hour = hours
+        if not 0 <= start_hour < end_hour <= HOURS:
+            raise ValueError('Часы работы должны быть в пределах суток, начало раньше конца.')
+        day = default_working_intervals(start_hour, end_hour)
+        planned = [
+            PlannedMaster(
+                master.name, master.service_ids, [list(day) if intervals else [] for intervals in master.week],
+                master.pk,
+            )
+            for master in planned
+        ]
+    return planned
+
+
+# The roster as arrays: capable[master, service], and for every master, weekday and hour the first
+# working minute of the hour (NOT_WORKING when the master does not work then) and the end of
+# the working interval it belongs to.
+def roster_arrays(roster, services):
+    capable = np.array(
+        [[service.pk in master.service_ids for service in services] for master in roster], dtype=bool,
+    ).reshape(len(roster), len(services))
+    open_from = np.full((len(roster), DAYS, HOURS), NOT_WORKING, dtype=np.int64)
+    run_end = np.zeros((len(roster), DAYS, HOURS), dtype=np.int64)
+    for m, master in enumerate(roster):
+        for day, intervals in enumerate(master.week):
+            for start, end in intervals:
+                for hour in range(start // 60, (end - 1) // 60 + 1):
+                    if open_from[m, day, hour] == NOT_WORKING:
+                        open_from[m, day, hour] = max(start, hour * 60)
+                        run_end[m, day, hour] = end
+    return capable, open_from, run_end
+
+
+# Simulates the weeks with the roster. Returns the arrays served[week, service], lost[week, service]
+# and booked[week, master] (the booked minutes). The same seed draws the same clients for any roster,
+# so two rosters simulated with one seed are compared on the same weeks.
+def simulate(demand, durations, roster, services, simulations=DEFAULT_SIMULATIONS, seed=None, growth=1.0):
+    rng = np.random.default_rng(seed)
+    capable, open_from, run_end = roster_arrays(roster, services)
+    # the specialists are asked first, so the masters with more services stay free for the others
+    order = sorted(range(len(roster)), key=lambda m: capable[m].sum())
+    free_at = np.zeros((simulations, len(roster), DAYS), dtype=np.int64)
+    served = np.zeros((simulations, len(services)), dtype=np.int64)
+    lost = np.zeros((simulations, len(services)), dtype=np.int64)
+    booked = np.zeros((simulations, len(roster)), dtype=np.int64)
+    for hour in np.flatnonzero(demand.sum(axis=(0, 1))):
+        arrivals = rng.poisson(demand[:, :, hour] * growth, size=(simulations, len(services), DAYS))
+        hour_end = (hour + 1) * 60
+        for s in rng.permutation(len(services)):
+            left = arrivals[:, s, :]
+            duration = durations[s]
+            for m in order:
+                if not capable[m, s] or not left.any():
+                    continue
+                start = np.maximum(free_at[:, m, :], open_from[m, :, hour])
+                # the clients the master can start within the hour and finish before the end of the interval
+                in_hour = np.where(start < hour_end, (hour_end - 1 - start) // duration + 1, 0)
+                in_interval = np.maximum((run_end[m, :, hour] - start) // duration, 0)
+                taken = np.minimum(left, np.minimum(in_hour, in_interval))
+                free_at[:, m, :] = np.where(taken > 0, start + taken * duration, free_at[:, m, :])
+                booked[:, m] += (taken * duration).sum(axis=1)
+                served[:, s] += taken.sum(axis=1)
+                left = left - taken
+            lost[:, s] += left.sum(axis=1)
+    return served, lost, booked
+
+
+# The mean, the 10th and the 90th percentile of the weekly values.
+def _spread(values):
+    if not len(values):
+        return {'mean': 0, 'low': 0, 'high': 0}
+    low, high = np.percentile(values, [10, 90])
+    return {'mean': round(float(values.mean()), 1), 'low': round(float(low), 1), 'high': round(float(high), 1)}
+
+
+# The report of a simulated roster: the weekly bookings, lost bookings, revenue and utilization
+# (the mean and the 10-90 percentile range), and the means of every master and service.
+def summarize(roster, services, prices, served, lost, booked):
+    available = np.array([master.available_minutes for master in roster], dtype=np.int64)
+    weekly_booked = booked.sum(axis=1)
+    utilization = weekly_booked * 100 / available.sum() if available.sum() else np.zeros(len(weekly_booked))
+    weekly_served, weekly_lost = served.sum(axis=1), lost.sum(axis=1)
+    demand = weekly_served.mean() + weekly_lost.mean() if len(weekly_served) else 0
+    return {
+        'masters_count': len(roster),
+        'available_minutes': int(available.sum()),
+        'served': _spread(weekly_served),
+        'lost': _spread(weekly_lost),
+        'lost_percent': round(weekly_lost.mean() * 100 / demand) if demand else 0,
+        'revenue': _spread(served @ prices),
+        'lost_revenue': _spread(lost @ prices),
+        'utilization': _spread(utilization),
+        'masters': [
+            {'name': master.name, 'available_minutes': int(available[m]),
+             'utilization': occupancy_percent(booked[:, m].mean(), available[m])}
+            for m, master in enumerate(roster)
+        ],
+        'services': [
+            {'name': service.name, 'served': round(float(served[:, s].mean()), 1),
+             'lost': round(float(lost[:, s].mean()), 1), 'revenue': round(float(served[:, s].mean() * prices[s]))}
+            for s, service in enumerate(services)
+        ],
+    }
+
+
+# Simulates the current roster and the planned one (see plan_roster) on the same weeks drawn from
+# the demand of the history and returns both reports.
+def capacity_plan(simulations=DEFAULT_SIMULATIONS, history_weeks=None, growth=1.0, without=(), extra=(),
+                  hours=None, seed=None, today=None):
+    services = list(Service.objects.active().order_by('pk'))
+    start_date, end_date = history_window(history_weeks, today)
+    demand = load_demand(services, start_date, end_date)
+    durations = np.array([service_minutes(service) for service in services], dtype=np.int64)
+    prices = np.array([service.price for service in services], dtype=np.int64)
+    roster = current_roster(services)
+    planned = plan_roster(roster, without, extra, hours)
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 32)
+    reports = {}
+    for name, masters in (('current', roster), ('planned', planned)):
+        results = simulate(demand, durations, masters, services, simulations, seed, growth)
+        reports[name] = summarize(masters, services, prices, *results)
+    return {
+        'start': start_date, 'end': end_date, 'weeks': ((end_date - start_date).days + 1) // DAYS,
+        'simulations': simulations, 'seed': seed, 'growth': growth,
+        'demand': round(float(demand.sum()) * growth, 1),
+        **reports,
+    }
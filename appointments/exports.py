@@ -0,0 +1,202 @@
+import csv
+import zipfile
+from datetime import date as date_type
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+
+from .archive import history
+
+# Export of the appointments for accounting, as CSV or XLSX. Both formats are generated row by row
+# from a .iterator() over one joined query (a UNION ALL with the archive) and streamed to the client,
+# so the memory used does not depend on the length of the range: the CSV rows are written one at a time,
+# and the XLSX workbook is a zip archive written to an unseekable stream and handed out as soon as
+# the compressor emits it.
+
+EXPORT_CHUNK_SIZE = 2000
+
+COLUMNS = ['Номер', 'Дата', 'Время', 'Мастер', 'Услуга', 'Цена', 'Длительность, мин', 'Клиент']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+EXPORT_FIELDS = ('pk', 'date', 'time', 'master__name', 'service__name', 'service__price', 'service__duration',
+                 'client__email')
+
+
+# The export rows of a queryset of appointments (or archived appointments), in the order of their dates.
+def export_values(queryset):
+    return queryset.order_by('date', 'time', 'pk').values_list(*EXPORT_FIELDS)
+
+
+# Returns the rows of the export: the appointments joined with the master, the service and the client.
+# `rows` is a values_list of EXPORT_FIELDS, by default all the appointments including the archive.
+def export_rows(rows=None):
+    if rows is None:
+        rows = history(EXPORT_FIELDS)
+    for pk, date, time, master, service, price, duration, client in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        minutes = int(duration.total_seconds() // 60) if duration else 0
+        yield pk, date, time, master, service, price, minutes, client or ''
+
+
+# csv.writer needs a file; this one hands back every written line instead of keeping it.
+class _Echo:
+
+    def write(self, value):
+        return value
+
+
+# The first characters that make a spreadsheet read a cell as a formula.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+# Prefixes a text cell that would start a formula with an apostrophe, so the names and the emails
+# are shown as text when the file is opened in Excel.
+def _csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(rows=None):
+    writer = csv.writer(_Echo())
+    # the BOM makes Excel read the file as UTF-8
+    yield '\ufeff' + writer.writerow(COLUMNS)
+    for row in export_rows(rows):
+        yield writer.writerow([_csv_cell(value) for value in row])
+
+
+# A write-only file for zipfile that collects the written bytes until they are taken.
+# It has no tell/seek, so zipfile writes the archive sequentially with data descriptors.
+class _Stream:
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Записи" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # style 1 is a date (built-in format 14), style 2 is a time (built-in format 20)
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="20" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+SHEET_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+SHEET_FOOTER = '</sheetData></worksheet>'
+
+# the day before the zero serial of the 1900 date system of spreadsheets
+SERIAL_EPOCH = date_type(1899, 12, 30)
+
+
+def _string(value):
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_row(number, row):
+    pk, date, time, master, service, price, minutes, client = row
+    day = (date - SERIAL_EPOCH).days
+    fraction = (time.hour * 3600 + time.minute * 60 + time.second) / 86400
+    return (
+        f'<row r="{number}"><c><v>{pk}</v></c><c s="1"><v>{day}</v></c><c s="2"><v>{fraction}</v></c>'
+        f'{_string(master)}{_string(service)}<c><v>{price}</v></c><c><v>{minutes}</v></c>{_string(client)}</row>'
+    )
+
+
+def iter_xlsx(rows=None):
+    stream = _Stream()
+    workbook = zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED)
+    for name, content in XLSX_PARTS.items():
+        workbook.writestr(name, content)
+    with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+        sheet.write((SHEET_HEADER + '<row r="1">' + ''.join(map(_string, COLUMNS)) + '</row>').encode())
+        for number, row in enumerate(export_rows(rows), start=2):
+            sheet.write(_xlsx_row(number, row).encode())
+            if number % EXPORT_CHUNK_SIZE == 0:
+                yield stream.take()
+        sheet.write(SHEET_FOOTER.encode())
+    workbook.close()
+    yield stream.take()
+
+
+EXPORTERS = {'csv': iter_csv, 'xlsx': iter_xlsx}
+
+
+def export_filename(export_format, start_date=None, end_date=None):
+    parts = ['appointments'] + [str(value) for value in (start_date, end_date) if value]
+    return '-'.join(parts) + '.' + export_format
+
+
+# The streaming response with the export of the rows (see export_rows) in the format (csv or xlsx).
+def export_response(rows, export_format='csv', start_date=None, end_date=None):
+    response = StreamingHttpResponse(EXPORTERS[export_format](rows), content_type=CONTENT_TYPES[export_format])
+    filename = export_filename(export_format, start_date, end_date)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -1,5 +1,7 @@
 from django import forms
+from .availability import is_bookable, slot_times
 from .models import Master, Appointment, Service
+from .working_hours import parse_working_hours
 from django.forms import TimeField
 
 # Time selection field for the appointment form.
@@ -18,10 +20,116 @@ class AppointmentForm(forms.ModelForm):
         model = Appointment
         fields = ['service', 'master', 'date', 'time']
         widgets = {
-            'date': forms.DateInput(attrs={'type': 'date'}),
+            'date': forms.DateInput(attrs={'type': 'date'}, format='%Y-%m-%d'),
             'time': forms.TimeInput(attrs={'type': 'time'}),
         }
 
+    # hold_token is the slot hold of the client, which does not make the slot unavailable for them.
+    # The deleted masters and services cannot be booked.
+    def __init__(self, *args, hold_token=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hold_token = hold_token
+        self.fields['service'].queryset = Service.objects.active()
+        self.fields['master'].queryset = Master.objects.active()
+
+    # The clean method checks that the whole service fits into the free time of the master
+    # starting at the selected time.
+    def clean(self):
+        cleaned_data = super().clean()
+        master = cleaned_data.get('master')
+        service = cleaned_data.get('service')
+        date = cleaned_data.get('date')
+        time = cleaned_data.get('time')
+        if master and service and date and time and not is_bookable(
+                master, service, date, time, ignore_hold=self.hold_token):
+            raise forms.ValidationError('Это время недоступно для выбранной услуги.')
+        return cleaned_data
+
+# A form to book a service with any available master: the client picks only the date and time.
+class AnyMasterBookingForm(forms.Form):
+    date = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
+    time = TimeSelectField(choices=[])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        choices = [(str(slot), slot.strftime('%H:%M')) for slot in slot_times()]
+        self.fields['time'].widget = forms.Select(choices=choices)
+
+# One row of the bulk booking screen for receptionists. Empty rows are skipped.
+class BulkBookingRowForm(forms.Form):
+    master = forms.ModelChoiceField(queryset=Master.objects.active().order_by('name'), required=False)
+    service = forms.ModelChoiceField(queryset=Service.objects.active().order_by('name'), required=False)
+    date = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}, format='%Y-%m-%d'))
+    time = TimeSelectField(choices=[], required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        choices = [('', '---')] + [(str(slot), slot.strftime('%H:%M')) for slot in slot_times()]
+        self.fields['time'].widget = forms.Select(choices=choices)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        values = [cleaned_data.get(name) for name in ('master', 'service', 'date', 'time')]
+        if any(values) and not all(values):
+            raise forms.ValidationError('Заполните мастера, услугу, дату и время.')
+        return cleaned_data
+
+    # The row in the format of appointments.bulk_booking.book_batch, or None for an empty row.
+    def booking_row(self):
+        if not self.cleaned_data.get('master'):
+            return None
+        return {
+            'master': self.cleaned_data['master'].pk,
+            'service': self.cleaned_data['service'].pk,
+            'date': self.cleaned_data['date'],
+            'time': self.cleaned_data['time'],
+        }
+
+
+BulkBookingFormSet = forms.formset_factory(BulkBookingRowForm, extra=10)
+
+
+# The parameters of the capacity simulation on the staff page: the masters who leave, the new masters
+# (all providing the same services) and the working hours of the planned roster. Without weeks the demand
+# is taken from the default history (APPOINTMENTS_CAPACITY_HISTORY_WEEKS). The form does not import
+# appointments.capacity, so NumPy is loaded only by the capacity page.
+class CapacityPlanForm(forms.Form):
+    simulations = forms.IntegerField(min_value=100, max_value=5000, initial=2000)
+    weeks = forms.IntegerField(min_value=1, max_value=104, required=False)
+    growth = forms.FloatField(min_value=0.1, max_value=10, initial=1.0)
+    without = forms.ModelMultipleChoiceField(queryset=Master.objects.active().order_by('name'), required=False)
+    new_masters = forms.IntegerField(min_value=0, max_value=10, initial=0)
+    new_services = forms.ModelMultipleChoiceField(queryset=Service.objects.active().order_by('name'), required=False)
+    start_hour = forms.IntegerField(min_value=0, max_value=23, required=False)
+    end_hour = forms.IntegerField(min_value=1, max_value=24, required=False)
+    seed = forms.IntegerField(min_value=0, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('new_masters') and not cleaned_data.get('new_services'):
+            raise forms.ValidationError('Выберите услуги новых мастеров.')
+        start_hour, end_hour = cleaned_data.get('start_hour'), cleaned_data.get('end_hour')
+        if (start_hour is None) != (end_hour is None):
+            raise forms.ValidationError('Укажите начало и конец рабочего дня.')
+        if start_hour is not None and start_hour >= end_hour:
+            raise forms.ValidationError('Начало рабочего дня должно быть раньше конца.')
+        return cleaned_data
+
+    # The keyword arguments of appointments.capacity.capacity_plan.
+    def plan_kwargs(self):
+        data = self.cleaned_data
+        services = {service.pk for service in data['new_services']}
+        return {
+            'simulations': data['simulations'],
+            'history_weeks': data['weeks'],
+            'growth': data['growth'],
+            'without': [master.pk for master in data['without']],
+            'extra': [services] * data['new_masters'],
+            'hours': (data['start_hour'], data['end_hour']) if data['start_hour'] is not None else None,
+            'seed': data['seed'],
+        }
+
+
 # Form to create a master.
 class MasterForm(forms.ModelForm):
     pass
@@ -29,6 +137,23 @@ class MasterForm(forms.ModelForm):
     class Meta:
         model = Master
         fields = ['name', 'photo', 'description', 'services', 'availability']
+        help_texts = {
+            'availability': 'График работы, например: {"weekly": {"mon": [["09:00", "19:00"]]}, '
+                            '"exceptions": {"2023-05-01": []}}. Пустое значение - стандартный график.',
+        }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['services'].queryset = Service.objects.active()
+
+    # The clean_availability method checks the weekly working hours template.
+    def clean_availability(self):
+        availability = self.cleaned_data.get('availability')
+        try:
+            parse_working_hours(availability)
+        except ValueError as error:
+            raise forms.ValidationError(str(error))
+        return availability or {}
 
 # Form to create a sevice.
 class ServiceForm(forms.ModelForm):
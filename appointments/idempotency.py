@@ -0,0 +1,127 @@
+import hashlib
+import json
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.http import HttpResponse
+from django.utils import timezone
+
+from .availability import get_setting
+from .models import IdempotencyKey
+
+# The key lives for a day by default (APPOINTMENTS_IDEMPOTENCY_TTL in seconds).
+DEFAULT_IDEMPOTENCY_TTL = 24 * 60 * 60
+
+# Only final outcomes are remembered: a successful redirect or a "slot taken" page.
+# A form with errors is not stored, so the client can correct it and submit again.
+REMEMBERED_STATUSES = {201, 301, 302, 303, 409}
+
+
+def idempotency_ttl():
+    return timedelta(seconds=get_setting('APPOINTMENTS_IDEMPOTENCY_TTL', DEFAULT_IDEMPOTENCY_TTL))
+
+
+# Returns the key sent by the client (the Idempotency-Key header or the idempotency_key form field)
+# scoped to the URL, or None.
+def request_key(request):
+    key = request.headers.get('Idempotency-Key') or request.POST.get('idempotency_key')
+    if not key:
+        return None
+    return hashlib.sha256(f'{request.path}:{key}'.encode()).hexdigest()
+
+
+# The form fields that change between two submissions of the same booking.
+IGNORED_FIELDS = {'csrfmiddlewaretoken', 'idempotency_key'}
+
+
+# Returns the hash of what the request asks for: the form fields (without the CSRF token and the key)
+# or the raw body of other requests. A retry must send the same, otherwise the key is reused for another booking.
+def request_hash(request):
+    if request.content_type in ('application/x-www-form-urlencoded', 'multipart/form-data'):
+        fields = sorted(
+            (name, value)
+            for name, values in request.POST.lists() if name not in IGNORED_FIELDS
+            for value in values
+        )
+        body = json.dumps(fields).encode()
+    else:
+        body = request.body
+    return hashlib.sha256(body).hexdigest()
+
+
+# The answer to a request that reuses a key with other data: nothing is replayed or booked.
+def mismatch_response():
+    return HttpResponse('Ключ идемпотентности уже использован для другого запроса.', status=422)
+
+
+# The answer to a retry that arrives while the first request is still being processed.
+def in_progress_response():
+    response = HttpResponse('Запрос уже обрабатывается.', status=409)
+    response['Retry-After'] = '1'
+    return response
+
+
+# Deletes the expired keys with one query and returns their number.
+def purge_expired_keys(now=None):
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
+
+
+# IdempotentPostMixin makes the POST of a view idempotent: the first request with a key
+# is processed and its response is stored, a retry with the same key and the same data gets the stored response
+# back after one key lookup, without validating the form or touching the booking tables again.
+# A request that reuses the key with other data is refused with 422.
+# The views also get a fresh `idempotency_key` in the context for the hidden form field.
+class IdempotentPostMixin:
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['idempotency_key'] = uuid.uuid4().hex
+        return context
+
+    def dispatch(self, request, *args, **kwargs):
+        key = request_key(request) if request.method == 'POST' else None
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        now = timezone.now()
+        body_hash = request_hash(request)
+        stored = IdempotencyKey.objects.filter(key=key, expires_at__gt=now).first()
+        if stored is not None:
+            if stored.request_hash != body_hash:
+                return mismatch_response()
+            return self.replay(stored)
+        IdempotencyKey.objects.filter(key=key).delete()
+        try:
+            stored = IdempotencyKey.objects.create(key=key, request_hash=body_hash, expires_at=now + idempotency_ttl())
+        except IntegrityError:
+            # the same request is being processed right now
+            return in_progress_response()
+
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except Exception:
+            stored.delete()
+            raise
+        if response.status_code in REMEMBERED_STATUSES:
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            stored.status_code = response.status_code
+            stored.content_type = response.get('Content-Type', '')
+            stored.location = response.get('Location', '')
+            stored.content = response.content.decode(response.charset)
+            stored.save(update_fields=['status_code', 'content_type', 'location', 'content'])
+        else:
+            stored.delete()
+        return response
+
+    @staticmethod
+    def replay(stored):
+        if stored.status_code is None:
+            return in_progress_response()
+        response = HttpResponse(stored.content, status=stored.status_code, content_type=stored.content_type)
+        if stored.location:
+            response['Location'] = stored.location
+        response['Idempotent-Replayed'] = 'true'
+        return response
@@ -0,0 +1,242 @@
+import csv
+import io
+import json
+import os
+from datetime import date as date_type, datetime, time as time_type, timezone as dt_timezone
+
+from django.db import transaction
+from django.utils import timezone
+
+from .inventory import invalidate_masters
+from .models import Availability, Master, Service
+from .rollups import refresh_rollups
+
+# Bulk import of master schedules. A schedule file is a list of working intervals, one per row:
+#
+#   JSON:  [{"master": 1, "service": "Маникюр", "date": "2023-04-10", "start_time": "09:00", "end_time": "13:00"}, ...]
+#          or one such object per line (JSON Lines)
+#   CSV:   master,service,date,start_time,end_time
+#   iCal:  one VEVENT per interval, SUMMARY is the service and X-MASTER the master
+#
+# The master and the service are given by id or by name. The master may be omitted when the file
+# belongs to one master (Master.schedule). The files are read in chunks and the rows are written
+# with batched bulk_create inside one transaction per file, so a file of any size needs little memory.
+
+IMPORT_BATCH_SIZE = 2000
+READ_CHUNK_SIZE = 64 * 1024
+FORMATS = {'.json': 'json', '.jsonl': 'json', '.csv': 'csv', '.ics': 'ical', '.ical': 'ical'}
+
+
+# Raised for a file that cannot be imported at all (unknown format, broken JSON).
+class ScheduleImportError(Exception):
+    pass
+
+
+# The result of importing one file: the number of created rows and the rejected rows
+# as (row number, message) pairs.
+class ImportResult:
+
+    def __init__(self, name):
+        self.name = name
+        self.created = 0
+        self.errors = []
+
+    def __str__(self):
+        return f'{self.name}: импортировано {self.created}, ошибок {len(self.errors)}'
+
+
+def detect_format(name):
+    extension = os.path.splitext(name or '')[1].lower()
+    if extension not in FORMATS:
+        raise ScheduleImportError(f'Неизвестный формат файла "{name}".')
+    return FORMATS[extension]
+
+
+# Yields the objects of a JSON array or of JSON Lines, decoding them one by one from chunks
+# of the file, so the whole document is never held in memory.
+def iter_json(text, chunk_size=READ_CHUNK_SIZE):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    number = 0
+    eof = False
+    while True:
+        # skip the whitespace, the commas between the objects and the brackets of the array
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[]':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                return
+            buffer, position = text.read(chunk_size), 0
+            eof = not buffer
+            continue
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            chunk = '' if eof else text.read(chunk_size)
+            if not chunk:
+                raise ScheduleImportError(f'Некорректный JSON после записи {number}.')
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        number += 1
+        position = end
+        yield number, value
+
+
+# Yields the rows of a CSV file with a header line.
+def iter_csv(text):
+    for number, row in enumerate(csv.DictReader(text), start=1):
+        yield number, row
+
+
+def _ical_datetime(value):
+    moment = datetime.strptime(value[:15], '%Y%m%dT%H%M%S')
+    if value.endswith('Z'):
+        moment = timezone.localtime(moment.replace(tzinfo=dt_timezone.utc))
+    return moment
+
+
+# Yields one row per VEVENT of an iCalendar file. The lines are unfolded and read one by one.
+def iter_ical(text):
+    number = 0
+    event = None
+    previous = None
+
+    def lines():
+        nonlocal previous
+        for line in text:
+            line = line.rstrip('\r\n')
+            if line[:1] in (' ', '\t') and previous is not None:
+                previous += line[1:]
+                continue
+            if previous is not None:
+                yield previous
+            previous = line
+        if previous is not None:
+            yield previous
+
+    for line in lines():
+        name, _, value = line.partition(':')
+        name = name.split(';')[0].upper()
+        if name == 'BEGIN' and value == 'VEVENT':
+            event = {}
+        elif name == 'END' and value == 'VEVENT' and event is not None:
+            number += 1
+            row = {'master': event.get('X-MASTER'), 'service': event.get('SUMMARY')}
+            try:
+                start, end = _ical_datetime(event['DTSTART']), _ical_datetime(event['DTEND'])
+                row.update(date=start.date(), start_time=start.time(), end_time=end.time())
+            except (KeyError, ValueError):
+                row['error'] = 'некорректные DTSTART/DTEND.'
+            yield number, row
+            event = None
+        elif event is not None:
+            event[name] = value.replace('\\,', ',').replace('\\;', ';')
+
+
+PARSERS = {'json': iter_json, 'csv': iter_csv, 'ical': iter_ical}
+
+
+# Resolves the masters and the services of the rows by id or by name with one query per table.
+class _Lookup:
+
+    def __init__(self):
+        self.masters = self._index(Master.objects.active().values_list('pk', 'name'))
+        self.services = self._index(Service.objects.active().values_list('pk', 'name'))
+        self.provided = set(Master.services.through.objects.values_list('master_id', 'service_id'))
+
+    @staticmethod
+    def _index(rows):
+        index = {}
+        for pk, name in rows:
+            index[str(pk)] = pk
+            index.setdefault(name, pk)
+        return index
+
+    @staticmethod
+    def find(index, value):
+        return index.get(str(value).strip()) if value not in (None, '') else None
+
+
+def _parse_date(value):
+    return value if isinstance(value, date_type) else date_type.fromisoformat(str(value).strip())
+
+
+def _parse_time(value):
+    return value if isinstance(value, time_type) else time_type.fromisoformat(str(value).strip())
+
+
+# Turns one parsed row into an unsaved Availability. Raises ValueError with the reason otherwise.
+def _availability(row, lookup, master_id):
+    if not isinstance(row, dict):
+        raise ValueError('ожидается объект.')
+    if row.get('error'):
+        raise ValueError(row['error'])
+    if row.get('master') not in (None, ''):
+        master_id = lookup.find(lookup.masters, row['master'])
+        if master_id is None:
+            raise ValueError(f'мастер "{row["master"]}" не найден.')
+    if master_id is None:
+        raise ValueError('не указан мастер.')
+    service_id = lookup.find(lookup.services, row.get('service'))
+    if service_id is None:
+        raise ValueError(f'услуга "{row.get("service")}" не найдена.')
+    if (master_id, service_id) not in lookup.provided:
+        raise ValueError('мастер не оказывает эту услугу.')
+    try:
+        date = _parse_date(row['date'])
+        start_time, end_time = _parse_time(row['start_time']), _parse_time(row['end_time'])
+    except KeyError as error:
+        raise ValueError(f'не указано поле {error}.')
+    except (TypeError, ValueError):
+        raise ValueError('некорректная дата или время.')
+    if start_time >= end_time:
+        raise ValueError('начало должно быть раньше конца.')
+    return Availability(
+        master_id=master_id, service_id=service_id, date=date, start_time=start_time, end_time=end_time,
+    )
+
+
+# Imports one schedule file (a binary file object) and returns the ImportResult.
+# The rows of the file are written in one transaction; rejected rows are reported and skipped.
+# `master` is the master of the rows that do not name one. The slot inventory of the imported
+# masters is invalidated afterwards and rebuilt on the next read, the rollups of the imported days are recomputed.
+def import_schedule_file(file, name=None, master=None, file_format=None, batch_size=IMPORT_BATCH_SIZE):
+    name = name or getattr(file, 'name', '')
+    parser = PARSERS[file_format or detect_format(name)]
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    result = ImportResult(name)
+    lookup = _Lookup()
+    default_master = master.pk if master is not None else None
+    masters = set()
+    days = set()
+    batch = []
+    try:
+        with transaction.atomic():
+            for number, row in parser(text):
+                try:
+                    availability = _availability(row, lookup, default_master)
+                except ValueError as error:
+                    result.errors.append((number, str(error)))
+                    continue
+                masters.add(availability.master_id)
+                days.add((availability.master_id, availability.date))
+                batch.append(availability)
+                if len(batch) >= batch_size:
+                    Availability.objects.bulk_create(batch)
+                    result.created += len(batch)
+                    batch = []
+            if batch:
+                Availability.objects.bulk_create(batch)
+                result.created += len(batch)
+            invalidate_masters(masters)
+            refresh_rollups(days)
+    finally:
+        text.detach()
+    return result
+
+
+# Imports a schedule file from disk.
+def import_schedule_path(path, master=None, file_format=None):
+    with open(path, 'rb') as file:
+        return import_schedule_file(file, name=path, master=master, file_format=file_format)
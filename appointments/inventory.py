@@ -0,0 +1,184 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .availability import (bookable_starts, horizon_dates, load_day_intervals, load_holds, merge_intervals,
+                           slot_step, slot_times, subtract_intervals, to_minutes)
+from .live import publish_slots
+from .models import Master, SlotInventory
+
+
+# The slot inventory is a materialized copy of the default schedule grid of every master
+# (one SlotInventory row per master, date and slot). It is filled lazily for the dates somebody
+# asks for, rebuilt for one master-day when an appointment, availability or slot hold of that day changes,
+# and extended every night by the extend_slot_inventory management command.
+
+
+# Computes the slot statuses of the given master-days from the working hours, the appointments
+# and the slot holds. A slot is free when it lies entirely in the free time of the master,
+# booked when it lies in the working hours but overlaps an appointment, held when it overlaps
+# only somebody's hold, and closed outside the working hours.
+# Returns ({(master_id, date): {time: status}}, {(master_id, date, time): held_until}).
+def _compute(master_days):
+    times = slot_times()
+    candidates = [to_minutes(slot) for slot in times]
+    step = to_minutes(slot_step())
+    holds = load_holds(master_days)
+    statuses = {}
+    held_until = {}
+    for key, (working, busy) in load_day_intervals(master_days, holds=False).items():
+        day_holds = holds.get(key, [])
+        open_slots = set(bookable_starts(merge_intervals(working), step, candidates))
+        unbooked_slots = set(bookable_starts(subtract_intervals(working, busy), step, candidates))
+        free_slots = unbooked_slots
+        if day_holds:
+            busy = busy + [(start, end) for start, end, _ in day_holds]
+            free_slots = set(bookable_starts(subtract_intervals(working, busy), step, candidates))
+        day = {}
+        for slot, minutes in zip(times, candidates):
+            if minutes in free_slots:
+                day[slot] = SlotInventory.FREE
+            elif minutes in unbooked_slots:
+                day[slot] = SlotInventory.HELD
+                held_until[key + (slot,)] = max(
+                    expires_at for start, end, expires_at in day_holds
+                    if start < minutes + step and minutes < end
+                )
+            elif minutes in open_slots:
+                day[slot] = SlotInventory.BOOKED
+            else:
+                day[slot] = SlotInventory.CLOSED
+        statuses[key] = day
+    return statuses, held_until
+
+
+def _inventory_rows(statuses, held_until):
+    return [
+        SlotInventory(
+            master_id=master_id, date=date, time=time, status=status,
+            held_until=held_until.get((master_id, date, time)),
+        )
+        for (master_id, date), day in statuses.items()
+        for time, status in day.items()
+    ]
+
+
+# Creates the inventory rows of the master-days that have not been materialized yet
+# and returns their statuses.
+def materialize(master_days):
+    statuses, held_until = _compute(master_days)
+    SlotInventory.objects.bulk_create(
+        _inventory_rows(statuses, held_until), batch_size=1000, ignore_conflicts=True,
+    )
+    return statuses
+
+
+# Rebuilds the inventory of one master-day. It is called from the Appointment signals,
+# so only the day touched by the booking is recomputed. Returns the slots that stopped
+# being free and the slots that became free.
+def refresh_day(master_id, date):
+    if date < timezone.localdate():
+        return set(), set()
+    statuses, held_until = _compute([(master_id, date)])
+    with transaction.atomic():
+        rows = SlotInventory.objects.filter(master_id=master_id, date=date)
+        previous = {slot for slot, status in rows.values_list('time', 'status') if status == SlotInventory.FREE}
+        rows.delete()
+        SlotInventory.objects.bulk_create(_inventory_rows(statuses, held_until), ignore_conflicts=True)
+    free = {slot for slot, status in statuses[(master_id, date)].items() if status == SlotInventory.FREE}
+    return previous - free, free - previous
+
+
+# Called whenever the schedule of a master-day changes: rebuilds the inventory of that day,
+# bumps Master.schedule_changed_at, which the availability endpoints use for ETags,
+# and pushes the taken and freed slots to the open booking pages once the transaction commits.
+def schedule_changed(master_id, date):
+    taken, freed = refresh_day(master_id, date)
+    Master.objects.filter(pk=master_id).update(schedule_changed_at=timezone.now())
+    if taken or freed:
+        transaction.on_commit(lambda: publish_slots(master_id, date, taken, freed))
+
+
+# Drops the future inventory of the masters after their working hours have been changed in bulk
+# (a new template or an imported schedule). The days are materialized again on the next read.
+def invalidate_masters(master_ids):
+    master_ids = list(master_ids)
+    if not master_ids:
+        return
+    SlotInventory.objects.filter(master_id__in=master_ids, date__gte=timezone.localdate()).delete()
+    Master.objects.filter(pk__in=master_ids).update(schedule_changed_at=timezone.now())
+
+
+# Returns {(master_id, date): {time: status}} for the masters and the dates with a single range read.
+# Held slots whose hold has expired are returned as free. The master-days that are not
+# in the inventory yet are materialized on the fly, so the dates must lie within the booking horizon:
+# ValueError is raised otherwise.
+def read_inventory_bulk(master_ids, dates):
+    now = timezone.now()
+    days = defaultdict(dict)
+    master_ids = list(master_ids)
+    if not dates or not master_ids:
+        return days
+    first, last = horizon_dates()
+    if dates[0] < first or dates[-1] > last:
+        raise ValueError(f'The slot inventory covers {first} - {last} only')
+    rows = (
+        SlotInventory.objects
+        .filter(master_id__in=master_ids, date__range=(dates[0], dates[-1]))
+        .order_by('date', 'time')
+        .values_list('master_id', 'date', 'time', 'status', 'held_until')
+    )
+    for master_id, date, time, status, held_until in rows:
+        if status == SlotInventory.HELD and held_until and held_until <= now:
+            status = SlotInventory.FREE
+        days[(master_id, date)][time] = status
+
+    missing = [
+        (master_id, date)
+        for master_id in master_ids
+        for date in dates
+        if (master_id, date) not in days
+    ]
+    days.update(materialize(missing))
+    return days
+
+
+# Returns {date: {time: status}} for one master and the dates with a single range read.
+def read_inventory(master, dates):
+    return {
+        date: day
+        for (_, date), day in read_inventory_bulk([master.pk], dates).items()
+    }
+
+
+# Makes sure that the inventory covers the next `days` days for every master
+# and removes the rows of the past days. Returns the number of materialized master-days.
+def extend_horizon(days):
+    today = timezone.localdate()
+    dates = [today + timedelta(days=i) for i in range(days)]
+    existing = set(
+        SlotInventory.objects
+        .filter(date__range=(dates[0], dates[-1]))
+        .values_list('master_id', 'date')
+        .distinct()
+    )
+    missing = [
+        (master_id, date)
+        for master_id in Master.objects.active().values_list('pk', flat=True)
+        for date in dates
+        if (master_id, date) not in existing
+    ]
+    materialize(missing)
+    SlotInventory.objects.filter(date__lt=today).delete()
+    return len(missing)
+
+
+# Frees the inventory slots of the expired holds with a single UPDATE, marks the schedules
+# of their masters as changed and returns the number of freed slots.
+def release_expired_slots(now=None):
+    now = now or timezone.now()
+    expired = SlotInventory.objects.filter(status=SlotInventory.HELD, held_until__lte=now)
+    Master.objects.filter(pk__in=expired.values('master_id')).update(schedule_changed_at=now)
+    return expired.update(status=SlotInventory.FREE, held_until=None)
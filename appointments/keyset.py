@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+
+# Keyset pagination over (start, pk): the next page continues after the last row of the previous one,
+# so a page costs one index range read on (client, start) however deep the client scrolls,
+# unlike OFFSET, which reads and skips all the earlier rows.
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+# The cursor is "<microseconds since the epoch>-<pk>" of the last row of a page.
+def encode_cursor(start, pk):
+    delta = start - EPOCH
+    return f'{(delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds}-{pk}'
+
+
+# Returns (start, pk) of the cursor, or None for a missing or broken cursor.
+def decode_cursor(value):
+    try:
+        microseconds, pk = value.split('-')
+        return EPOCH + timedelta(microseconds=int(microseconds)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def _after(queryset, position, descending):
+    if descending:
+        queryset = queryset.order_by('-start', '-pk')
+    else:
+        queryset = queryset.order_by('start', 'pk')
+    if position:
+        start, pk = position
+        if descending:
+            queryset = queryset.filter(Q(start__lt=start) | Q(start=start, pk__lt=pk))
+        else:
+            queryset = queryset.filter(Q(start__gt=start) | Q(start=start, pk__gt=pk))
+    return queryset
+
+
+# Returns the page of the queryset after the cursor as (rows, next cursor or None).
+# The rows are ordered by start and pk, newest first when `descending`. A list of querysets
+# (e.g. the appointments and the archive, whose ids do not overlap) is paged as one:
+# every queryset reads its own next page and the pages are merged.
+def keyset_page(queryset, cursor=None, descending=False, size=20):
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    position = decode_cursor(cursor) if cursor else None
+    rows = []
+    for part in querysets:
+        rows += _after(part, position, descending)[:size + 1]
+    if len(querysets) > 1:
+        rows.sort(key=lambda row: (row.start, row.pk), reverse=descending)
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, encode_cursor(rows[-1].start, rows[-1].pk)
+    return rows, None
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Live slot updates for the booking page. When the slots of a master-day change, the change
+# is published to the channel of the master and pushed to the open booking pages as server-sent
+# events. The events are served by live_events, a plain ASGI application mounted in mysite/asgi.py
+# next to Django: an idle connection is one coroutine waiting on a queue, so thousands of them
+# cost little and never hold a WSGI worker.
+#
+# The broker is pluggable (APPOINTMENTS_LIVE_BROKER, a dotted path to a class with publish,
+# subscribe and unsubscribe). The default LocalBroker works inside one process, which is enough
+# when the site runs in one ASGI server; several processes need a shared backend.
+
+DEFAULT_BROKER = 'appointments.live.LocalBroker'
+HEARTBEAT_SECONDS = 15
+QUEUE_SIZE = 100
+LIVE_PATH = re.compile(r'^/appointments/masters/(?P<master_id>\d+)/events/$')
+
+
+def master_channel(master_id):
+    return f'master-{master_id}'
+
+
+# LocalBroker is an in-process pub/sub. Every subscriber is an asyncio.Queue bound to its event loop;
+# publish may be called from any thread (e.g. a sync view) and hands the message to the loops
+# with call_soon_threadsafe. A subscriber that does not keep up loses messages instead of
+# growing its queue.
+class LocalBroker:
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self.lock:
+            self.subscribers[channel].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self.lock:
+            self.subscribers[channel] = {item for item in self.subscribers[channel] if item[1] is not queue}
+            if not self.subscribers[channel]:
+                del self.subscribers[channel]
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_put, queue, message)
+            except RuntimeError:
+                # the loop of the subscriber has been closed
+                self.unsubscribe(channel, queue)
+
+
+def _put(queue, message):
+    if not queue.full():
+        queue.put_nowait(message)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(getattr(settings, 'APPOINTMENTS_LIVE_BROKER', DEFAULT_BROKER))()
+
+
+# Publishes the change of the slots of a master-day: the slots that stopped or started being free.
+def publish_slots(master_id, date, taken, freed):
+    get_broker().publish(master_channel(master_id), {
+        'date': str(date),
+        'taken': sorted(str(slot) for slot in taken),
+        'freed': sorted(str(slot) for slot in freed),
+    })
+
+
+def format_event(message):
+    return f'event: slots\ndata: {json.dumps(message)}\n\n'.encode()
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+# The ASGI application of /appointments/masters/<id>/events/: an event stream of the slot
+# changes of the master, with a comment line every HEARTBEAT_SECONDS to keep proxies from closing it.
+async def live_events(scope, receive, send, master_id):
+    if scope['method'] != 'GET':
+        await send({'type': 'http.response.start', 'status': 405, 'headers': [(b'allow', b'GET')]})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    broker = get_broker()
+    channel = master_channel(master_id)
+    queue = broker.subscribe(channel)
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    getter = None
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        heartbeat = getattr(settings, 'APPOINTMENTS_LIVE_HEARTBEAT', HEARTBEAT_SECONDS)
+        while True:
+            getter = getter or asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED,
+            )
+            if disconnected in done:
+                break
+            if getter in done:
+                body, getter = format_event(getter.result()), None
+            else:
+                body = b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    except OSError:
+        pass
+    finally:
+        for task in (getter, disconnected):
+            if task is not None:
+                task.cancel()
+        broker.unsubscribe(channel, queue)
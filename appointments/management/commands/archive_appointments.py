@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from appointments.archive import ARCHIVE_BATCH_SIZE, archive_cutoff, iter_archive
+
+
+# Moves the appointments older than the cutoff to the archive in small batches. Every batch is one
+# short transaction, so the command can be stopped at any time and run again to go on; the pause
+# between the batches lets the booking requests write in between. Meant to be run from cron at night:
+#   0 3 * * * python manage.py archive_appointments --days 365
+class Command(BaseCommand):
+    help = 'Moves the past appointments to ArchivedAppointment in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive the appointments older than this many days '
+                                                     '(APPOINTMENTS_ARCHIVE_AFTER_DAYS by default)')
+        parser.add_argument('--before', help='Archive the appointments before this date, YYYY-MM-DD')
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to wait between the batches')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            cutoff = parse_date(options['before'])
+            if cutoff is None:
+                raise CommandError(f'Invalid date: {options["before"]}')
+        else:
+            cutoff = archive_cutoff(options['days'])
+        if cutoff > timezone.localdate():
+            raise CommandError(f'The cutoff {cutoff} is in the future: only past appointments can be archived')
+        moved = 0
+        for count in iter_archive(cutoff, options['batch_size']):
+            moved += count
+            self.stdout.write(f'Archived {moved} appointments')
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} appointments before {cutoff}'))
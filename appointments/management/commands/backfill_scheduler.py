@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from appointments.scheduler_sync import SYNC_BATCH_SIZE, backfill
+
+
+# Creates the django-scheduler calendars and events of the masters and appointments
+# that have not been synced yet (e.g. after the bridge was deployed). New bookings are synced by signals.
+class Command(BaseCommand):
+    help = 'Copies the masters and appointments missing in django-scheduler in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SYNC_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        calendars, events = backfill(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Created {calendars} calendars and {events} events'))
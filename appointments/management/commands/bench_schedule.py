@@ -0,0 +1,52 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from appointments.availability import appointment_bounds, slot_times
+from appointments.models import Appointment, Master, Service
+
+
+# Benchmark for Master.get_schedule_dict. It creates a master with a growing booking history
+# inside a transaction that is rolled back at the end, so the database is not changed,
+# and prints the average time of one schedule computation for each history size.
+class Command(BaseCommand):
+    help = 'Measures get_schedule_dict time for a growing appointment history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = CustomUser.objects.create(username='bench-schedule', email='bench@example.com')
+            service = Service.objects.create(name='Bench', price=1, duration=timedelta(hours=1))
+            master = Master.objects.create(name='Bench', user=user)
+            times = slot_times()
+            today = timezone.localdate()
+            created = 0
+
+            self.stdout.write(f'{"history":>10} {"ms/call":>10}')
+            for size in sorted(options['sizes']):
+                # the history lies in the past, so the window of the schedule stays the same
+                batch = []
+                while created < size:
+                    day = today - timedelta(days=1 + created // len(times))
+                    slot = times[created % len(times)]
+                    start, end = appointment_bounds(day, slot, service)
+                    batch.append(Appointment(
+                        service=service, master=master, date=day, time=slot, start=start, end=end,
+                    ))
+                    created += 1
+                Appointment.objects.bulk_create(batch, batch_size=1000)
+
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    master.get_schedule_dict()
+                elapsed = (time.perf_counter() - started) / options['repeat'] * 1000
+                self.stdout.write(f'{size:>10} {elapsed:>10.2f}')
+
+            transaction.set_rollback(True)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from appointments.availability import DEFAULT_INVENTORY_DAYS, get_setting
+from appointments.inventory import extend_horizon
+
+
+# Extends the slot inventory to the rolling horizon and removes the past days.
+# It is meant to be run every night, e.g. from cron:
+#   0 3 * * * python manage.py extend_slot_inventory
+class Command(BaseCommand):
+    help = 'Materializes the slot inventory of all masters for the next days'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=get_setting('APPOINTMENTS_INVENTORY_DAYS', DEFAULT_INVENTORY_DAYS),
+        )
+
+    def handle(self, *args, **options):
+        created = extend_horizon(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Materialized {created} master-days'))
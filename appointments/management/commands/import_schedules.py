@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from appointments.importers import ScheduleImportError, import_schedule_path
+from appointments.models import Master
+
+
+# Imports working intervals of many masters from schedule files (JSON, JSON Lines, CSV or iCal):
+#   python manage.py import_schedules schedules/april.csv schedules/anna.ics --master 3
+# Every file is imported in its own transaction; the rejected rows are listed with their numbers.
+class Command(BaseCommand):
+    help = 'Imports Availability rows from schedule files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--master', type=int, help='Master of the rows that do not name one')
+        parser.add_argument('--format', choices=['json', 'csv', 'ical'], help='Format of the files')
+
+    def handle(self, *args, **options):
+        master = None
+        if options['master'] is not None:
+            master = Master.objects.filter(pk=options['master']).first()
+            if master is None:
+                raise CommandError(f'Master {options["master"]} does not exist')
+        for path in options['paths']:
+            try:
+                result = import_schedule_path(path, master=master, file_format=options['format'])
+            except (OSError, ScheduleImportError) as error:
+                self.stderr.write(self.style.ERROR(f'{path}: {error}'))
+                continue
+            for number, message in result.errors:
+                self.stderr.write(f'{path}, запись {number}: {message}')
+            self.stdout.write(self.style.SUCCESS(str(result)))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from appointments.purge import PURGE_BATCH_SIZE, deleted_objects, iter_purge
+
+
+# Deletes the soft-deleted masters and services together with their appointments, availability and
+# other dependent rows. The rows go in small batches, each in its own short transaction, with a pause
+# in between, so the site keeps working while a master with a long history is purged. Stopped runs
+# go on where they stopped. Meant to be run from cron at night:
+#   30 3 * * * python manage.py purge_deleted
+class Command(BaseCommand):
+    help = 'Purges the deleted masters and services and their dependent rows in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.05, help='Seconds to wait between the batches')
+
+    def handle(self, *args, **options):
+        objects = deleted_objects()
+        for obj in objects:
+            label = f'{obj._meta.verbose_name} "{obj}"'
+            totals = {}
+            for what, deleted in iter_purge(obj, options['batch_size']):
+                totals[what] = totals.get(what, 0) + deleted
+                self.stdout.write(f'{label}: deleted {totals[what]} {what}')
+                time.sleep(options['pause'])
+            self.stdout.write(f'{label}: purged')
+        self.stdout.write(self.style.SUCCESS(f'Purged {len(objects)} deleted masters and services'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from appointments.booking import sweep_expired_holds
+from appointments.idempotency import purge_expired_keys
+
+
+# Removes the expired short-lived booking records in bulk. Meant to be run from cron every few minutes:
+#   */5 * * * * python manage.py purge_expired
+class Command(BaseCommand):
+    help = 'Deletes expired idempotency keys and slot holds'
+
+    def handle(self, *args, **options):
+        keys = purge_expired_keys()
+        holds = sweep_expired_holds()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {keys} expired idempotency keys and {holds} slot holds'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from appointments.rollups import ROLLUP_BATCH_SIZE, rebuild_rollups
+
+
+# Rebuilds the daily revenue and occupancy rollups from the appointments, e.g. after they were
+# deployed or after the appointments were changed bypassing the signals. New bookings update them by signals.
+#   python manage.py rebuild_rollups --from 2023-01-01 --to 2023-12-31
+class Command(BaseCommand):
+    help = 'Recomputes the daily rollups of the date range (all dates by default) in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start_date', help='First date, YYYY-MM-DD')
+        parser.add_argument('--to', dest='end_date', help='Last date, YYYY-MM-DD')
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        dates = []
+        for name in ('start_date', 'end_date'):
+            value = options[name]
+            dates.append(parse_date(value) if value else None)
+            if value and dates[-1] is None:
+                raise CommandError(f'Invalid date: {value}')
+        created = rebuild_rollups(*dates, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {created} rollups'))
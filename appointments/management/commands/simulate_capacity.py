@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from appointments.capacity import DEFAULT_SIMULATIONS, capacity_plan
+
+
+# Simulates the weeks of the current roster of masters and of a planned one on the demand of the
+# last weeks and prints the expected utilization, lost bookings and revenue of both, e.g. what happens
+# without master 3, with a new master providing services 1 and 2 and with the salon open from 8 to 21:
+#   python manage.py simulate_capacity --without 3 --add-master 1,2 --hours 8-21 --growth 1.2
+class Command(BaseCommand):
+    help = 'Monte Carlo simulation of the weekly bookings with the current and a planned roster of masters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simulations', type=int, default=DEFAULT_SIMULATIONS, help='Simulated weeks')
+        parser.add_argument('--weeks', type=int, help='Weeks of history the demand is taken from')
+        parser.add_argument('--growth', type=float, default=1.0, help='Multiplier of the historical demand')
+        parser.add_argument('--without', type=int, action='append', default=[], help='Id of a master who leaves')
+        parser.add_argument('--add-master', action='append', default=[],
+                            help='Comma separated service ids of a new master')
+        parser.add_argument('--hours', help='Working hours of every working day, e.g. 8-21')
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        if options['simulations'] < 1 or (options['weeks'] is not None and options['weeks'] < 1):
+            raise CommandError('--simulations and --weeks must be positive')
+        if options['growth'] <= 0:
+            raise CommandError('--growth must be positive')
+        try:
+            extra = [{int(value) for value in services.split(',')} for services in options['add_master']]
+            hours = tuple(int(value) for value in options['hours'].split('-')) if options['hours'] else None
+            plan = capacity_plan(
+                options['simulations'], options['weeks'], options['growth'], options['without'], extra, hours,
+                options['seed'],
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+        self.stdout.write(
+            f"Demand of {plan['start']} - {plan['end']} x {plan['growth']}: {plan['demand']} bookings a week, "
+            f"{plan['simulations']} simulated weeks, seed {plan['seed']}"
+        )
+        for name in ('current', 'planned'):
+            report = plan[name]
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{name.capitalize()} roster: {report['masters_count']} masters, "
+                f"{report['available_minutes']} working minutes a week"
+            ))
+            for label, key in (('Bookings', 'served'), ('Lost bookings', 'lost'), ('Revenue', 'revenue'),
+                               ('Lost revenue', 'lost_revenue'), ('Utilization, %', 'utilization')):
+                spread = report[key]
+                self.stdout.write(f"  {label}: {spread['mean']} (10-90%: {spread['low']} - {spread['high']})")
+            self.stdout.write(f"  Lost share: {report['lost_percent']}%")
+            for master in report['masters']:
+                self.stdout.write(f"    {master['name']}: {master['utilization']}%")
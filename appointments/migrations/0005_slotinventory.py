@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_remove_appointment_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('time', models.TimeField()),
+                ('status', models.CharField(choices=[('free', 'Free'), ('booked', 'Booked'), ('held', 'Held')], default='free', max_length=6)),
+                ('master', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='appointments.master')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='slotinventory',
+            constraint=models.UniqueConstraint(fields=('master', 'date', 'time'), name='unique_inventory_slot'),
+        ),
+    ]
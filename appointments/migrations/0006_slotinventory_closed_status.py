@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_slotinventory'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='slotinventory',
+            name='status',
+            field=models.CharField(choices=[('free', 'Free'), ('booked', 'Booked'), ('held', 'Held'), ('closed', 'Closed')], default='free', max_length=6),
+        ),
+    ]
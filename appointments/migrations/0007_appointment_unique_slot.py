@@ -0,0 +1,43 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:19
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+# Stops the migration when some appointments are booked twice at the same master, date and time:
+# the constraint cannot be added then, and which booking to keep is the salon's decision, not the migration's.
+# The error lists the duplicates, so they can be moved or cancelled before migrating again.
+def check_duplicate_slots(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    duplicates = (
+        Appointment.objects
+        .values_list('master_id', 'date', 'time')
+        .annotate(count=Count('pk'))
+        .filter(count__gt=1)
+        .order_by('master_id', 'date', 'time')
+    )
+    lines = []
+    for master_id, date, time, _ in duplicates:
+        ids = Appointment.objects.filter(master_id=master_id, date=date, time=time).order_by('pk')
+        lines.append(f'  master {master_id} on {date} at {time}: appointments {list(ids.values_list("pk", flat=True))}')
+    if lines:
+        raise RuntimeError(
+            'Cannot add the unique_appointment_slot constraint, some slots are booked more than once:\n'
+            + '\n'.join(lines)
+            + '\nMove or delete all but one appointment of every slot and run migrate again.'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_slotinventory_closed_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_slots, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('master', 'date', 'time'), name='unique_appointment_slot'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_slothold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='master',
+            name='schedule_changed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:29
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+
+# Fills start and end of the existing appointments in batches ordered by the primary key,
+# so the whole table is never loaded at once.
+def backfill_bounds(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    default = timedelta(minutes=getattr(settings, 'APPOINTMENTS_SLOT_MINUTES', 60))
+    last_pk = 0
+    while True:
+        batch = list(
+            Appointment.objects.filter(pk__gt=last_pk).select_related('service').order_by('pk')[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        for appointment in batch:
+            appointment.start = timezone.make_aware(datetime.combine(appointment.date, appointment.time))
+            duration = appointment.service.duration or default
+            appointment.end = appointment.start + max(duration, timedelta(minutes=1))
+        Appointment.objects.bulk_update(batch, ['start', 'end'])
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0010_master_schedule_changed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='end',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='start',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_bounds, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['master', 'start'], name='appointment_master_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='availability',
+            index=models.Index(fields=['master', 'date'], name='availability_master_date_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedule', '0014_use_autofields_for_pk'),
+        ('appointments', '0011_appointment_start_end'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='event',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='appointment', to='schedule.event'),
+        ),
+        migrations.AddField(
+            model_name='master',
+            name='calendar',
+            field=models.OneToOneField(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='master', to='schedule.calendar'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+import appointments.models
+
+
+# Gives every existing master its own token before the column becomes unique.
+def fill_calendar_tokens(apps, schema_editor):
+    Master = apps.get_model('appointments', 'Master')
+    for master in Master.objects.only('pk'):
+        Master.objects.filter(pk=master.pk).update(calendar_token=appointments.models.new_calendar_token())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0017_idempotencykey_request_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='master',
+            name='calendar_token',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_calendar_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='master',
+            name='calendar_token',
+            field=models.CharField(default=appointments.models.new_calendar_token, editable=False, max_length=64,
+                                   unique=True),
+        ),
+    ]
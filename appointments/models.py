@@ -1,12 +1,40 @@
-import datetime
+import secrets
+
 from django.db import models
 from django.urls import reverse
-from datetime import datetime, timedelta
 from django.utils import timezone
 
+from .availability import appointment_bounds, build_schedule_dict, occupancy_percent
+
+
+# SoftDeleteQuerySet selects the masters or services that have not been deleted.
+class SoftDeleteQuerySet(models.QuerySet):
+
+    def active(self):
+        return self.filter(is_active=True)
+
+
+# SoftDeleteModel: a deleted row is only marked inactive and hidden; its dependent rows
+# are purged later in batches by the purge_deleted management command (see appointments.purge).
+class SoftDeleteModel(models.Model):
+    is_active = models.BooleanField(default=True, db_index=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = SoftDeleteQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+# The soft_delete method marks the row deleted with one UPDATE.
+    def soft_delete(self):
+        self.is_active = False
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['is_active', 'deleted_at'])
+
+
 # This is a class represents a service that can be offered by a Master.
 # It has a name, price, and duration.
-class Service(models.Model):
+class Service(SoftDeleteModel):
     name = models.CharField(max_length=150)
     price = models.IntegerField()
     duration = models.DurationField(default=0)
@@ -19,10 +47,16 @@ class Service(models.Model):
     def get_absolute_url(self):
         return reverse("service_list")
 
+# Returns a new secret for the URL of a master's calendar feed.
+def new_calendar_token():
+    return secrets.token_urlsafe(24)
+
+
 # Master: Represents a service provider. It has a name, photo, user (which is a foreign key to the CustomUser
 # model in accounts app), a many-to-many field to Service, a JSON field for availability, a description,
-# and a schedule file.
-class Master(models.Model):
+# a schedule file, the time when its bookings last changed, its django-scheduler calendar and the secret
+# token of its .ics feed URL.
+class Master(SoftDeleteModel):
     name = models.CharField(max_length=150)
     photo = models.ImageField(upload_to='users/', default='users/profile_placeholder.jpg', blank=True)
     user = models.ForeignKey('accounts.CustomUser', on_delete=models.CASCADE)
@@ -30,57 +64,74 @@ class Master(models.Model):
     availability = models.JSONField(default=list)
     description = models.CharField(max_length=255, default='Мастер по маникюру и педикюру')
     schedule = models.FileField(upload_to='schedules/', blank=True)
+    schedule_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
+    calendar = models.OneToOneField(
+        'schedule.Calendar', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='master',
+    )
+    calendar_token = models.CharField(max_length=64, unique=True, default=new_calendar_token, editable=False)
 
 #  The __str__ method is used to display the name of the master in the Django admin interface.
     def __str__(self):
         return self.name
 
+# The calendar_slug property is the slug of the master's calendar in django-scheduler.
+    @property
+    def calendar_slug(self):
+        return f'master-{self.pk}'
+
 # The get_absolute_url method returns the URL for the list of masters.
     def get_absolute_url(self):
         return reverse("master_list")
 
 # The method get_schedule_dict creates a dictionary of the master's availability
-# for the next 10 days, including whether or not each hour of the day is available for appointments.
-    def get_schedule_dict(self):
-        # получаем все записи по данному мастеру
-        appointments = Appointment.objects.filter(master=self)
-
-        # создаем словарь с расписанием
-        schedule_dict = {}
-        for i in range(10):
-            # вычисляем дату i-го дня от сегодняшней даты
-            date = timezone.now().date() + timedelta(days=i)
-            # создаем словарь для расписания на эту дату
-            schedule = {}
-            for j in range(9, 20):
-                # проверяем, что j находится в нужном диапазоне
-                if j < 9 or j >= 19:
-                    continue
-                # вычисляем время j-го часа
-                dt = datetime(year=2023, month=4, day=6, hour=j)
-                time = dt.time()
-                # проверяем, свободно ли это время
-                is_available = True
-                for appointment in appointments:
-                    if appointment.date == date and appointment.time == time:
-                        is_available = False
-                        break
-                # добавляем запись в словарь расписания
-                schedule[str(time)] = 'available' if is_available else 'unavailable'
-                # добавляем словарь расписания на эту дату в общий словарь
-            schedule_dict[str(date)] = schedule
-        return schedule_dict
-
-        return schedule_dict
+# for the next days (10 by default), including whether or not each slot of the working day
+# is available for appointments. When a service is given, a slot is available only if the whole
+# service fits before the next appointment. The horizon, working hours and slot step can be passed as parameters.
+    def get_schedule_dict(self, service=None, days=None, start_hour=None, end_hour=None, step=None,
+                          start_date=None):
+        return build_schedule_dict(
+            self, service=service, days=days, start_hour=start_hour, end_hour=end_hour, step=step,
+            start_date=start_date,
+        )
+
+
+# AppointmentQuerySet adds the range queries served by the (master, start) index.
+class AppointmentQuerySet(models.QuerySet):
+
+    # Appointments of the masters (instances or ids) that overlap the interval [start, end).
+    def overlapping(self, masters, start, end):
+        return self.filter(master__in=masters, start__lt=end, end__gt=start)
 
 
 #Appointment: Represents an appointment made by a client for a specific service
 # with a specific master on a specific date and time. It has foreign keys to Service and Master.
+# start and end are the timestamps of the appointment derived from the service duration;
+# they are filled on save and make the overlap queries indexable. event is the copy of the appointment
+# in the master's django-scheduler calendar, client is the user who made the booking.
 class Appointment(models.Model):
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
     master = models.ForeignKey(Master, on_delete=models.CASCADE)
     date = models.DateField()
     time = models.TimeField()
+    start = models.DateTimeField(null=True, editable=False)
+    end = models.DateTimeField(null=True, editable=False)
+    event = models.OneToOneField(
+        'schedule.Event', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='appointment',
+    )
+    client = models.ForeignKey(
+        'accounts.CustomUser', on_delete=models.SET_NULL, null=True, blank=True, related_name='appointments',
+    )
+
+    objects = AppointmentQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['master', 'date', 'time'], name='unique_appointment_slot'),
+        ]
+        indexes = [
+            models.Index(fields=['master', 'start'], name='appointment_master_start_idx'),
+            models.Index(fields=['client', 'start'], name='appointment_client_start_idx'),
+        ]
 
 # The __str__ method is used to display the details of the appointment.
     def __str__(self):
@@ -90,6 +141,45 @@ class Appointment(models.Model):
     def get_absolute_url(self):
         return reverse("appointment_detail", kwargs={"pk": self.pk})
 
+# The save method keeps start and end in line with the date, the time and the service.
+    def save(self, *args, **kwargs):
+        self.start, self.end = appointment_bounds(self.date, self.time, self.service)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'start', 'end'}
+        super().save(*args, **kwargs)
+
+# ArchivedAppointment: An appointment moved out of the Appointment table once it is old enough
+# (see appointments.archive). It keeps the id, the fields and the calendar event of the appointment,
+# so the history of the clients, the rollups and the exports read both tables alike.
+class ArchivedAppointment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE)
+    master = models.ForeignKey(Master, on_delete=models.CASCADE)
+    date = models.DateField()
+    time = models.TimeField()
+    start = models.DateTimeField(null=True)
+    end = models.DateTimeField(null=True)
+    event = models.OneToOneField(
+        'schedule.Event', on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_appointment',
+    )
+    client = models.ForeignKey(
+        'accounts.CustomUser', on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='archived_appointments',
+    )
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['client', 'start'], name='archived_client_start_idx'),
+            models.Index(fields=['date'], name='archived_date_idx'),
+        ]
+
+# The __str__ method is used to display the details of the archived appointment.
+    def __str__(self):
+        return f'{self.service} with {self.master} on {self.date} at {self.time}'
+
+
 # Availability: Represents a time slot when a Master is available to provide a specific Service.
 # It has foreign keys to Master and Service, and fields for the date, start time, and end time.
 class Availability(models.Model):
@@ -103,6 +193,112 @@ class Availability(models.Model):
     start_time = models.TimeField()
     end_time = models.TimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['master', 'date'], name='availability_master_date_idx'),
+        ]
+
 # The __str__ method is used to display the details of the availability.
     def __str__(self):
         return f'{self.master} on {self.date} from {self.start_time} to {self.end_time}'
+
+
+# SlotInventory: A materialized slot of the default schedule grid of a Master.
+# Each row keeps the status of one slot (free, booked, held or closed) for one date and time.
+# The rows are maintained by appointments.inventory and read with a single range query.
+class SlotInventory(models.Model):
+    FREE = 'free'
+    BOOKED = 'booked'
+    HELD = 'held'
+    CLOSED = 'closed'
+    STATUS_CHOICES = [
+        (FREE, 'Free'),
+        (BOOKED, 'Booked'),
+        (HELD, 'Held'),
+        (CLOSED, 'Closed'),
+    ]
+
+    master = models.ForeignKey(Master, on_delete=models.CASCADE, related_name='slots')
+    date = models.DateField()
+    time = models.TimeField()
+    status = models.CharField(max_length=6, choices=STATUS_CHOICES, default=FREE)
+    held_until = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['master', 'date', 'time'], name='unique_inventory_slot'),
+        ]
+
+# The __str__ method is used to display the details of the slot.
+    def __str__(self):
+        return f'{self.master} on {self.date} at {self.time}: {self.status}'
+
+
+# SlotHold: A short-lived hold of a slot by a client who is filling in the booking form.
+# While the hold is active the slot is unavailable for everybody else. The token identifies
+# the hold of the client, the hold is released on submit or when it expires.
+class SlotHold(models.Model):
+    master = models.ForeignKey(Master, on_delete=models.CASCADE, related_name='holds')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, null=True, blank=True)
+    date = models.DateField()
+    time = models.TimeField()
+    token = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['master', 'date'], name='slothold_master_date_idx'),
+        ]
+
+# The __str__ method is used to display the details of the hold.
+    def __str__(self):
+        return f'{self.master} on {self.date} at {self.time} held until {self.expires_at}'
+
+
+# IdempotencyKey: The stored outcome of a booking POST sent with an idempotency key.
+# A retry with the same key and the same request data (request_hash) gets the stored response until expires_at.
+# status_code is empty while the first request is still being processed.
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    request_hash = models.CharField(max_length=64, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    location = models.CharField(max_length=255, blank=True)
+    content = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+# The __str__ method is used to display the key and its status.
+    def __str__(self):
+        return f'{self.key} ({self.status_code or "in progress"})'
+
+
+# DailyRollup: The precomputed totals of one master for one day: the number of bookings,
+# the booked minutes, the revenue (the sum of the service prices) and the working minutes.
+# The rows are maintained by appointments.rollups; the owners' dashboard reads only them.
+class DailyRollup(models.Model):
+    master = models.ForeignKey(Master, on_delete=models.CASCADE, related_name='rollups')
+    date = models.DateField()
+    bookings = models.PositiveIntegerField(default=0)
+    booked_minutes = models.PositiveIntegerField(default=0)
+    revenue = models.IntegerField(default=0)
+    available_minutes = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['master', 'date'], name='unique_daily_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['date'], name='dailyrollup_date_idx'),
+        ]
+
+# The __str__ method is used to display the details of the rollup.
+    def __str__(self):
+        return f'{self.master} on {self.date}: {self.bookings} bookings, {self.revenue}'
+
+# The booked share of the working time in percent.
+    @property
+    def occupancy(self):
+        return occupancy_percent(self.booked_minutes, self.available_minutes)
@@ -0,0 +1,109 @@
+from django.utils import timezone
+
+from .availability import (FreeDay, availability_hours, format_minutes, load_availability, load_day_intervals,
+                           schedule_dates, service_minutes, slot_times, subtract_intervals, to_minutes)
+from .models import Master
+
+# Package booking search: for a list of services booked together (e.g. manicure + pedicure)
+# it finds chains of back-to-back appointments, where every next service starts exactly when
+# the previous one ends. One master can do all the services or the client can be handed off
+# to another master. The search runs over the free intervals of the qualifying masters.
+
+DEFAULT_PACKAGE_DAYS = 30
+
+
+# Returns {service_id: [master ids]} for the masters able to provide each service.
+def qualifying_masters(service_ids):
+    masters = {service_id: [] for service_id in service_ids}
+    for service_id, master_id in (
+        Master.services.through.objects
+        .filter(service_id__in=service_ids, master__is_active=True)
+        .order_by('master_id')
+        .values_list('service_id', 'master_id')
+    ):
+        masters[service_id].append(master_id)
+    return masters
+
+
+# Finds the chain for the legs starting at `start`. `days` holds the free time of every
+# (master_id, service_id). Masters already used in the chain are tried first, so one-master chains
+# are preferred to hand-offs.
+def _chain(legs, leg, start, days, used):
+    if leg == len(legs):
+        return []
+    service, duration, masters = legs[leg]
+    ordered = [master_id for master_id in used if master_id in masters]
+    ordered += [master_id for master_id in masters if master_id not in used]
+    for master_id in ordered:
+        day = days.get((master_id, service.pk))
+        if day is None or day.longest < duration or not day.fits(start, duration):
+            continue
+        rest = _chain(legs, leg + 1, start + duration, days, used + [master_id])
+        if rest is not None:
+            return [(service, master_id, start, start + duration)] + rest
+    return None
+
+
+# Returns up to `limit` chains for the services (in the given order), earliest first.
+# Each chain is a dict with the date and the list of legs (service, master, start, end).
+def find_package_chains(services, start_date=None, days=DEFAULT_PACKAGE_DAYS, limit=20, now=None):
+    services = list(services)
+    if not services:
+        return []
+    masters = qualifying_masters({service.pk for service in services})
+    legs = [(service, service_minutes(service), set(masters[service.pk])) for service in services]
+    total = sum(duration for _, duration, _ in legs)
+    if any(not leg_masters for _, _, leg_masters in legs):
+        return []
+
+    dates = schedule_dates(days, start_date)
+    master_ids = set().union(*(leg_masters for _, _, leg_masters in legs))
+    master_days = [(master_id, date) for master_id in master_ids for date in dates]
+    rows = load_availability(master_days)
+    intervals = load_day_intervals(master_days, availability=rows)
+    now = timezone.localtime(now)
+    candidates = [to_minutes(slot) for slot in slot_times()]
+    names = dict(Master.objects.filter(pk__in=master_ids).values_list('pk', 'name'))
+
+    chains = []
+    for date in dates:
+        free_days = {}
+        for service, _, leg_masters in legs:
+            for master_id in leg_masters:
+                working, busy = intervals[(master_id, date)]
+                # the Availability rows of a day give the working hours of one service each
+                if (master_id, date) in rows:
+                    working = availability_hours(rows[(master_id, date)], service)
+                free_days[(master_id, service.pk)] = FreeDay(subtract_intervals(working, busy))
+        first_service, first_duration, first_masters = legs[0]
+        latest_end = max(day.latest_end for day in free_days.values())
+        for start in candidates:
+            # pruning: the whole package must end before the last free minute of the day
+            if start + total > latest_end:
+                break
+            if date == now.date() and start <= to_minutes(now.time()):
+                continue
+            if not any(free_days[(master_id, first_service.pk)].fits(start, first_duration)
+                       for master_id in first_masters):
+                continue
+            chain = _chain(legs, 0, start, free_days, [])
+            if chain is None:
+                continue
+            chains.append({
+                'date': str(date),
+                'legs': [
+                    {
+                        'service': service.pk,
+                        'service_name': service.name,
+                        'master': master_id,
+                        'master_name': names[master_id],
+                        'time': format_minutes(leg_start),
+                        'end': format_minutes(leg_end),
+                    }
+                    for service, master_id, leg_start, leg_end in chain
+                ],
+                'masters': len({master_id for _, master_id, _, _ in chain}),
+            })
+            if len(chains) >= limit:
+                return chains
+    return chains
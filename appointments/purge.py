@@ -0,0 +1,99 @@
+import contextvars
+
+from django.db import transaction
+from schedule.models import Event
+
+from .batches import iter_batches
+from .inventory import invalidate_masters
+from .models import (Appointment, ArchivedAppointment, Availability, DailyRollup, Master, Service, SlotHold,
+                     SlotInventory)
+from .rollups import refresh_rollups
+from .staff_grid import invalidate_grid
+
+# Purge of the soft-deleted masters and services. Deleting a master or a service in the views only
+# marks it inactive; its dependent rows (appointments, availability, slots, ...) are deleted here in
+# batches (see appointments.batches) instead of one long CASCADE inside the request.
+# The row itself is deleted last, when nothing depends on it any more. The deletion signals are muted
+# while a batch is deleted; what they would do is done once per batch instead: the calendar events
+# of the deleted appointments are removed and, for a service, the schedules and rollups of the
+# (still active) masters are updated.
+
+PURGE_BATCH_SIZE = 500
+
+_purging = contextvars.ContextVar('appointments_purging', default=False)
+
+
+# True while the dependent rows of a deleted master or service are being purged.
+def is_purging():
+    return _purging.get()
+
+
+def _master_dependents(master_id):
+    return [
+        ('slots', SlotInventory.objects.filter(master_id=master_id)),
+        ('slot holds', SlotHold.objects.filter(master_id=master_id)),
+        ('availability rows', Availability.objects.filter(master_id=master_id)),
+        ('appointments', Appointment.objects.filter(master_id=master_id)),
+        ('archived appointments', ArchivedAppointment.objects.filter(master_id=master_id)),
+        ('rollups', DailyRollup.objects.filter(master_id=master_id)),
+    ]
+
+
+def _service_dependents(service_id):
+    return [
+        ('slot holds', SlotHold.objects.filter(service_id=service_id)),
+        ('availability rows', Availability.objects.filter(service_id=service_id)),
+        ('appointments', Appointment.objects.filter(service_id=service_id)),
+        ('archived appointments', ArchivedAppointment.objects.filter(service_id=service_id)),
+        ('master services', Master.services.through.objects.filter(service_id=service_id)),
+    ]
+
+
+# Deletes one batch of the queryset and returns the number of deleted rows, 0 when nothing is left.
+# With `refresh` the schedules and the rollups of the touched master-days are updated as well.
+def purge_batch(queryset, batch_size=PURGE_BATCH_SIZE, refresh=False):
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    model = queryset.model
+    rows = model.objects.filter(pk__in=ids)
+    fields = {field.name for field in model._meta.get_fields()}
+    token = _purging.set(True)
+    try:
+        with transaction.atomic():
+            event_ids = []
+            if 'event' in fields:
+                event_ids = list(rows.exclude(event=None).values_list('event_id', flat=True))
+            days = set(rows.values_list('master_id', 'date')) if refresh and 'date' in fields else set()
+            rows.delete()
+            Event.objects.filter(pk__in=event_ids).delete()
+            if days:
+                invalidate_masters({master_id for master_id, _ in days})
+                refresh_rollups(days)
+                invalidate_grid()
+    finally:
+        _purging.reset(token)
+    return len(ids)
+
+
+# Purges one soft-deleted master or service batch by batch and yields (what, deleted) after every batch.
+# The master or the service itself is deleted at the end.
+def iter_purge(obj, batch_size=PURGE_BATCH_SIZE):
+    if isinstance(obj, Master):
+        dependents, refresh = _master_dependents(obj.pk), False
+    else:
+        dependents, refresh = _service_dependents(obj.pk), True
+    for what, queryset in dependents:
+        for deleted in iter_batches(lambda: purge_batch(queryset, batch_size, refresh)):
+            yield what, deleted
+    obj.delete()
+
+
+# The soft-deleted masters and services waiting for the purge, the oldest deletions first.
+# A row that was only deactivated (is_active unchecked in the admin) is not purged.
+def deleted_objects():
+    return [
+        obj
+        for model in (Master, Service)
+        for obj in model.objects.filter(is_active=False, deleted_at__isnull=False).order_by('deleted_at', 'pk')
+    ]
@@ -0,0 +1,143 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+
+from .availability import duration_minutes, load_day_intervals, occupancy_percent, total_minutes
+from .archive import history_querysets
+from .models import DailyRollup, Master
+
+# Daily rollups of the bookings: one DailyRollup row per master and day. The totals are aggregated
+# by the database (COUNT and SUM over the appointments and the archived appointments joined with their
+# services) and the working minutes come from the working hours of the day. A booking change recomputes
+# only the rollup of its master-day; rebuild_rollups recomputes a whole range in batches.
+
+ROLLUP_BATCH_SIZE = 1000
+
+ROLLUP_FIELDS = ['bookings', 'booked_minutes', 'revenue', 'available_minutes', 'updated_at']
+
+
+# Returns {(master_id, date): totals} of the appointments matching the filters, grouped by master and day.
+# Each table (the appointments and the archive) is aggregated by the database per service duration, so the
+# booked minutes follow the rule of the schedule (availability.duration_minutes: a service without
+# a duration takes one slot); the totals of a day are added up here.
+def aggregate_days(**filters):
+    totals = {}
+    for queryset in history_querysets(**filters):
+        rows = (
+            queryset
+            .values('master_id', 'date', 'service__duration')
+            .annotate(bookings=Count('pk'), revenue=Sum('service__price'))
+            .order_by()
+        )
+        for row in rows:
+            day = totals.setdefault((row['master_id'], row['date']), {'bookings': 0, 'revenue': 0, 'minutes': 0})
+            day['bookings'] += row['bookings']
+            day['revenue'] += row['revenue'] or 0
+            day['minutes'] += row['bookings'] * duration_minutes(row['service__duration'])
+    return totals
+
+
+# Returns {(master_id, date): working minutes} of the master-days.
+def available_minutes(master_days):
+    return {
+        key: total_minutes(working)
+        for key, (working, _) in load_day_intervals(master_days, holds=False).items()
+    }
+
+
+# Returns {(master_id, date): totals} of the master-days. The days are selected with
+# IN lists of the masters and the dates, and the other combinations are dropped here.
+def _totals(master_days):
+    master_ids = {master_id for master_id, _ in master_days}
+    dates = {date for _, date in master_days}
+    totals = aggregate_days(master_id__in=master_ids, date__in=dates)
+    return {key: day for key, day in totals.items() if key in master_days}
+
+
+# Builds the unsaved rollups of the master-days; a day without bookings gets a rollup with zero totals,
+# so the idle working time counts in the occupancy.
+def _rollups(master_days, totals):
+    minutes = available_minutes(master_days)
+    now = timezone.now()
+    rollups = []
+    for key in sorted(master_days):
+        day = totals.get(key, {})
+        rollups.append(DailyRollup(
+            master_id=key[0], date=key[1], bookings=day.get('bookings', 0),
+            booked_minutes=day.get('minutes', 0),
+            revenue=day.get('revenue', 0),
+            available_minutes=minutes[key],
+            updated_at=now,
+        ))
+    return rollups
+
+
+# Recomputes the rollups of the given master-days after their bookings or working hours changed.
+def refresh_rollups(master_days):
+    master_days = set(master_days)
+    if not master_days:
+        return
+    DailyRollup.objects.bulk_create(
+        _rollups(master_days, _totals(master_days)),
+        update_conflicts=True, unique_fields=['master', 'date'], update_fields=ROLLUP_FIELDS,
+    )
+
+
+# Recomputes the working minutes of the rollups of the masters from today on,
+# e.g. after their working hours template has changed.
+def refresh_master_rollups(master_ids):
+    refresh_rollups(
+        DailyRollup.objects
+        .filter(master_id__in=master_ids, date__gte=timezone.localdate())
+        .values_list('master_id', 'date')
+    )
+
+
+# Rebuilds the rollups of every active master for every day of the date range (from the first to the last
+# booked day when the range is open). The range is walked in windows of about batch_size master-days, each
+# replaced in its own transaction (see appointments.batches); the bookings of a window are aggregated
+# by the database with one query. The idle days of the soft-deleted masters
+# get no rollups, the days they have bookings on keep theirs until the purge. Returns the number of rollups.
+def rebuild_rollups(start_date=None, end_date=None, batch_size=ROLLUP_BATCH_SIZE):
+    if start_date is None or end_date is None:
+        bounds = [queryset.aggregate(first=Min('date'), last=Max('date')) for queryset in history_querysets()]
+        start_date = start_date or min((row['first'] for row in bounds if row['first']), default=None)
+        end_date = end_date or max((row['last'] for row in bounds if row['last']), default=None)
+    if start_date is None or end_date is None or start_date > end_date:
+        return 0
+    master_ids = list(Master.objects.active().order_by('pk').values_list('pk', flat=True))
+    window = timedelta(days=max(1, batch_size // max(1, len(master_ids))))
+    created = 0
+    day = start_date
+    while day <= end_date:
+        last = min(day + window - timedelta(days=1), end_date)
+        with transaction.atomic():
+            DailyRollup.objects.filter(date__range=(day, last)).delete()
+            totals = aggregate_days(date__range=(day, last))
+            master_days = set(totals) | {
+                (master_id, day + timedelta(days=offset))
+                for master_id in master_ids for offset in range((last - day).days + 1)
+            }
+            created += len(DailyRollup.objects.bulk_create(_rollups(master_days, totals)))
+        day = last + timedelta(days=1)
+    return created
+
+
+# The dashboard of the date range read from the rollups only: the totals of every master,
+# of every day and of the whole range, each with its occupancy.
+def dashboard(start_date, end_date):
+    rollups = DailyRollup.objects.filter(date__range=(start_date, end_date))
+    totals = dict(
+        total_bookings=Sum('bookings'), total_booked=Sum('booked_minutes'), total_revenue=Sum('revenue'),
+        total_available=Sum('available_minutes'),
+    )
+    masters = list(
+        rollups.values('master_id', 'master__name').annotate(**totals).order_by('-total_revenue', 'master__name')
+    )
+    days = list(rollups.values('date').annotate(**totals).order_by('date'))
+    total = rollups.aggregate(**totals)
+    for row in masters + days + [total]:
+        row['occupancy'] = occupancy_percent(row['total_booked'] or 0, row['total_available'] or 0)
+    return {'masters': masters, 'days': days, 'total': total}
@@ -0,0 +1,109 @@
+from schedule.models import Calendar, Event
+
+from .models import Appointment, Master
+
+# Bridge from the bookings into django-scheduler (mounted at /schedule/): every master gets
+# a Calendar and every appointment an Event in it. The signals apply only the change of one row,
+# the events are one-time events, so django-scheduler has no occurrences to rebuild, and
+# the backfill_scheduler command writes the missing rows in batches.
+
+SYNC_BATCH_SIZE = 1000
+
+
+def _event_fields(appointment, service_name):
+    return {
+        'start': appointment.start,
+        'end': appointment.end,
+        'title': service_name,
+    }
+
+
+# Returns the id of the calendar of the master, creating the calendar when it is missing.
+def calendar_id_for(master):
+    if master.calendar_id is None:
+        calendar, _ = Calendar.objects.get_or_create(
+            slug=master.calendar_slug, defaults={'name': master.name},
+        )
+        Master.objects.filter(pk=master.pk).update(calendar=calendar)
+        master.calendar_id = calendar.pk
+    return master.calendar_id
+
+
+# Renames the calendar of the master after the master has been renamed.
+def sync_master(master):
+    if master.calendar_id is not None:
+        Calendar.objects.filter(pk=master.calendar_id).exclude(name=master.name).update(name=master.name)
+
+
+# Creates or updates the event of one appointment.
+def sync_appointment(appointment):
+    fields = _event_fields(appointment, appointment.service.name)
+    fields['calendar_id'] = calendar_id_for(appointment.master)
+    if appointment.event_id is not None and Event.objects.filter(pk=appointment.event_id).update(**fields):
+        return
+    event = Event.objects.create(**fields)
+    Appointment.objects.filter(pk=appointment.pk).update(event=event)
+    appointment.event_id = event.pk
+
+
+# Deletes the event of a deleted appointment.
+def remove_appointment(appointment):
+    if appointment.event_id is not None:
+        Event.objects.filter(pk=appointment.event_id).delete()
+
+
+# Deletes the calendar (and with it the events) of a deleted master.
+def remove_master(master):
+    if master.calendar_id is not None:
+        Calendar.objects.filter(pk=master.calendar_id).delete()
+
+
+# Creates the missing calendars and events in batches and returns their numbers.
+def backfill(batch_size=SYNC_BATCH_SIZE):
+    masters = list(Master.objects.filter(calendar=None).only('pk', 'name'))
+    existing = dict(
+        Calendar.objects.filter(slug__in=[master.calendar_slug for master in masters]).values_list('slug', 'pk')
+    )
+    new_calendars = [
+        Calendar(name=master.name, slug=master.calendar_slug)
+        for master in masters if master.calendar_slug not in existing
+    ]
+    Calendar.objects.bulk_create(new_calendars, batch_size=batch_size)
+    existing.update((calendar.slug, calendar.pk) for calendar in new_calendars)
+    for master in masters:
+        master.calendar_id = existing[master.calendar_slug]
+    Master.objects.bulk_update(masters, ['calendar'], batch_size=batch_size)
+
+    calendars = dict(Master.objects.exclude(calendar=None).values_list('pk', 'calendar_id'))
+    created = 0
+    last_pk = 0
+    while True:
+        appointments = list(
+            Appointment.objects.filter(event=None, pk__gt=last_pk)
+            .select_related('service').order_by('pk')[:batch_size]
+        )
+        if not appointments:
+            break
+        created += _create_events(appointments, calendars)
+        last_pk = appointments[-1].pk
+    return len(new_calendars), created
+
+
+def _create_events(appointments, calendars):
+    events = [
+        Event(calendar_id=calendars[appointment.master_id], **_event_fields(appointment, appointment.service.name))
+        for appointment in appointments
+    ]
+    Event.objects.bulk_create(events)
+    for appointment, event in zip(appointments, events):
+        appointment.event_id = event.pk
+    Appointment.objects.bulk_update(appointments, ['event'])
+    return len(events)
+
+
+# Creates the events of appointments inserted with bulk_create, which sends no signals.
+# The appointments need their master and service loaded.
+def sync_created_appointments(appointments):
+    masters = {appointment.master_id: appointment.master for appointment in appointments}
+    calendars = {master_id: calendar_id_for(master) for master_id, master in masters.items()}
+    return _create_events(appointments, calendars)
@@ -0,0 +1,148 @@
+from functools import wraps
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .archive import is_archiving
+from .calendar_feed import touch_service_feeds
+from .purge import is_purging
+
+from .inventory import invalidate_masters, schedule_changed
+from .rollups import refresh_master_rollups, refresh_rollups
+from .models import Appointment, Availability, Master, Service, SlotHold
+from .staff_grid import invalidate_grid, invalidate_grid_day
+from .scheduler_sync import remove_appointment, remove_master, sync_appointment, sync_master
+
+
+# The deletion receivers skip the rows removed in bulk: the archive keeps the calendar events and
+# rollups of the moved appointments and the past days have no slots or grid to update; the purge of
+# deleted masters and services updates them once per batch (see appointments.purge).
+def unless_bulk_removal(handler):
+    @wraps(handler)
+    def wrapper(sender, instance, **kwargs):
+        if not is_archiving() and not is_purging():
+            return handler(sender, instance, **kwargs)
+    return wrapper
+
+
+# Remembers the master and date the appointment (or availability) had before it was changed,
+# so the old day is freed in the slot inventory as well.
+@receiver(pre_save, sender=Appointment)
+@receiver(pre_save, sender=Availability)
+@receiver(pre_save, sender=SlotHold)
+def remember_previous_day(sender, instance, **kwargs):
+    instance._previous_day = None
+    if instance.pk:
+        instance._previous_day = (
+            sender.objects.filter(pk=instance.pk).values_list('master_id', 'date').first()
+        )
+
+
+# Updates the slot inventory and the schedule version of the days touched by a saved appointment, availability or slot hold.
+# Deleted holds are handled by appointments.booking, so expired holds can be swept in bulk.
+@receiver(post_save, sender=Appointment)
+@receiver(post_save, sender=Availability)
+@receiver(post_save, sender=SlotHold)
+def update_inventory_on_save(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_day', None)
+    if previous and previous != (instance.master_id, instance.date):
+        schedule_changed(*previous)
+    schedule_changed(instance.master_id, instance.date)
+
+
+# Recomputes the slots of a deleted appointment or availability in the slot inventory
+# and marks the schedule of the master as changed.
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=Availability)
+@unless_bulk_removal
+def update_inventory_on_delete(sender, instance, **kwargs):
+    schedule_changed(instance.master_id, instance.date)
+
+
+# Remembers the working hours template the master had before it was changed.
+@receiver(pre_save, sender=Master)
+def remember_previous_template(sender, instance, **kwargs):
+    instance._previous_template = None
+    if instance.pk:
+        instance._previous_template = (
+            Master.objects.filter(pk=instance.pk).values_list('availability', flat=True).first()
+        )
+
+
+# Drops the future slot inventory of a master whose working hours template has changed.
+@receiver(post_save, sender=Master)
+def update_inventory_on_template_change(sender, instance, created, **kwargs):
+    if not created and getattr(instance, '_previous_template', None) != instance.availability:
+        invalidate_masters([instance.pk])
+
+
+# Copies a saved appointment into the master's django-scheduler calendar.
+@receiver(post_save, sender=Appointment)
+def sync_event_on_save(sender, instance, **kwargs):
+    sync_appointment(instance)
+
+
+# Removes the calendar event of a deleted appointment.
+@receiver(post_delete, sender=Appointment)
+@unless_bulk_removal
+def remove_event_on_delete(sender, instance, **kwargs):
+    remove_appointment(instance)
+
+
+# Keeps the name of the master's calendar in line with the master.
+@receiver(post_save, sender=Master)
+def sync_calendar_on_save(sender, instance, created, **kwargs):
+    if not created:
+        sync_master(instance)
+
+
+# The events of a changed service (its name is the summary) change the feeds of its masters.
+@receiver(post_save, sender=Service)
+def touch_feeds_on_service_change(sender, instance, created, **kwargs):
+    if not created:
+        touch_service_feeds(instance.pk)
+
+
+# Removes the calendar of a deleted master.
+@receiver(post_delete, sender=Master)
+def remove_calendar_on_delete(sender, instance, **kwargs):
+    remove_master(instance)
+
+
+# Drops the cached staff grid of the days touched by a booking.
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@unless_bulk_removal
+def invalidate_grid_on_booking(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_day', None)
+    if previous and previous[1] != instance.date:
+        invalidate_grid_day(previous[1])
+    invalidate_grid_day(instance.date)
+
+
+# Drops all cached staff grids when the masters (the rows of the grid) change.
+@receiver(post_save, sender=Master)
+@receiver(post_delete, sender=Master)
+def invalidate_grid_on_master_change(sender, instance, **kwargs):
+    invalidate_grid()
+
+
+# Recomputes the daily rollups of the days touched by a booking or a change of the working hours.
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=Availability)
+@receiver(post_delete, sender=Availability)
+@unless_bulk_removal
+def update_rollups(sender, instance, **kwargs):
+    days = {(instance.master_id, instance.date)}
+    previous = getattr(instance, '_previous_day', None)
+    if previous:
+        days.add(previous)
+    refresh_rollups(days)
+
+
+# Recomputes the working minutes of the upcoming rollups of a master whose working hours template has changed.
+@receiver(post_save, sender=Master)
+def update_rollups_on_template_change(sender, instance, created, **kwargs):
+    if not created and getattr(instance, '_previous_template', None) != instance.availability:
+        refresh_master_rollups([instance.pk])
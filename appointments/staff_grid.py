@@ -0,0 +1,101 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import FilteredRelation, Q
+
+from .availability import schedule_dates, slot_step, slot_times, to_minutes
+from .models import Master
+
+# The staff overview: for every day a grid of all masters (rows) by the slots of the default
+# working day (columns). The grid of the requested days is read with one query - the masters
+# left-joined with the appointments of those days and their services - and laid out in one pass
+# over the rows. The layout of each day is kept for a few minutes in the shared cache (see CACHES in
+# the settings) and dropped by the booking signals.
+
+GRID_CACHE_PREFIX = 'staff-grid'
+GRID_CACHE_TIMEOUT = 5 * 60
+
+
+def _version():
+    # bumped when masters are added, renamed or removed, which changes the rows of every day
+    return cache.get_or_set(f'{GRID_CACHE_PREFIX}:version', 1, None)
+
+
+def grid_cache_key(date, version=None):
+    return f'{GRID_CACHE_PREFIX}:{version or _version()}:{date}'
+
+
+# Drops the cached grid of the day after a booking change.
+def invalidate_grid_day(date):
+    cache.delete(grid_cache_key(date))
+
+
+# Drops the cached grids of all days after a change of the masters.
+def invalidate_grid():
+    try:
+        cache.incr(f'{GRID_CACHE_PREFIX}:version')
+    except ValueError:
+        pass
+
+
+# Builds the grids of the dates with one query. Returns {date: {'masters': [row, ...]}},
+# where a row is {'id', 'name', 'cells'} and a cell is None for a free slot,
+# {'service', 'time', 'span'} for the slot an appointment starts in, or 'busy' for the
+# following slots covered by the same appointment (the first cell spans them).
+def build_grids(dates):
+    times = slot_times()
+    positions = {to_minutes(slot): position for position, slot in enumerate(times)}
+    step = to_minutes(slot_step())
+    rows = (
+        Master.objects.active()
+        .annotate(booking=FilteredRelation('appointment', condition=Q(appointment__date__in=dates)))
+        .order_by('name', 'pk', 'booking__date', 'booking__time')
+        .values_list('pk', 'name', 'booking__date', 'booking__time', 'booking__service__name',
+                     'booking__service__duration')
+    )
+    grids = {date: {'masters': []} for date in dates}
+    current = None
+    for master_id, name, date, start, service, duration in rows:
+        if current is None or current[0] != master_id:
+            current = (master_id, {
+                date: {'id': master_id, 'name': name, 'cells': [None] * len(times)} for date in dates
+            })
+            for day, row in current[1].items():
+                grids[day]['masters'].append(row)
+        if date is None:
+            continue
+        minutes = to_minutes(start)
+        length = to_minutes(duration) if duration else step
+        span = max(1, -(-length // step))
+        cells = current[1][date]['cells']
+        position = positions.get(minutes)
+        if position is None:
+            # the appointment does not start on the grid: every slot it overlaps shows it
+            for slot, index in positions.items():
+                if slot < minutes + length and minutes < slot + step and cells[index] is None:
+                    cells[index] = {'service': service, 'time': start, 'span': 1}
+            continue
+        cells[position] = {'service': service, 'time': start, 'span': min(span, len(times) - position)}
+        for index in range(position + 1, min(position + span, len(times))):
+            cells[index] = 'busy'
+    return grids
+
+
+# Returns [(date, grid)] for `days` days from start_date. The cached days are reused and
+# the missing ones are built together with one query.
+def staff_grid(start_date=None, days=1):
+    dates = schedule_dates(days, start_date)
+    version = _version()
+    keys = {date: grid_cache_key(date, version) for date in dates}
+    cached = cache.get_many(list(keys.values()))
+    grids = {date: cached[key] for date, key in keys.items() if key in cached}
+    missing = [date for date in dates if date not in grids]
+    if missing:
+        built = build_grids(missing)
+        cache.set_many({keys[date]: grid for date, grid in built.items()}, GRID_CACHE_TIMEOUT)
+        grids.update(built)
+    return [(date, grids[date]) for date in dates]
+
+
+def week_start(date):
+    return date - timedelta(days=date.weekday())
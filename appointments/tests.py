@@ -1,8 +1,49 @@
-from django.test import TestCase
+import asyncio
+import csv
+import importlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import zipfile
 
-from datetime import timedelta
+import numpy as np
+from django.apps import apps
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from datetime import time, timedelta
 from django.urls import reverse, resolve
-from appointments.models import Service, Master
+from django.utils import timezone
+from schedule.models import Calendar, Event
+from appointments.models import (Service, Master, Appointment, SlotInventory, Availability, IdempotencyKey,
+                                 SlotHold, DailyRollup, ArchivedAppointment)
+from appointments.availability import bookable_starts, is_bookable, load_day_intervals, subtract_intervals
+from appointments.forms import AppointmentForm, MasterForm
+from appointments.working_hours import compiled_working_hours
+from appointments.importers import import_schedule_file, iter_json
+from appointments.live import format_event, get_broker, publish_slots
+from appointments.staff_grid import staff_grid
+from appointments.bulk_booking import _book_batch
+from appointments.exports import iter_xlsx
+from appointments.rollups import dashboard, rebuild_rollups
+from appointments.archive import archive_batch, archive_cutoff, history
+from appointments.capacity import capacity_plan, current_roster, load_demand, plan_roster, simulate
+from appointments.purge import deleted_objects, iter_purge
+from appointments.keyset import decode_cursor, encode_cursor
+from appointments.bitmap import AvailabilityIndex
+from appointments.packages import find_package_chains
+from appointments.booking import (book_any_master, book_appointment, hold_slot, sweep_expired_holds,
+                                  NoMasterAvailable, SlotTaken)
+from appointments.idempotency import purge_expired_keys
+from appointments.inventory import extend_horizon, read_inventory_bulk
 from .views import ServiceListView, MasterListView
 from accounts.models import CustomUser
 
@@ -80,7 +121,8 @@ class ServiceTest(TestCase):
             reverse('service_delete', args=[self.service.pk])
         )
         self.assertEqual(response.status_code, 302)
-        self.assertEqual(Service.objects.count(), 0)
+        self.assertEqual(Service.objects.active().count(), 0)
+        self.assertEqual(self.client.get(reverse('service_detail', kwargs={'pk': self.service.pk})).status_code, 404)
 
     def test_service_detailview(self):
         """
@@ -131,3 +173,1554 @@ class MasterTest(TestCase):
         view = resolve(reverse('master_list', kwargs={'service_id': self.service.pk}))
         self.assertEqual(view.func.view_class, MasterListView)
 
+
+class ScheduleTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='schedule@example.com', password='test123')
+        cls.service = Service.objects.create(name='Manicure', price=20, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Schedule Master', user=cls.user)
+        cls.today = timezone.localdate()
+
+    def test_schedule_dict_shape(self):
+        """
+        Test for checking the default 10 days x 9:00-19:00 schedule
+        """
+        schedule = self.master.get_schedule_dict()
+        self.assertEqual(len(schedule), 10)
+        self.assertEqual(list(schedule)[0], str(self.today))
+        day = schedule[str(self.today)]
+        self.assertEqual(list(day), ['%02d:00:00' % hour for hour in range(9, 19)])
+        self.assertEqual(set(day.values()), {'available'})
+
+    def test_booked_slot_is_unavailable(self):
+        """
+        Test for checking that a booked slot is marked as unavailable
+        """
+        tomorrow = self.today + timedelta(days=1)
+        Appointment.objects.create(service=self.service, master=self.master, date=tomorrow, time=time(11))
+        schedule = self.master.get_schedule_dict()
+        self.assertEqual(schedule[str(tomorrow)]['11:00:00'], 'unavailable')
+        self.assertEqual(schedule[str(tomorrow)]['12:00:00'], 'available')
+        self.assertEqual(schedule[str(self.today)]['11:00:00'], 'available')
+
+    def test_schedule_parameters(self):
+        """
+        Test for checking the horizon, working hours and slot step parameters
+        """
+        schedule = self.master.get_schedule_dict(days=3, start_hour=10, end_hour=12, step=timedelta(minutes=30))
+        self.assertEqual(len(schedule), 3)
+        self.assertEqual(list(schedule[str(self.today)]), ['10:00:00', '10:30:00', '11:00:00', '11:30:00'])
+
+    def test_schedule_single_query(self):
+        """
+        Test for checking that the schedule does not depend on the size of the booking history
+        """
+        Appointment.objects.bulk_create([
+            Appointment(service=self.service, master=self.master,
+                        date=self.today - timedelta(days=1 + i // 10), time=time(9 + i % 10))
+            for i in range(500)
+        ])
+        self.master.get_schedule_dict()
+        with self.assertNumQueries(1):
+            self.master.get_schedule_dict()
+
+
+class SlotInventoryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='inventory@example.com', password='test123')
+        cls.service = Service.objects.create(name='Pedicure', price=30, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Inventory Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def slot_status(self, slot_time):
+        return SlotInventory.objects.get(master=self.master, date=self.tomorrow, time=slot_time).status
+
+    def test_extend_horizon(self):
+        """
+        Test for checking that the nightly command materializes the rolling horizon
+        """
+        self.assertEqual(extend_horizon(5), 5)
+        self.assertEqual(SlotInventory.objects.filter(master=self.master).count(), 5 * 10)
+        self.assertEqual(extend_horizon(5), 0)
+
+    def test_inventory_follows_appointments(self):
+        """
+        Test for checking that saving, moving and deleting an appointment updates the inventory
+        """
+        extend_horizon(3)
+        appointment = Appointment.objects.create(
+            service=self.service, master=self.master, date=self.tomorrow, time=time(10))
+        self.assertEqual(self.slot_status(time(10)), SlotInventory.BOOKED)
+
+        appointment.time = time(15)
+        appointment.save()
+        self.assertEqual(self.slot_status(time(10)), SlotInventory.FREE)
+        self.assertEqual(self.slot_status(time(15)), SlotInventory.BOOKED)
+
+        appointment.delete()
+        self.assertEqual(self.slot_status(time(15)), SlotInventory.FREE)
+        self.assertEqual(self.master.get_schedule_dict()[str(self.tomorrow)]['15:00:00'], 'available')
+
+
+class IntervalSchedulingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='intervals@example.com', password='test123')
+        cls.short = Service.objects.create(name='Short', price=10, duration=timedelta(hours=1))
+        cls.long = Service.objects.create(name='Long', price=50, duration=timedelta(hours=2, minutes=30))
+        cls.master = Master.objects.create(name='Interval Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        Appointment.objects.create(service=cls.short, master=cls.master, date=cls.tomorrow, time=time(12))
+
+    def test_subtract_intervals(self):
+        """
+        Test for checking the sweep line over working and busy intervals
+        """
+        free = subtract_intervals([(540, 1140)], [(720, 780), (600, 660), (630, 700)])
+        self.assertEqual(free, [(540, 600), (700, 720), (780, 1140)])
+        self.assertEqual(bookable_starts(free, 150, [540, 600, 780, 960, 1020]), [780, 960])
+
+    def test_long_service_does_not_overlap_next_appointment(self):
+        """
+        Test for checking that a 2.5h service is only offered where it fits
+        """
+        day = self.master.get_schedule_dict(service=self.long)[str(self.tomorrow)]
+        self.assertEqual(day['09:00:00'], 'available')
+        self.assertEqual(day['10:00:00'], 'unavailable')
+        self.assertEqual(day['12:00:00'], 'unavailable')
+        self.assertEqual(day['13:00:00'], 'available')
+        self.assertEqual(day['17:00:00'], 'unavailable')
+        self.assertEqual(self.master.get_schedule_dict(service=self.short)[str(self.tomorrow)]['11:00:00'],
+                         'available')
+
+    def test_availability_defines_working_hours(self):
+        """
+        Test for checking that Availability rows replace the default working day
+        """
+        Availability.objects.create(master=self.master, service=self.short, date=self.tomorrow,
+                                    start_time=time(10), end_time=time(14))
+        day = self.master.get_schedule_dict(service=self.short)[str(self.tomorrow)]
+        self.assertEqual([slot for slot, status in day.items() if status == 'available'],
+                         ['10:00:00', '11:00:00', '13:00:00'])
+
+    def test_availability_is_per_service(self):
+        """
+        Test for checking that the Availability rows of one service do not open the day for another service
+        """
+        Availability.objects.create(master=self.master, service=self.short, date=self.tomorrow,
+                                    start_time=time(9), end_time=time(12))
+        Availability.objects.create(master=self.master, service=self.long, date=self.tomorrow,
+                                    start_time=time(14), end_time=time(18))
+        self.assertTrue(is_bookable(self.master, self.short, self.tomorrow, time(10)))
+        self.assertFalse(is_bookable(self.master, self.short, self.tomorrow, time(15)))
+        self.assertTrue(is_bookable(self.master, self.long, self.tomorrow, time(14)))
+        self.assertFalse(is_bookable(self.master, self.long, self.tomorrow, time(9)))
+        day = self.master.get_schedule_dict(service=self.short)[str(self.tomorrow)]
+        self.assertEqual([slot for slot, status in day.items() if status == 'available'],
+                         ['09:00:00', '10:00:00', '11:00:00'])
+        index = AvailabilityIndex.build([self.master.pk], [self.tomorrow])
+        self.assertEqual(index.next_free(self.master.pk, self.long), (self.tomorrow, time(14)))
+        self.assertEqual(index.free_masters(self.tomorrow, time(9), self.long), [])
+
+    def test_form_rejects_overlapping_booking(self):
+        """
+        Test for checking that the appointment form rejects a service that overlaps the next appointment
+        """
+        data = {'service': self.long.pk, 'master': self.master.pk, 'date': self.tomorrow}
+        self.assertFalse(AppointmentForm(dict(data, time='10:00')).is_valid())
+        self.assertTrue(AppointmentForm(dict(data, time='13:00')).is_valid())
+
+
+class AvailabilityIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='bitmap@example.com', password='test123')
+        cls.service = Service.objects.create(name='Gel', price=40, duration=timedelta(hours=2))
+        cls.busy = Master.objects.create(name='Busy Master', user=cls.user)
+        cls.free = Master.objects.create(name='Free Master', user=cls.user)
+        for master in (cls.busy, cls.free):
+            master.services.add(cls.service)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        for hour in (9, 11, 12):
+            Appointment.objects.create(service=cls.service, master=cls.busy, date=cls.tomorrow, time=time(hour))
+        Appointment.objects.create(service=cls.service, master=cls.free, date=cls.tomorrow, time=time(9))
+
+    def test_earliest_slot_across_masters(self):
+        """
+        Test for checking the earliest slot and the masters free at a given time
+        """
+        index = AvailabilityIndex.build([self.busy.pk, self.free.pk], dates=[self.tomorrow])
+        self.assertEqual(index.earliest([self.busy.pk, self.free.pk], self.service),
+                         (self.tomorrow, time(11), [self.free.pk]))
+        self.assertEqual(index.next_free(self.busy.pk, self.service), (self.tomorrow, time(14)))
+        self.assertEqual(index.free_masters(self.tomorrow, time(15), self.service), [self.busy.pk, self.free.pk])
+        self.assertEqual(index.free_masters(self.tomorrow, time(18), self.service), [])
+
+    def test_master_list_shows_next_free_slot(self):
+        """
+        Test for checking that the master list cards show the next free slot
+        """
+        url = reverse('master_list', kwargs={'service_id': self.service.pk})
+        self.client.get(url)
+        # the service, the masters, the inventory and the Availability rows of the service
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, 'Свободно с')
+
+
+class PackageSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='package@example.com', password='test123')
+        cls.manicure = Service.objects.create(name='Manicure', price=20, duration=timedelta(hours=1))
+        cls.pedicure = Service.objects.create(name='Pedicure', price=30, duration=timedelta(minutes=90))
+        cls.both = Master.objects.create(name='Both Master', user=cls.user)
+        cls.both.services.add(cls.manicure, cls.pedicure)
+        cls.feet = Master.objects.create(name='Feet Master', user=cls.user)
+        cls.feet.services.add(cls.pedicure)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def test_single_master_chain_is_preferred(self):
+        """
+        Test for checking that one master doing both services is offered first
+        """
+        chains = find_package_chains([self.manicure, self.pedicure], start_date=self.tomorrow, days=1, limit=1)
+        self.assertEqual(chains[0]['date'], str(self.tomorrow))
+        self.assertEqual([(leg['master'], leg['time'], leg['end']) for leg in chains[0]['legs']],
+                         [(self.both.pk, '09:00', '10:00'), (self.both.pk, '10:00', '11:30')])
+
+    def test_hand_off_to_another_master(self):
+        """
+        Test for checking the hand-off when the first master is busy right after the first service
+        """
+        Appointment.objects.create(service=self.manicure, master=self.both, date=self.tomorrow, time=time(10))
+        chains = find_package_chains([self.manicure, self.pedicure], start_date=self.tomorrow, days=1)
+        first = chains[0]
+        self.assertEqual([(leg['master'], leg['time']) for leg in first['legs']],
+                         [(self.both.pk, '09:00'), (self.feet.pk, '10:00')])
+        self.assertEqual(first['masters'], 2)
+
+    def test_package_search_view(self):
+        """
+        Test for checking the JSON package search endpoint
+        """
+        response = self.client.get(reverse('package_search'), {
+            'services': [self.manicure.pk, self.pedicure.pk], 'date': str(self.tomorrow), 'days': 2,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['chains'])
+        self.assertEqual(self.client.get(reverse('package_search')).status_code, 400)
+        for date in ('garbage', '2023-02-30', '9999-12-30', '0001-01-01'):
+            response = self.client.get(reverse('package_search'), {'services': [self.manicure.pk], 'date': date})
+            self.assertEqual(response.status_code, 400)
+
+    @override_settings(APPOINTMENTS_START_HOUR=20, APPOINTMENTS_END_HOUR=23)
+    def test_package_ending_at_midnight(self):
+        """
+        Test for checking that a package ending at the end of the day is shown as 24:00
+        """
+        night = Master.objects.create(name='Night Master', user=self.user, availability={
+            'weekly': {day: [['20:00', '24:00']] for day in ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')},
+        })
+        night.services.add(self.manicure)
+        chains = find_package_chains([self.manicure, self.manicure], start_date=self.tomorrow, days=1)
+        self.assertEqual([(leg['time'], leg['end']) for leg in chains[-1]['legs']],
+                         [('22:00', '23:00'), ('23:00', '24:00')])
+
+
+class AnyMasterBookingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='any@example.com', password='test123')
+        cls.service = Service.objects.create(name='Any', price=25, duration=timedelta(hours=1))
+        cls.loaded = Master.objects.create(name='Loaded Master', user=cls.user)
+        cls.idle = Master.objects.create(name='Idle Master', user=cls.user)
+        for master in (cls.loaded, cls.idle):
+            master.services.add(cls.service)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        Appointment.objects.create(service=cls.service, master=cls.loaded, date=cls.tomorrow, time=time(9))
+
+    def test_least_loaded_master_is_assigned(self):
+        """
+        Test for checking that the slot goes to the master with the fewest booked minutes
+        """
+        appointment = book_any_master(self.service, self.tomorrow, time(12))
+        self.assertEqual(appointment.master, self.idle)
+        appointment = book_any_master(self.service, self.tomorrow, time(12))
+        self.assertEqual(appointment.master, self.loaded)
+        with self.assertRaises(NoMasterAvailable):
+            book_any_master(self.service, self.tomorrow, time(12))
+
+    def test_past_time_is_not_bookable(self):
+        """
+        Test for checking that no booking path takes a date and time that has already come
+        """
+        past = timezone.localdate() - timedelta(days=3)
+        self.assertFalse(is_bookable(self.idle, self.service, past, time(10)))
+        with self.assertRaises(NoMasterAvailable):
+            book_any_master(self.service, past, time(10))
+        with self.assertRaises(SlotTaken):
+            book_appointment(self.idle, self.service, past, time(10))
+        url = reverse('appointment_create', kwargs={'service_id': self.service.pk, 'pk': self.idle.pk})
+        response = self.client.post(url, {
+            'service': self.service.pk, 'master': self.idle.pk, 'date': past, 'time': '10:00',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Appointment.objects.filter(date=past).exists())
+
+    def test_any_master_booking_view(self):
+        """
+        Test for checking the "any master" form on the service page
+        """
+        url = reverse('any_master_booking', kwargs={'pk': self.service.pk})
+        response = self.client.post(url, {'date': self.tomorrow, 'time': '10:00:00'}, follow=True)
+        self.assertRedirects(response, reverse('appointment_create_success'))
+        self.assertContains(response, '<div class="alert alert-success" role="alert">Запись успешно создана!</div>')
+        self.assertTrue(Appointment.objects.filter(master=self.idle, date=self.tomorrow, time=time(10)).exists())
+
+        Appointment.objects.create(service=self.service, master=self.loaded, date=self.tomorrow, time=time(10))
+        response = self.client.post(url, {'date': self.tomorrow, 'time': '10:00:00'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'нет свободных мастеров')
+
+
+class BookingRaceTest(TransactionTestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create(email='race@example.com', password='test123')
+        self.service = Service.objects.create(name='Race', price=15, duration=timedelta(hours=1))
+        self.master = Master.objects.create(name='Race Master', user=self.user)
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def test_concurrent_bookings_for_one_slot(self):
+        """
+        Test for checking that only one of many concurrent bookings of one slot succeeds
+        """
+        results = []
+        barrier = threading.Barrier(8)
+
+        def book():
+            try:
+                barrier.wait()
+                book_appointment(self.master, self.service, self.tomorrow, time(14))
+                results.append('booked')
+            except SlotTaken:
+                results.append('taken')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=book) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('booked'), 1)
+        self.assertEqual(results.count('taken'), 7)
+        self.assertEqual(Appointment.objects.filter(master=self.master, date=self.tomorrow).count(), 1)
+
+    def test_slot_taken_response(self):
+        """
+        Test for checking the "slot just taken" page with alternatives instead of a server error
+        """
+        Appointment.objects.create(service=self.service, master=self.master, date=self.tomorrow, time=time(14))
+        with self.assertRaises(SlotTaken) as taken:
+            book_appointment(self.master, self.service, self.tomorrow, time(14))
+        self.assertIn((str(self.tomorrow), '09:00'), taken.exception.alternatives)
+
+        response = self.client.post(
+            reverse('master_detail', kwargs={'service_id': self.service.pk, 'pk': self.master.pk}),
+            {'service': self.service.pk, 'master': self.master.pk, 'date': self.tomorrow, 'time': '15:00'},
+        )
+        self.assertEqual(response.status_code, 302)
+
+
+class UniqueSlotMigrationTest(TransactionTestCase):
+    before = [('appointments', '0006_slotinventory_closed_status')]
+    after = [('appointments', '0007_appointment_unique_slot')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_stop_the_migration(self):
+        """
+        Test for checking that the migration lists the appointments booked twice in one slot and keeps them
+        """
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        old_apps = executor.loader.project_state(self.before).apps
+        user = old_apps.get_model('accounts', 'CustomUser').objects.create(email='dup@example.com')
+        service = old_apps.get_model('appointments', 'Service').objects.create(name='Dup', price=10, duration=timedelta(hours=1))
+        master = old_apps.get_model('appointments', 'Master').objects.create(name='Dup Master', user_id=user.pk)
+        Appointment = old_apps.get_model('appointments', 'Appointment')
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        kept, duplicate, other = (
+            Appointment.objects.create(service=service, master=master, date=tomorrow, time=time(hour))
+            for hour in (10, 10, 11)
+        )
+
+        with self.assertRaisesMessage(RuntimeError, f'appointments [{kept.pk}, {duplicate.pk}]'):
+            MigrationExecutor(connection).migrate(self.after)
+        self.assertEqual(Appointment.objects.count(), 3)
+
+        duplicate.delete()
+        MigrationExecutor(connection).migrate(self.after)
+        Appointment = MigrationExecutor(connection).loader.project_state(self.after).apps.get_model(
+            'appointments', 'Appointment')
+        self.assertEqual(sorted(Appointment.objects.values_list('pk', flat=True)), [kept.pk, other.pk])
+
+
+class IdempotencyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='retry@example.com', password='test123')
+        cls.service = Service.objects.create(name='Retry', price=15, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Retry Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        cls.url = reverse('appointment_create', kwargs={'service_id': cls.service.pk, 'pk': cls.master.pk})
+
+    def post(self, key, time='10:00'):
+        return self.client.post(self.url, {
+            'service': self.service.pk, 'master': self.master.pk, 'date': self.tomorrow, 'time': time,
+            'idempotency_key': key,
+        })
+
+    def test_retry_gets_original_response(self):
+        """
+        Test for checking that a resubmitted booking is answered from the stored response
+        """
+        first = self.post('abc')
+        self.assertRedirects(first, reverse('appointment_create_success'), fetch_redirect_response=False)
+        with self.assertNumQueries(1):
+            retry = self.post('abc')
+        self.assertEqual(retry.status_code, 302)
+        self.assertEqual(retry['Location'], first['Location'])
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Appointment.objects.filter(master=self.master).count(), 1)
+
+        # another key is a new submission and finds the slot taken
+        self.assertEqual(self.post('def').status_code, 200)
+
+    def test_key_reused_for_other_data_is_refused(self):
+        """
+        Test for checking that a key sent again with another time is refused instead of replayed
+        """
+        self.assertEqual(self.post('abc').status_code, 302)
+        response = self.post('abc', time='15:00')
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(list(Appointment.objects.values_list('time', flat=True)), [time(10)])
+
+    def test_expired_keys_are_purged(self):
+        """
+        Test for checking that expired keys are not replayed and are purged in bulk
+        """
+        self.post('old')
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(purge_expired_keys(), 1)
+        self.assertEqual(IdempotencyKey.objects.count(), 0)
+
+
+class SlotHoldTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='hold@example.com', password='test123')
+        cls.service = Service.objects.create(name='Hold', price=15, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Hold Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def test_held_slot_is_unavailable_for_others(self):
+        """
+        Test for checking that a held slot is unavailable for other clients but bookable by its owner
+        """
+        hold = hold_slot(self.master, self.service, self.tomorrow, time(11))
+        self.assertEqual(self.master.get_schedule_dict()[str(self.tomorrow)]['11:00:00'], 'unavailable')
+        with self.assertRaises(SlotTaken):
+            hold_slot(self.master, self.service, self.tomorrow, time(11))
+        with self.assertRaises(SlotTaken):
+            book_appointment(self.master, self.service, self.tomorrow, time(11))
+
+        book_appointment(self.master, self.service, self.tomorrow, time(11), hold_token=hold.token)
+        self.assertFalse(SlotHold.objects.exists())
+
+    def test_expired_holds_are_swept_in_bulk(self):
+        """
+        Test for checking that expired holds free their slots and are deleted with a fixed number of queries
+        """
+        for hour in (10, 12, 14):
+            hold_slot(self.master, self.service, self.tomorrow, time(hour))
+        past = timezone.now() - timedelta(seconds=1)
+        SlotHold.objects.update(expires_at=past)
+        SlotInventory.objects.filter(status=SlotInventory.HELD).update(held_until=past)
+        # an expired hold does not block the slot even before the sweep
+        self.assertEqual(self.master.get_schedule_dict()[str(self.tomorrow)]['10:00:00'], 'available')
+        with self.assertNumQueries(3):
+            self.assertEqual(sweep_expired_holds(), 3)
+        self.assertFalse(SlotInventory.objects.filter(status=SlotInventory.HELD).exists())
+
+    def test_hold_view_keeps_token_in_session(self):
+        """
+        Test for checking the hold endpoint used by the booking page
+        """
+        url = reverse('slot_hold', kwargs={'service_id': self.service.pk, 'pk': self.master.pk})
+        response = self.client.post(url, {'date': self.tomorrow, 'time': '15:00'})
+        self.assertEqual(response.status_code, 200)
+        token = self.client.session['slot_hold']
+        self.client.post(url, {'date': self.tomorrow, 'time': '16:00'})
+        self.assertFalse(SlotHold.objects.filter(token=token).exists())
+        self.assertEqual(SlotHold.objects.get().time, time(16))
+
+        # a taken time keeps the previous hold and its token, so the client can still book or release it
+        hold_slot(self.master, self.service, self.tomorrow, time(12))
+        self.assertEqual(self.client.post(url, {'date': self.tomorrow, 'time': '12:00'}).status_code, 409)
+        token = self.client.session['slot_hold']
+        self.assertEqual(SlotHold.objects.get(token=token).time, time(16))
+
+        response = self.client.post(
+            reverse('appointment_create', kwargs={'service_id': self.service.pk, 'pk': self.master.pk}),
+            {'service': self.service.pk, 'master': self.master.pk, 'date': self.tomorrow, 'time': '16:00'},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(SlotHold.objects.filter(token=token).exists())
+
+
+class AvailabilityEndpointTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='json@example.com', password='test123')
+        cls.service = Service.objects.create(name='Json', price=15, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Json Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        cls.url = reverse('master_availability', kwargs={
+            'service_id': cls.service.pk, 'pk': cls.master.pk, 'date': str(cls.tomorrow)})
+
+    def test_availability_of_one_date(self):
+        """
+        Test for checking the JSON availability of one master and one date
+        """
+        Appointment.objects.create(service=self.service, master=self.master, date=self.tomorrow, time=time(9))
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['date'], str(self.tomorrow))
+        self.assertEqual(data['slots']['09:00:00'], 'unavailable')
+        self.assertEqual(data['available'][0], '10:00')
+
+    def test_date_outside_horizon_is_refused(self):
+        """
+        Test for checking that dates before today or beyond the booking horizon are answered with 400
+        and do not fill the slot inventory
+        """
+        for date in ('9999-12-31', '0001-01-01', '2400-01-01', str(timezone.localdate() - timedelta(days=1))):
+            url = reverse('master_availability', kwargs={
+                'service_id': self.service.pk, 'pk': self.master.pk, 'date': date})
+            self.assertEqual(self.client.get(url).status_code, 400)
+        self.assertFalse(SlotInventory.objects.exists())
+        with self.assertRaises(ValueError):
+            read_inventory_bulk([self.master.pk], [timezone.localdate() + timedelta(days=365)])
+
+    def test_conditional_get(self):
+        """
+        Test for checking that an unchanged day is answered with 304 and a booking changes the ETag
+        """
+        first = self.client.get(self.url)
+        self.assertIn('ETag', first)
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+        Appointment.objects.create(service=self.service, master=self.master, date=self.tomorrow, time=time(9))
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+        self.assertIn('Last-Modified', changed)
+
+    def test_create_page_loads_times_lazily(self):
+        """
+        Test for checking that the booking page no longer embeds the whole schedule
+        """
+        response = self.client.get(reverse('appointment_create', kwargs={
+            'service_id': self.service.pk, 'pk': self.master.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'eval(')
+        self.assertContains(response, '/availability/0000-00-00/')
+
+
+class WorkingHoursTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='hours@example.com', password='test123')
+        cls.service = Service.objects.create(name='Hours', price=15, duration=timedelta(hours=1))
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        weekday = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'][cls.tomorrow.weekday()]
+        cls.template = {'weekly': {weekday: [['10:00', '12:00']]}}
+        cls.master = Master.objects.create(name='Hours Master', user=cls.user, availability=cls.template)
+
+    def test_template_limits_the_day(self):
+        """
+        Test for checking that the weekly template sets the working hours of the day
+        """
+        day = self.master.get_schedule_dict(service=self.service)[str(self.tomorrow)]
+        self.assertEqual([slot for slot, status in day.items() if status == 'available'], ['10:00:00', '11:00:00'])
+
+    def test_exception_closes_the_day(self):
+        """
+        Test for checking that an exception date is a day off and the inventory is refreshed
+        """
+        self.master.get_schedule_dict(service=self.service)
+        self.master.availability = dict(self.template, exceptions={str(self.tomorrow): []})
+        self.master.save()
+        day = self.master.get_schedule_dict(service=self.service)[str(self.tomorrow)]
+        self.assertNotIn('available', day.values())
+
+    def test_form_rejects_wrong_template(self):
+        """
+        Test for checking that the master form validates the template
+        """
+        form = MasterForm(data={'name': 'Wrong', 'availability': '{"weekly": {"mon": [["19:00", "09:00"]]}}'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('availability', form.errors)
+        form = MasterForm(data={'name': 'Wrong', 'availability': '{"exceptions": {"2030-01-01": []}}'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('weekly', form.errors['availability'][0])
+
+    def test_stored_wrong_template_is_logged(self):
+        """
+        Test for checking that a wrong stored template is logged and read as the default hours
+        """
+        with self.assertLogs('appointments.working_hours', 'ERROR') as logs:
+            self.assertIsNone(compiled_working_hours({'exceptions': {str(self.tomorrow): []}}))
+        self.assertIn('weekly', logs.output[0])
+
+
+class ScheduleImportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='import@example.com', password='test123')
+        cls.service = Service.objects.create(name='Import', price=15, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Import Master', user=cls.user)
+        cls.master.services.add(cls.service)
+
+    def test_json_is_decoded_in_chunks(self):
+        """
+        Test for checking that a JSON array is imported record by record from small chunks
+        """
+        rows = [
+            {'master': self.master.pk, 'service': 'Import', 'date': '2030-01-0%d' % day,
+             'start_time': '10:00', 'end_time': '12:00'}
+            for day in range(1, 10)
+        ]
+        text = io.StringIO(json.dumps(rows))
+        self.assertEqual(len(list(iter_json(text, chunk_size=16))), 9)
+        result = import_schedule_file(io.BytesIO(json.dumps(rows).encode()), name='rows.json', batch_size=4)
+        self.assertEqual(result.created, 9)
+        self.assertEqual(Availability.objects.filter(master=self.master).count(), 9)
+
+    def test_csv_reports_row_errors(self):
+        """
+        Test for checking that wrong CSV rows are reported and the others are imported
+        """
+        content = (
+            'master,service,date,start_time,end_time\n'
+            f'{self.master.pk},Import,2030-01-01,10:00,12:00\n'
+            'Nobody,Import,2030-01-01,10:00,12:00\n'
+            'Import Master,Import,2030-01-02,12:00,10:00\n'
+        )
+        result = import_schedule_file(io.BytesIO(content.encode()), name='rows.csv')
+        self.assertEqual(result.created, 1)
+        self.assertEqual([number for number, _ in result.errors], [2, 3])
+
+    def test_ical_for_one_master(self):
+        """
+        Test for checking that the events of an iCal file become availability of the given master
+        """
+        content = (
+            'BEGIN:VCALENDAR\r\nBEGIN:VEVENT\r\nSUMMARY:Imp\r\n ort\r\n'
+            'DTSTART:20300101T100000\r\nDTEND:20300101T130000\r\nEND:VEVENT\r\nEND:VCALENDAR\r\n'
+        )
+        result = import_schedule_file(io.BytesIO(content.encode()), name='anna.ics', master=self.master)
+        self.assertEqual(result.created, 1)
+        availability = Availability.objects.get(master=self.master)
+        self.assertEqual((availability.start_time, availability.end_time), (time(10), time(13)))
+
+    def test_command(self):
+        """
+        Test for checking the import_schedules management command
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as file:
+            file.write('{"service": "Import", "date": "2030-01-01", "start_time": "09:00", "end_time": "11:00"}\n')
+        self.addCleanup(os.remove, file.name)
+        out = io.StringIO()
+        call_command('import_schedules', file.name, master=self.master.pk, stdout=out)
+        self.assertIn('импортировано 1', out.getvalue())
+
+
+class AppointmentRangeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='range@example.com', password='test123')
+        cls.service = Service.objects.create(name='Range', price=15, duration=timedelta(minutes=90))
+        cls.master = Master.objects.create(name='Range Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        cls.appointment = Appointment.objects.create(
+            service=cls.service, master=cls.master, date=cls.tomorrow, time=time(10))
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return ' '.join(str(row[-1]) for row in cursor.fetchall())
+
+    def test_start_and_end_are_derived(self):
+        """
+        Test for checking that start and end follow the date, the time and the service duration
+        """
+        self.assertEqual(timezone.localtime(self.appointment.start).time(), time(10))
+        self.assertEqual(self.appointment.end - self.appointment.start, timedelta(minutes=90))
+        start = self.appointment.start
+        self.assertTrue(Appointment.objects.overlapping([self.master], start + timedelta(hours=1),
+                                                        start + timedelta(hours=2)).exists())
+        self.assertFalse(Appointment.objects.overlapping([self.master], self.appointment.end,
+                                                         start + timedelta(hours=3)).exists())
+
+    def test_backfill_in_batches(self):
+        """
+        Test for checking that the migration fills start and end of the existing rows
+        """
+        Appointment.objects.create(service=self.service, master=self.master, date=self.tomorrow, time=time(14))
+        Appointment.objects.update(start=None, end=None)
+        migration = importlib.import_module('appointments.migrations.0011_appointment_start_end')
+        batch_size, migration.BATCH_SIZE = migration.BATCH_SIZE, 1
+        try:
+            migration.backfill_bounds(apps, None)
+        finally:
+            migration.BATCH_SIZE = batch_size
+        self.assertFalse(Appointment.objects.filter(start=None).exists())
+        self.assertEqual(Appointment.objects.get(pk=self.appointment.pk).end, self.appointment.end)
+
+    def test_hot_queries_use_indexes(self):
+        """
+        Test for checking with EXPLAIN QUERY PLAN that the schedule queries use the composite indexes
+        """
+        with CaptureQueriesContext(connection) as queries:
+            load_day_intervals([(self.master.pk, self.tomorrow)], holds=False)
+        appointments, = [query['sql'] for query in queries if 'FROM "appointments_appointment"' in query['sql']]
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + appointments)
+            self.assertIn('appointment_master_start_idx', ' '.join(str(row[-1]) for row in cursor.fetchall()))
+        availability = Availability.objects.filter(
+            master_id__in=[self.master.pk], date__range=(self.tomorrow, self.tomorrow + timedelta(days=9)))
+        self.assertIn('availability_master_date_idx', self.explain(availability))
+
+    def test_busy_time_comes_from_start_and_end(self):
+        """
+        Test for checking that the busy interval of the day is read from the start and end of the appointment
+        """
+        working, busy = load_day_intervals([(self.master.pk, self.tomorrow)], holds=False)[
+            (self.master.pk, self.tomorrow)]
+        self.assertEqual(busy, [(600, 690)])
+
+
+class CalendarFeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='feed@example.com', password='test123')
+        cls.service = Service.objects.create(name='Feed', price=15, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Feed Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        cls.url = reverse('master_calendar', kwargs={'pk': cls.master.pk, 'token': cls.master.calendar_token})
+
+    def setUp(self):
+        Appointment.objects.create(service=self.service, master=self.master, date=self.tomorrow, time=time(10))
+        Appointment.objects.create(
+            service=self.service, master=self.master, date=self.tomorrow + timedelta(days=5), time=time(11))
+
+    def test_feed_is_streamed(self):
+        """
+        Test for checking that the feed is a streamed calendar with one event per appointment
+        """
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertTrue(content.startswith('BEGIN:VCALENDAR'))
+        self.assertEqual(content.count('BEGIN:VEVENT'), 2)
+        self.assertIn('SUMMARY:Feed', content)
+
+        ranged = self.client.get(self.url, {'from': str(self.tomorrow), 'to': str(self.tomorrow)})
+        self.assertEqual(b''.join(ranged.streaming_content).decode().count('BEGIN:VEVENT'), 1)
+        self.assertEqual(self.client.get(self.url, {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'from': '0001-01-01'}).status_code, 400)
+
+    def test_feed_needs_the_calendar_token(self):
+        """
+        Test for checking that the feed is only served at the URL with the master's secret token
+        """
+        other = Master.objects.create(name='Other Master', user=self.user)
+        self.assertNotEqual(other.calendar_token, self.master.calendar_token)
+        for token in ('guess', other.calendar_token):
+            url = reverse('master_calendar', kwargs={'pk': self.master.pk, 'token': token})
+            self.assertEqual(self.client.get(url).status_code, 404)
+            etag = self.client.get(self.url)['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+    def test_conditional_get(self):
+        """
+        Test for checking that a polling client gets 304 until the bookings change
+        """
+        first = self.client.get(self.url)
+        with self.assertNumQueries(1):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        Appointment.objects.create(service=self.service, master=self.master, date=self.tomorrow, time=time(15))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_etag_follows_names(self):
+        """
+        Test for checking that renaming the master or a service of its appointments changes the ETag
+        """
+        etag = self.client.get(self.url)['ETag']
+        self.master.name = 'Renamed Master'
+        self.master.save()
+        renamed = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(renamed.status_code, 200)
+        self.service.name = 'Renamed Feed'
+        self.service.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=renamed['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('SUMMARY:Renamed Feed', b''.join(response.streaming_content).decode())
+
+    def test_feed_includes_archive(self):
+        """
+        Test for checking that the archived appointments stay in the feed
+        """
+        Appointment.objects.create(service=self.service, master=self.master,
+                                   date=self.tomorrow - timedelta(days=400), time=time(10))
+        archive_batch(archive_cutoff(days=365))
+        content = b''.join(self.client.get(self.url).streaming_content).decode()
+        self.assertEqual(content.count('BEGIN:VEVENT'), 3)
+
+
+class SchedulerBridgeTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='bridge@example.com', password='test123')
+        cls.service = Service.objects.create(name='Bridge', price=15, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Bridge Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def test_appointment_changes_are_synced(self):
+        """
+        Test for checking that saving and deleting an appointment updates only its event
+        """
+        appointment = Appointment.objects.create(
+            service=self.service, master=self.master, date=self.tomorrow, time=time(10))
+        event = Event.objects.get(appointment=appointment)
+        self.assertEqual(event.calendar.slug, self.master.calendar_slug)
+        self.assertEqual((event.start, event.end, event.title), (appointment.start, appointment.end, 'Bridge'))
+
+        appointment.time = time(12)
+        appointment.save()
+        self.assertEqual(Event.objects.get().start, appointment.start)
+        appointment.delete()
+        self.assertFalse(Event.objects.exists())
+
+    def test_backfill(self):
+        """
+        Test for checking that the backfill command creates the missing calendars and events in batches
+        """
+        for hour in (10, 11, 12):
+            Appointment.objects.create(service=self.service, master=self.master, date=self.tomorrow, time=time(hour))
+        Appointment.objects.update(event=None)
+        Event.objects.all().delete()
+        Master.objects.update(calendar=None)
+        Calendar.objects.all().delete()
+
+        out = io.StringIO()
+        call_command('backfill_scheduler', batch_size=2, stdout=out)
+        self.assertIn('Created 1 calendars and 3 events', out.getvalue())
+        self.assertEqual(Event.objects.filter(calendar__master=self.master).count(), 3)
+        self.assertFalse(Appointment.objects.filter(event=None).exists())
+
+
+class RecordingBroker:
+    messages = []
+
+    def publish(self, channel, message):
+        self.messages.append((channel, message))
+
+
+class LiveUpdatesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='live@example.com', password='test123')
+        cls.service = Service.objects.create(name='Live', price=15, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Live Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def setUp(self):
+        get_broker.cache_clear()
+        self.addCleanup(get_broker.cache_clear)
+
+    def test_booking_publishes_taken_slot(self):
+        """
+        Test for checking that a booking publishes the taken slot after the commit
+        """
+        self.master.get_schedule_dict()
+        RecordingBroker.messages = []
+        with self.settings(APPOINTMENTS_LIVE_BROKER='appointments.tests.RecordingBroker'):
+            with self.captureOnCommitCallbacks(execute=True):
+                Appointment.objects.create(service=self.service, master=self.master, date=self.tomorrow, time=time(9))
+        self.assertEqual(RecordingBroker.messages, [
+            (f'master-{self.master.pk}', {'date': str(self.tomorrow), 'taken': ['09:00:00'], 'freed': []}),
+        ])
+
+    def test_event_stream(self):
+        """
+        Test for checking that the ASGI application streams a published change and stops on disconnect
+        """
+        from mysite.asgi import application
+
+        async def scenario():
+            disconnect = asyncio.Event()
+            sent = []
+
+            async def receive():
+                await disconnect.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': f'/appointments/masters/{self.master.pk}/events/'}
+            stream = asyncio.ensure_future(application(scope, receive, send))
+            while len(sent) < 2:
+                await asyncio.sleep(0)
+            await asyncio.to_thread(publish_slots, self.master.pk, self.tomorrow, [time(9)], [])
+            while len(sent) < 3:
+                await asyncio.sleep(0.01)
+            disconnect.set()
+            await asyncio.wait_for(stream, 1)
+            return sent
+
+        sent = asyncio.run(scenario())
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(sent[2]['body'], format_event({'date': str(self.tomorrow), 'taken': ['09:00:00'], 'freed': []}))
+        self.assertFalse(get_broker().subscribers)
+
+
+class StaffGridTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='grid@example.com', password='test123')
+        cls.staff = CustomUser.objects.create(username='grid-staff', email='staff@example.com', is_staff=True)
+        cls.service = Service.objects.create(name='Grid', price=15, duration=timedelta(hours=2))
+        cls.masters = [Master.objects.create(name=f'Grid Master {number:02d}', user=cls.user) for number in range(50)]
+        cls.today = timezone.localdate()
+        for master in cls.masters:
+            for hour in (9, 12, 15):
+                Appointment.objects.create(service=cls.service, master=master, date=cls.today, time=time(hour))
+
+    def setUp(self):
+        cache.clear()
+
+    # a memory cache, so that only the queries of the grid itself are counted
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_grid_from_one_query(self):
+        """
+        Test for checking that the grid of 50 masters is built with one query and then cached
+        """
+        with self.assertNumQueries(1):
+            (day, grid), = staff_grid(self.today)
+        self.assertEqual(len(grid['masters']), 50)
+        cells = grid['masters'][0]['cells']
+        self.assertEqual(cells[0]['span'], 2)
+        self.assertEqual(cells[1], 'busy')
+        self.assertIsNone(cells[2])
+        with self.assertNumQueries(0):
+            staff_grid(self.today)
+
+    def test_booking_invalidates_the_day(self):
+        """
+        Test for checking that a new booking drops the cached grid of its day
+        """
+        staff_grid(self.today)
+        Appointment.objects.filter(master=self.masters[0], time=time(12)).delete()
+        (day, grid), = staff_grid(self.today)
+        self.assertIsNone(grid['masters'][0]['cells'][3])
+
+    def test_staff_only(self):
+        """
+        Test for checking that only staff can open the grid page
+        """
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('staff_grid')).status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('staff_grid'), {'week': '1'})
+        self.assertContains(response, 'Grid Master 49')
+        self.assertEqual(len(response.context['grids']), 7)
+
+
+class BulkBookingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(email='bulk@example.com', password='test123')
+        cls.staff = CustomUser.objects.create(username='bulk-staff', email='bulk-staff@example.com',
+                                              is_staff=True, is_superuser=True)
+        cls.service = Service.objects.create(name='Bulk', price=15, duration=timedelta(hours=2))
+        cls.masters = [Master.objects.create(name=f'Bulk Master {number}', user=cls.user) for number in range(2)]
+        for master in cls.masters:
+            master.services.add(cls.service)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def row(self, master, hour, **extra):
+        return dict({'master': master.pk, 'service': self.service.pk, 'date': str(self.tomorrow),
+                     'time': f'{hour:02d}:00'}, **extra)
+
+    def test_batch_is_checked_in_memory(self):
+        """
+        Test for checking that the rows are checked against the bookings and against each other
+        """
+        first, second = self.masters
+        Appointment.objects.create(service=self.service, master=first, date=self.tomorrow, time=time(9))
+        rows = [
+            self.row(first, 10),   # overlaps the existing 9:00-11:00 appointment
+            self.row(first, 11),
+            self.row(first, 12),   # overlaps the row above
+            self.row(second, 12),
+            self.row(second, 18),  # does not fit before the end of the day
+            self.row(second, 14, date='yesterday'),
+        ]
+        # the number of queries does not depend on the number of rows
+        with self.assertNumQueries(10):
+            report, appointments = _book_batch(rows)
+        self.assertEqual([line['status'] for line in report],
+                         ['rejected', 'accepted', 'rejected', 'accepted', 'rejected', 'rejected'])
+        self.assertEqual(Appointment.objects.count(), 3)
+        self.assertEqual(Appointment.objects.get(pk=report[1]['appointment']).end - appointments[0].start,
+                         timedelta(hours=2))
+
+    def test_endpoint_report_and_side_effects(self):
+        """
+        Test for checking the JSON endpoint and that the inventory and the calendar follow the batch
+        """
+        first, _ = self.masters
+        first.get_schedule_dict()
+        self.client.force_login(self.staff)
+        response = self.client.post(reverse('bulk_booking'), {'rows': [self.row(first, 10), self.row(first, 10)]},
+                                    content_type='application/json')
+        self.assertEqual(response.json()['accepted'], 1)
+        self.assertEqual(response.json()['rows'][1]['error'], 'Это время недоступно для выбранной услуги.')
+        slot = SlotInventory.objects.get(master=first, date=self.tomorrow, time=time(10))
+        self.assertEqual(slot.status, SlotInventory.BOOKED)
+        self.assertEqual(Event.objects.count(), 1)
+
+    def test_admin_screen(self):
+        """
+        Test for checking the bulk booking screen of the admin site
+        """
+        self.client.force_login(self.staff)
+        url = reverse('admin:appointments_appointment_bulk')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        data = {'form-TOTAL_FORMS': '2', 'form-INITIAL_FORMS': '0',
+                'form-0-master': self.masters[0].pk, 'form-0-service': self.service.pk,
+                'form-0-date': str(self.tomorrow), 'form-0-time': '10:00:00'}
+        response = self.client.post(url, data)
+        self.assertContains(response, 'Записано')
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class MyAppointmentsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='mine', email='mine@example.com')
+        cls.other = CustomUser.objects.create(username='other', email='other@example.com')
+        cls.service = Service.objects.create(name='Mine', price=10, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Mine Master', user=cls.other)
+        cls.master.services.add(cls.service)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        cls.yesterday = timezone.localdate() - timedelta(days=1)
+
+    def book(self, date, hour, client=None):
+        return Appointment.objects.create(service=self.service, master=self.master, date=date, time=time(hour),
+                                          client=client or self.user)
+
+    def test_booking_sets_client(self):
+        """
+        Test for checking that a booking of a logged-in user belongs to the user
+        """
+        self.client.force_login(self.user)
+        url = reverse('master_detail', kwargs={'pk': self.master.pk, 'service_id': self.service.pk})
+        self.client.post(url, {'service': self.service.pk, 'master': self.master.pk, 'date': self.tomorrow,
+                               'time': '10:00'})
+        self.assertEqual(Appointment.objects.get().client, self.user)
+
+    def test_cursor_round_trip(self):
+        """
+        Test for checking the encoding of the page cursor
+        """
+        appointment = self.book(self.tomorrow, 10)
+        self.assertEqual(decode_cursor(encode_cursor(appointment.start, appointment.pk)),
+                         (appointment.start, appointment.pk))
+        self.assertIsNone(decode_cursor('broken'))
+
+    def test_upcoming_pages(self):
+        """
+        Test for checking that the upcoming bookings are paged in order without gaps
+        """
+        booked = [self.book(self.tomorrow + timedelta(days=day), hour) for day in range(3) for hour in (10, 12, 14)]
+        self.book(self.tomorrow, 16, client=self.other)
+        self.book(self.yesterday, 10)
+        self.client.force_login(self.user)
+        url = reverse('my_appointments')
+        seen, cursor = [], None
+        while True:
+            response = self.client.get(url, {'after': cursor} if cursor else {})
+            seen += response.context['appointments']
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+            self.assertLessEqual(len(response.context['appointments']), 20)
+        self.assertEqual(seen, booked)
+
+    def test_past_tab_and_cancel(self):
+        """
+        Test for checking the past tab and that only the own upcoming bookings can be cancelled
+        """
+        past = self.book(self.yesterday, 10)
+        upcoming = self.book(self.tomorrow, 10)
+        foreign = self.book(self.tomorrow, 12, client=self.other)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('my_appointments'), {'tab': 'past'})
+        self.assertEqual(response.context['appointments'], [past])
+        self.assertEqual(self.client.post(reverse('appointment_cancel', args=[foreign.pk])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('appointment_cancel', args=[past.pk])).status_code, 404)
+        response = self.client.post(reverse('appointment_cancel', args=[upcoming.pk]))
+        self.assertRedirects(response, reverse('my_appointments'))
+        self.assertFalse(Appointment.objects.filter(pk=upcoming.pk).exists())
+
+    def test_login_required_and_profile_link(self):
+        """
+        Test for checking that the page needs a login and is linked from the own profile
+        """
+        response = self.client.get(reverse('my_appointments'))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('profile', kwargs={'pk': self.user.pk}))
+        self.assertContains(response, reverse('my_appointments'))
+
+
+class AppointmentExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='export', email='export@example.com')
+        cls.staff = CustomUser.objects.create(username='export-staff', email='export-staff@example.com',
+                                              is_staff=True, is_superuser=True)
+        cls.service = Service.objects.create(name='Export & Co', price=1500, duration=timedelta(minutes=90))
+        cls.master = Master.objects.create(name='Export Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+        for day in range(3):
+            Appointment.objects.create(service=cls.service, master=cls.master, client=cls.user,
+                                       date=cls.tomorrow + timedelta(days=day), time=time(10))
+
+    def test_csv_range(self):
+        """
+        Test for checking the CSV export of a date range
+        """
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('appointment_export'), {
+            'from': str(self.tomorrow), 'to': str(self.tomorrow + timedelta(days=1)),
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split(',')[1:], [str(self.tomorrow), '10:00:00', 'Export Master', 'Export & Co',
+                                                   '1500', '90', 'export@example.com'])
+
+    def test_csv_formulas_are_escaped(self):
+        """
+        Test for checking that the text cells starting a formula are exported as text
+        """
+        Master.objects.filter(pk=self.master.pk).update(name='=HYPERLINK("x")')
+        CustomUser.objects.filter(pk=self.user.pk).update(email='@export@example.com')
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('appointment_export'),
+                                   {'from': str(self.tomorrow), 'to': str(self.tomorrow)})
+        row = next(csv.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()[1:]))
+        self.assertEqual((row[3], row[7]), ('\'=HYPERLINK("x")', "'@export@example.com"))
+        self.assertEqual(row[5], '1500')
+
+    def test_xlsx_workbook(self):
+        """
+        Test for checking that the XLSX export is a workbook with a row per appointment
+        """
+        workbook = zipfile.ZipFile(io.BytesIO(b''.join(iter_xlsx())))
+        self.assertIsNone(workbook.testzip())
+        sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row '), 4)
+        self.assertIn('Export &amp; Co', sheet)
+        self.assertIn('<c s="2"><v>0.4166666666666667</v></c>', sheet)
+
+    def test_staff_only_and_bad_input(self):
+        """
+        Test for checking that the export is for staff only and validates the parameters
+        """
+        url = reverse('appointment_export')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(url, {'format': 'pdf'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': 'yesterday'}).status_code, 400)
+
+    def test_admin_action(self):
+        """
+        Test for checking the export action of the appointment admin
+        """
+        self.client.force_login(self.staff)
+        response = self.client.post(reverse('admin:appointments_appointment_changelist'), {
+            'action': 'export_xlsx', '_selected_action': list(Appointment.objects.values_list('pk', flat=True)),
+        })
+        self.assertEqual(response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.assertTrue(zipfile.is_zipfile(io.BytesIO(b''.join(response.streaming_content))))
+
+
+class DailyRollupTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='rollup', email='rollup@example.com')
+        cls.staff = CustomUser.objects.create(username='rollup-staff', email='rollup-staff@example.com',
+                                              is_staff=True)
+        cls.service = Service.objects.create(name='Rollup', price=1200, duration=timedelta(minutes=150))
+        cls.busy = Master.objects.create(name='Busy Master', user=cls.user)
+        cls.idle = Master.objects.create(name='Idle Master', user=cls.user)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def test_booking_updates_rollup(self):
+        """
+        Test for checking that a booking and its cancellation update the rollup of the day
+        """
+        appointment = Appointment.objects.create(service=self.service, master=self.busy, date=self.tomorrow,
+                                                 time=time(10))
+        Appointment.objects.create(service=self.service, master=self.busy, date=self.tomorrow, time=time(14))
+        rollup = DailyRollup.objects.get(master=self.busy, date=self.tomorrow)
+        self.assertEqual((rollup.bookings, rollup.booked_minutes, rollup.revenue, rollup.available_minutes),
+                         (2, 300, 2400, 600))
+        self.assertEqual(rollup.occupancy, 50)
+        appointment.delete()
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.bookings, rollup.revenue), (1, 1200))
+
+    def test_working_hours_update_rollup(self):
+        """
+        Test for checking that the working minutes follow the availability of the day
+        """
+        Appointment.objects.create(service=self.service, master=self.busy, date=self.tomorrow, time=time(10))
+        Availability.objects.create(master=self.busy, service=self.service, date=self.tomorrow,
+                                    start_time=time(10), end_time=time(15))
+        rollup = DailyRollup.objects.get(master=self.busy, date=self.tomorrow)
+        self.assertEqual((rollup.available_minutes, rollup.occupancy), (300, 50))
+
+    def test_rebuild_matches_signals(self):
+        """
+        Test for checking that the bulk rebuild gives the rollups kept by the signals and covers the idle days
+        """
+        for day in range(3):
+            Appointment.objects.create(service=self.service, master=self.busy,
+                                       date=self.tomorrow + timedelta(days=day), time=time(10))
+        fields = ('master_id', 'date', 'bookings', 'booked_minutes', 'revenue', 'available_minutes')
+        kept = set(DailyRollup.objects.values_list(*fields))
+        DailyRollup.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_rollups', batch_size=2, stdout=out)
+        self.assertIn('Rebuilt 6 rollups', out.getvalue())
+        self.assertEqual(set(DailyRollup.objects.filter(master=self.busy).values_list(*fields)), kept)
+        self.assertEqual(DailyRollup.objects.filter(master=self.idle, bookings=0, available_minutes=600).count(), 3)
+        self.assertEqual(rebuild_rollups(self.tomorrow, self.tomorrow), 2)
+        self.assertEqual(DailyRollup.objects.count(), 6)
+
+    def test_rollups_follow_the_schedule(self):
+        """
+        Test for checking that a service without a duration takes one slot and deleted masters get no idle days
+        """
+        quick = Service.objects.create(name='Quick', price=100, duration=timedelta(0))
+        Appointment.objects.create(service=quick, master=self.busy, date=self.tomorrow, time=time(10))
+        rollup = DailyRollup.objects.get(master=self.busy, date=self.tomorrow)
+        self.assertEqual(rollup.booked_minutes, 60)
+        self.idle.soft_delete()
+        self.assertEqual(rebuild_rollups(self.tomorrow, self.tomorrow + timedelta(days=1), batch_size=1), 2)
+        self.assertFalse(DailyRollup.objects.filter(master=self.idle).exists())
+        self.assertEqual(DailyRollup.objects.get(master=self.busy, date=self.tomorrow).booked_minutes, 60)
+
+    def test_dashboard_reads_rollups(self):
+        """
+        Test for checking the staff dashboard totals
+        """
+        Appointment.objects.create(service=self.service, master=self.busy, date=self.tomorrow, time=time(10))
+        rebuild_rollups(self.tomorrow, self.tomorrow)
+        with self.assertNumQueries(3):
+            data = dashboard(self.tomorrow, self.tomorrow)
+        self.assertEqual([row['master__name'] for row in data['masters']], ['Busy Master', 'Idle Master'])
+        self.assertEqual((data['total']['total_revenue'], data['total']['occupancy']), (1200, 12))
+        url = reverse('staff_dashboard')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {'from': str(self.tomorrow), 'to': str(self.tomorrow)})
+        self.assertContains(response, 'Busy Master')
+        self.assertEqual(response.context['total']['total_bookings'], 1)
+
+
+class ArchiveTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='archive', email='archive@example.com')
+        cls.staff = CustomUser.objects.create(username='archive-staff', email='archive-staff@example.com',
+                                              is_staff=True)
+        cls.service = Service.objects.create(name='Archive', price=700, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Archive Master', user=cls.user)
+        today = timezone.localdate()
+        cls.old_day = today - timedelta(days=400)
+        cls.old = [
+            Appointment.objects.create(service=cls.service, master=cls.master, client=cls.user, date=cls.old_day,
+                                       time=time(hour))
+            for hour in (10, 12, 14)
+        ]
+        cls.recent = Appointment.objects.create(service=cls.service, master=cls.master, client=cls.user,
+                                                date=today - timedelta(days=3), time=time(10))
+        cls.upcoming = Appointment.objects.create(service=cls.service, master=cls.master, client=cls.user,
+                                                  date=today + timedelta(days=3), time=time(10))
+
+    def test_command_moves_old_appointments(self):
+        """
+        Test for checking that the command moves the old appointments with their events and rollups kept
+        """
+        rollup = DailyRollup.objects.values_list('bookings', 'revenue').get(date=self.old_day)
+        events = Event.objects.count()
+        event_id = Appointment.objects.values_list('event_id', flat=True).get(pk=self.old[0].pk)
+        out = io.StringIO()
+        call_command('archive_appointments', days=365, batch_size=2, pause=0, stdout=out)
+        self.assertIn('Archived 3 appointments before', out.getvalue())
+        self.assertEqual(set(Appointment.objects.values_list('pk', flat=True)), {self.recent.pk, self.upcoming.pk})
+        archived = ArchivedAppointment.objects.get(pk=self.old[0].pk)
+        self.assertEqual((archived.client, archived.start, archived.event_id), (self.user, self.old[0].start, event_id))
+        self.assertIsNotNone(event_id)
+        self.assertEqual(Event.objects.count(), events)
+        self.assertEqual(DailyRollup.objects.values_list('bookings', 'revenue').get(date=self.old_day), rollup)
+        rebuild_rollups(self.old_day, self.old_day)
+        self.assertEqual(DailyRollup.objects.values_list('bookings', 'revenue').get(date=self.old_day), (3, 2100))
+
+    def test_batches_are_resumable(self):
+        """
+        Test for checking that every batch is complete and the next one goes on with the rest
+        """
+        cutoff = archive_cutoff(365)
+        self.assertEqual(archive_batch(cutoff, 2), 2)
+        self.assertEqual(ArchivedAppointment.objects.count() + Appointment.objects.count(), 5)
+        self.assertEqual(archive_batch(cutoff, 2), 1)
+        self.assertEqual(archive_batch(cutoff, 2), 0)
+
+    def test_upcoming_appointments_are_never_archived(self):
+        """
+        Test for checking that a cutoff in the future is rejected and never moves the upcoming appointments
+        """
+        for options in ({'days': -5}, {'before': str(timezone.localdate() + timedelta(days=10))}):
+            with self.assertRaises(CommandError):
+                call_command('archive_appointments', pause=0, stdout=io.StringIO(), **options)
+        self.assertEqual(archive_batch(timezone.localdate() + timedelta(days=10)), 4)
+        self.assertEqual(list(Appointment.objects.values_list('pk', flat=True)), [self.upcoming.pk])
+
+    def test_history_reads_both_tables(self):
+        """
+        Test for checking that the client history and the export include the archived appointments
+        """
+        archive_batch(archive_cutoff(365))
+        rows = list(history(('pk', 'date', 'time'), client=self.user))
+        self.assertEqual([row[0] for row in rows], [appointment.pk for appointment in self.old] +
+                         [self.recent.pk, self.upcoming.pk])
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('my_appointments'), {'tab': 'past'})
+        self.assertEqual([appointment.pk for appointment in response.context['appointments']],
+                         [self.recent.pk] + [appointment.pk for appointment in reversed(self.old)])
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('appointment_export'))
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[1].endswith(',Archive Master,Archive,700,60,archive@example.com'))
+
+
+class SoftDeleteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='soft', email='soft@example.com')
+        cls.service = Service.objects.create(name='Soft', price=500, duration=timedelta(hours=1))
+        cls.other_service = Service.objects.create(name='Other Soft', price=300, duration=timedelta(hours=1))
+        cls.master = Master.objects.create(name='Soft Master', user=cls.user)
+        cls.other = Master.objects.create(name='Other Master', user=cls.user)
+        for master in (cls.master, cls.other):
+            master.services.add(cls.service, cls.other_service)
+        cls.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def book(self, master, service, hour):
+        return Appointment.objects.create(service=service, master=master, date=self.tomorrow, time=time(hour))
+
+    def test_delete_view_hides_master(self):
+        """
+        Test for checking that deleting a master only hides it and keeps its appointments until the purge
+        """
+        self.book(self.master, self.service, 10)
+        response = self.client.post(reverse('master_delete', kwargs={'pk': self.master.pk,
+                                                                     'service_id': self.service.pk}))
+        self.assertRedirects(response, reverse('master_list', kwargs={'service_id': self.service.pk}))
+        self.master.refresh_from_db()
+        self.assertFalse(self.master.is_active)
+        self.assertIsNotNone(self.master.deleted_at)
+        self.assertEqual(Appointment.objects.count(), 1)
+        response = self.client.get(reverse('master_list', kwargs={'service_id': self.service.pk}))
+        self.assertEqual(list(response.context['masters']), [self.other])
+        url = reverse('master_detail', kwargs={'pk': self.master.pk, 'service_id': self.service.pk})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.book(self.other, self.service, 10)
+        with self.assertRaises(NoMasterAvailable):
+            book_any_master(self.service, self.tomorrow, time(10))
+
+    def test_admin_delete_is_soft(self):
+        """
+        Test for checking that the admin deletes softly and can restore
+        """
+        staff = CustomUser.objects.create(username='soft-staff', email='soft-staff@example.com', is_staff=True,
+                                          is_superuser=True)
+        self.client.force_login(staff)
+        url = reverse('admin:appointments_service_changelist')
+        self.client.post(url, {'action': 'delete_selected', '_selected_action': [self.service.pk], 'post': 'yes'})
+        self.service.refresh_from_db()
+        self.assertFalse(self.service.is_active)
+        self.client.post(url, {'action': 'restore', '_selected_action': [self.service.pk]})
+        self.service.refresh_from_db()
+        self.assertTrue(self.service.is_active)
+        self.assertIsNone(self.service.deleted_at)
+
+    def test_purge_master_in_batches(self):
+        """
+        Test for checking that the purge deletes the dependent rows of a master in batches and the master last
+        """
+        for hour in (9, 11, 13):
+            self.book(self.master, self.service, hour)
+        self.master.get_schedule_dict()
+        kept = self.book(self.other, self.service, 9)
+        self.master.soft_delete()
+        Master.objects.filter(pk=self.other.pk).update(is_active=False)  # deactivated only, not deleted
+        self.assertEqual(deleted_objects(), [self.master])
+        progress = list(iter_purge(self.master, batch_size=2))
+        self.assertIn(('appointments', 2), progress)
+        self.assertIn(('appointments', 1), progress)
+        self.assertFalse(Master.objects.filter(pk=self.master.pk).exists())
+        self.assertEqual(list(Appointment.objects.all()), [kept])
+        self.assertEqual(Event.objects.count(), 1)
+        self.assertFalse(SlotInventory.objects.filter(master_id=self.master.pk).exists())
+
+    def test_purge_service_updates_active_masters(self):
+        """
+        Test for checking that purging a service frees the slots and updates the rollups of the masters
+        """
+        self.book(self.other, self.service, 10)
+        self.book(self.other, self.other_service, 12)
+        self.other.get_schedule_dict()
+        self.service.soft_delete()
+        out = io.StringIO()
+        call_command('purge_deleted', pause=0, stdout=out)
+        self.assertIn('Purged 1 deleted masters and services', out.getvalue())
+        self.assertFalse(Service.objects.filter(pk=self.service.pk).exists())
+        self.assertEqual(list(self.other.services.all()), [self.other_service])
+        rollup = DailyRollup.objects.get(master=self.other, date=self.tomorrow)
+        self.assertEqual((rollup.bookings, rollup.revenue), (1, 300))
+        schedule = self.other.get_schedule_dict()[str(self.tomorrow)]
+        self.assertEqual(schedule['10:00:00'], 'available')
+
+
+class CapacityPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create(username='capacity', email='capacity@example.com')
+        cls.staff = CustomUser.objects.create(username='capacity-staff', email='capacity-staff@example.com',
+                                              is_staff=True)
+        cls.service = Service.objects.create(name='Capacity', price=1000, duration=timedelta(minutes=60))
+        cls.master = Master.objects.create(name='Capacity Master', user=cls.user)
+        cls.master.services.add(cls.service)
+        cls.today = timezone.localdate()
+        # two bookings at 10 o'clock on the same weekday of each of the last two weeks
+        other = Master.objects.create(name='Capacity Other', user=cls.user)
+        for weeks in (1, 2):
+            day = cls.today - timedelta(weeks=weeks)
+            Appointment.objects.create(service=cls.service, master=cls.master, date=day, time=time(10))
+            Appointment.objects.create(service=cls.service, master=other, date=day, time=time(10))
+        other.soft_delete()
+
+    def test_demand_and_roster(self):
+        """
+        Test for checking the weekly demand loaded from the history and the planned roster
+        """
+        demand = load_demand([self.service], self.today - timedelta(weeks=2), self.today - timedelta(days=1))
+        self.assertEqual(demand.shape, (1, 7, 24))
+        self.assertEqual(demand[0, self.today.weekday(), 10], 2)
+        self.assertEqual(demand.sum(), 2)
+        roster = current_roster([self.service])
+        self.assertEqual([master.name for master in roster], ['Capacity Master'])
+        self.assertEqual(roster[0].available_minutes, 7 * 600)
+        planned = plan_roster(roster, extra=[{self.service.pk}], hours=(8, 20))
+        self.assertEqual([master.available_minutes for master in planned], [7 * 720, 7 * 720])
+        self.assertEqual(plan_roster(roster, without=[self.master.pk]), [])
+        with self.assertRaises(ValueError):
+            plan_roster(roster, hours=(20, 8))
+
+    def test_simulation(self):
+        """
+        Test for checking that one master loses the second client of the hour and a second master takes them
+        """
+        demand = np.zeros((1, 7, 24))
+        demand[0, 0, 10] = 2
+        roster = current_roster([self.service])
+        durations, prices = np.array([60]), np.array([1000])
+        served, lost, booked = simulate(demand, durations, roster, [self.service], simulations=3000, seed=1)
+        self.assertEqual(served.shape, (3000, 1))
+        self.assertTrue((served <= 1).all())
+        self.assertTrue((served + lost > 1).any())
+        planned = plan_roster(roster, extra=[{self.service.pk}])
+        served_more, lost_more, _ = simulate(demand, durations, planned, [self.service], simulations=3000, seed=1)
+        # the same seed draws the same clients for both rosters
+        self.assertTrue((served + lost == served_more + lost_more).all())
+        self.assertGreater(served_more.sum(), served.sum())
+        self.assertLess(lost_more.sum(), lost.sum())
+
+    def test_numpy_is_loaded_lazily(self):
+        """
+        Test for checking that the views and the forms do not import NumPy
+        """
+        code = ('import sys, django; django.setup(); import appointments.urls, appointments.forms; '
+                'print("numpy" in sys.modules)')
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                env=dict(os.environ, DJANGO_SETTINGS_MODULE='mysite.settings'))
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_command_and_page(self):
+        """
+        Test for checking the capacity simulation command and the staff page
+        """
+        out = io.StringIO()
+        call_command('simulate_capacity', simulations=200, weeks=2, add_master=[str(self.service.pk)], seed=3,
+                     stdout=out)
+        self.assertIn('Planned roster: 2 masters', out.getvalue())
+        plan = capacity_plan(simulations=200, history_weeks=2, seed=3, without=[self.master.pk])
+        self.assertEqual(plan['demand'], 2)
+        self.assertEqual((plan['planned']['served']['mean'], plan['planned']['lost_percent']), (0, 100))
+        url = reverse('staff_capacity')
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {'simulations': 200, 'start_hour': 8, 'end_hour': 20})
+        self.assertEqual(response.context['plan']['planned']['available_minutes'], 7 * 720)
+        self.assertEqual(response.context['plan']['weeks'], 12)
+        self.assertContains(response, 'Capacity Master')
+        response = self.client.get(url, {'new_masters': 1})
+        self.assertNotIn('plan', response.context)
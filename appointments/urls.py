@@ -1,7 +1,10 @@
 from django.urls import path
 from .views import (AppointmentCreateView, MasterListView, MasterDetailView, MasterCreateView, MasterUpdateView,
                     MasterDeleteView, ServiceListView, ServiceCreateView, ServiceUpdateView, ServiceDeleteView, ServiceDetailView,
-                    AppointmentCreateSuccessView)
+                    AppointmentCreateSuccessView, PackageSearchView, AnyMasterBookingView,
+                    SlotHoldView, AvailabilityView, MasterCalendarView, LiveEventsFallbackView,
+                    StaffGridView, BulkBookingView, MyAppointmentsView, AppointmentCancelView,
+                    AppointmentExportView, StaffDashboardView, StaffCapacityView)
 
 urlpatterns = [
     path('services/', ServiceListView.as_view(), name='service_list'),
@@ -9,11 +12,25 @@ urlpatterns = [
     path('services/<int:pk>/update/', ServiceUpdateView.as_view(), name='service_update'),
     path('services/<int:pk>/delete/', ServiceDeleteView.as_view(), name='service_delete'),
     path('services/<int:pk>/', ServiceDetailView.as_view(), name='service_detail'),
+    path('services/<int:pk>/book/', AnyMasterBookingView.as_view(), name='any_master_booking'),
     path('services/<int:service_id>/masters/', MasterListView.as_view(), name='master_list'),
     path('services/<int:service_id>/masters/create/', MasterCreateView.as_view(), name='master_create'),
     path('services/<int:service_id>/masters/<int:pk>/update/', MasterUpdateView.as_view(), name='master_update'),
     path('services/<int:service_id>/masters/<int:pk>/delete/', MasterDeleteView.as_view(), name='master_delete'),
     path('services/<int:service_id>/masters/<int:pk>/', MasterDetailView.as_view(), name='master_detail'),
     path('services/<int:service_id>/masters/<int:pk>/create/', AppointmentCreateView.as_view(), name='appointment_create'),
+    path('services/<int:service_id>/masters/<int:pk>/hold/', SlotHoldView.as_view(), name='slot_hold'),
+    path('services/<int:service_id>/masters/<int:pk>/availability/<str:date>/', AvailabilityView.as_view(),
+         name='master_availability'),
+    path('masters/<int:pk>/calendar/<str:token>.ics', MasterCalendarView.as_view(), name='master_calendar'),
+    path('masters/<int:pk>/events/', LiveEventsFallbackView.as_view(), name='master_live_events'),
+    path('staff/grid/', StaffGridView.as_view(), name='staff_grid'),
+    path('appointments/bulk/', BulkBookingView.as_view(), name='bulk_booking'),
+    path('staff/dashboard/', StaffDashboardView.as_view(), name='staff_dashboard'),
+    path('staff/capacity/', StaffCapacityView.as_view(), name='staff_capacity'),
+    path('export/', AppointmentExportView.as_view(), name='appointment_export'),
+    path('mine/', MyAppointmentsView.as_view(), name='my_appointments'),
+    path('mine/<int:pk>/cancel/', AppointmentCancelView.as_view(), name='appointment_cancel'),
     path('appointments/success/', AppointmentCreateSuccessView.as_view(), name='appointment_create_success'),
+    path('packages/search/', PackageSearchView.as_view(), name='package_search'),
 ]
@@ -1,6 +1,15 @@
+import hashlib
 import json
+from datetime import timedelta
 
 from django.contrib import messages
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_time
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
 
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy, reverse
@@ -10,13 +19,42 @@ from django.views.generic import TemplateView
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 
-from .forms import AppointmentForm, MasterForm, ServiceForm
+from .archive import history, history_querysets
+from .availability import horizon_dates, in_horizon, slot_times
+from .bitmap import AvailabilityIndex
+from .calendar_feed import feed_version, iter_feed
+from .exports import EXPORT_FIELDS, EXPORTERS, export_response
+from .bulk_booking import ACCEPTED, book_batch
+from .booking import NoMasterAvailable, SlotTaken, book_any_master, book_appointment, hold_slot, release_hold
+from .idempotency import IdempotentPostMixin
+from .keyset import keyset_page
+from .forms import AnyMasterBookingForm, AppointmentForm, CapacityPlanForm, MasterForm, ServiceForm
+from .packages import DEFAULT_PACKAGE_DAYS, find_package_chains
+from .rollups import dashboard
+from .staff_grid import staff_grid, week_start
 from .models import Appointment, Master, Service
 
 
+# Lets only staff in: anonymous visitors are sent to the login page, other users get 403.
+class StaffRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+
+# Deletes the object softly: it is hidden at once, and its appointments and other dependent rows
+# are deleted later in batches by the purge_deleted management command.
+class SoftDeleteMixin:
+
+    def form_valid(self, form):
+        success_url = self.get_success_url()
+        self.object.soft_delete()
+        return redirect(success_url)
+
+
 # List view for Service model
 class ServiceListView(ListView):
-    model = Service
+    queryset = Service.objects.active()
     template_name = 'service_list.html'
     context_object_name = 'services'
 
@@ -30,24 +68,55 @@ class ServiceCreateView(CreateView):
 
 # Update view for Service model
 class ServiceUpdateView(UpdateView):
-    model = Service
+    queryset = Service.objects.active()
     form_class = ServiceForm
     template_name = 'service_update.html'
 
 
 # Delete view for Service model
-class ServiceDeleteView(DeleteView):
-    model = Service
+class ServiceDeleteView(SoftDeleteMixin, DeleteView):
+    queryset = Service.objects.active()
     template_name = 'service_delete.html'
     success_url = reverse_lazy('service_list')
 
 
+# The user who makes a booking, or None for an anonymous visitor.
+def booking_client(request):
+    return request.user if request.user.is_authenticated else None
+
+
 # Detail view for Service model
-class ServiceDetailView(DetailView):
-    model = Service
+class ServiceDetailView(IdempotentPostMixin, DetailView):
+    queryset = Service.objects.active()
     template_name = 'service_detail.html'
     context_object_name = 'service'
 
+    # Adds the form to book the service with any available master.
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.setdefault('any_master_form', AnyMasterBookingForm())
+        return context
+
+
+# The AnyMasterBookingView books the service at the selected date and time with the least loaded
+# master who is free, so the client does not have to pick a master.
+class AnyMasterBookingView(ServiceDetailView):
+
+    def post(self, request, *args, **kwargs):
+        self.object = service = self.get_object()
+        form = AnyMasterBookingForm(request.POST)
+        if form.is_valid():
+            try:
+                book_any_master(service, form.cleaned_data['date'], form.cleaned_data['time'],
+                                client=booking_client(request))
+            except NoMasterAvailable:
+                # shown with the form, not as a message, so it stays on this page only
+                form.add_error(None, 'На это время нет свободных мастеров, выберите другое время.')
+            else:
+                messages.success(request, 'Запись успешно создана!')
+                return redirect('appointment_create_success')
+        return self.render_to_response(self.get_context_data(any_master_form=form))
+
 
 # List view for Master model
 class MasterListView(ListView):
@@ -57,12 +126,20 @@ class MasterListView(ListView):
 
     def get_queryset(self):
         # Get all masters that have the current service in their services list
-        return Master.objects.filter(services__pk=self.kwargs['service_id']).distinct()
+        return Master.objects.active().filter(services__pk=self.kwargs['service_id']).distinct()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # Get the current service object and add it to the context
-        context['service'] = get_object_or_404(Service, pk=self.kwargs['service_id'])
+        service = get_object_or_404(Service.objects.active(), pk=self.kwargs['service_id'])
+        context['service'] = service
+        # Find the next free slot of every master with one availability index
+        masters = list(context['masters'])
+        index = AvailabilityIndex.build([master.pk for master in masters])
+        for master in masters:
+            master.next_free_slot = index.next_free(master.pk, service)
+        context['masters'] = masters
+        context['earliest_slot'] = index.earliest([master.pk for master in masters], service)
         return context
 
 
@@ -83,7 +160,7 @@ class MasterUpdateView(UpdateView):
 
     def get_object(self):
         # Get the current master object by its primary key
-        return get_object_or_404(Master, pk=self.kwargs['pk'])
+        return get_object_or_404(Master.objects.active(), pk=self.kwargs['pk'])
 
     def form_valid(self, form):
         master = form.save(commit=False)
@@ -97,25 +174,41 @@ class MasterUpdateView(UpdateView):
 
 
 # Delete view for Master model
-class MasterDeleteView(DeleteView):
-    model = Master
+class MasterDeleteView(SoftDeleteMixin, DeleteView):
+    queryset = Master.objects.active()
     template_name = 'master_delete.html'
-    success_url = reverse_lazy('master_list')
+
+    def get_success_url(self):
+        return reverse('master_list', kwargs={'service_id': self.kwargs['service_id']})
+
+
+# The session key under which the token of the client's slot hold is kept.
+HOLD_SESSION_KEY = 'slot_hold'
+
+
+# Renders the "slot just taken" page with the nearest free slots of the master (HTTP 409).
+def slot_taken_response(request, error):
+    context = {
+        'master': error.master,
+        'service': error.service,
+        'date': error.date,
+        'time': error.time,
+        'alternatives': error.alternatives,
+    }
+    return render(request, 'appointment_slot_taken.html', context, status=409)
 
 
 # Detail view for Master model
-class MasterDetailView(DetailView):
-    model = Master
+class MasterDetailView(IdempotentPostMixin, DetailView):
+    queryset = Master.objects.active()
     template_name = 'master_detail.html'
     context_object_name = 'master'
 
-    # The get_context_data method adds the selected service and schedule_dict to the context of the template.
+    # The get_context_data method adds the selected service to the context of the template.
+    # The schedule is shown on the booking page, so it is not computed here.
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['service'] = get_object_or_404(Service, pk=self.kwargs['service_id'])
-        master = self.get_object()
-        schedule_dict = master.get_schedule_dict()
-        context['schedule_dict'] = schedule_dict
+        context['service'] = get_object_or_404(Service.objects.active(), pk=self.kwargs['service_id'])
         return context
 
     # The post method processes the form data submitted by the user.
@@ -124,13 +217,16 @@ class MasterDetailView(DetailView):
     # error message to the context and renders the template again with the invalid form.
     def post(self, request, *args, **kwargs):
         master = self.get_object()
-        service = get_object_or_404(Service, pk=self.kwargs['service_id'])
-        form = AppointmentForm(request.POST)
+        service = get_object_or_404(Service.objects.active(), pk=self.kwargs['service_id'])
+        hold_token = request.session.get(HOLD_SESSION_KEY)
+        form = AppointmentForm(request.POST, hold_token=hold_token)
         if form.is_valid():
-            appointment = form.save(commit=False)
-            appointment.service = service
-            appointment.master = master
-            appointment.save()
+            try:
+                book_appointment(master, service, form.cleaned_data['date'], form.cleaned_data['time'],
+                                 hold_token=hold_token, client=booking_client(request))
+            except SlotTaken as error:
+                return slot_taken_response(request, error)
+            request.session.pop(HOLD_SESSION_KEY, None)
             messages.success(request, 'Запись успешно создана!')
             return redirect('service_list')
         else:
@@ -138,7 +234,7 @@ class MasterDetailView(DetailView):
             return self.render_to_response(self.get_context_data(form=form))
 
 # The following code defines a view to create a new Appointment instance
-class AppointmentCreateView(CreateView):
+class AppointmentCreateView(IdempotentPostMixin, CreateView):
     model = Appointment
     form_class = AppointmentForm
     template_name = 'appointment_create.html'
@@ -157,53 +253,355 @@ class AppointmentCreateView(CreateView):
         kwargs = super().get_form_kwargs()
         kwargs['initial'] = {
             'master': self.get_object(),
-            'service': get_object_or_404(Service, pk=self.kwargs['service_id'])
+            'service': get_object_or_404(Service.objects.active(), pk=self.kwargs['service_id']),
+            'date': timezone.localdate(),
         }
+        kwargs['hold_token'] = self.request.session.get(HOLD_SESSION_KEY)
         return kwargs
 
     # The get_object method gets the Master object based on the pk URL parameter.
     def get_object(self):
-        return get_object_or_404(Master, pk=self.kwargs['pk'])
+        return get_object_or_404(Master.objects.active(), pk=self.kwargs['pk'])
 
     def post(self, request, *args, **kwargs):
+        self.object = None
         form = self.get_form()
         if form.is_valid():
-            messages.success(request, 'Запись успешно создана!')
             return self.form_valid(form)
         else:
             messages.error(request, 'Пожалуйста, исправьте ошибки.')
             return self.form_invalid(form)
 
-    # The form_valid method is called when the form is valid. It saves the form data to the database and
-    # redirects to the success URL.
+    # The form_valid method is called when the form is valid. It books the appointment through
+    # the booking service and redirects to the success URL. If the slot has just been taken
+    # by somebody else, it answers with the "slot taken" page and the nearest free slots.
     def form_valid(self, form):
-        self.object = form.save()
-        return super().form_valid(form)
-
-    # The get_context_data method adds the selected service, schedule_dict,
-    # and object  to the context of the template. It also adds the available
-    # time options for the time form field based on the schedule of the selected
-    # Master object. Finally, it returns the context.
+        data = form.cleaned_data
+        try:
+            self.object = book_appointment(data['master'], data['service'], data['date'], data['time'],
+                                           hold_token=form.hold_token, client=booking_client(self.request))
+        except SlotTaken as error:
+            return slot_taken_response(self.request, error)
+        self.request.session.pop(HOLD_SESSION_KEY, None)
+        messages.success(self.request, 'Запись успешно создана!')
+        return redirect(self.get_success_url())
+
+    # The get_context_data method adds the selected service, the schedule of the selected date
+    # (today by default) and object to the context of the template. It also adds the available
+    # time options of that date for the time form field. The other dates are loaded by the page
+    # from the AvailabilityView when the client picks them.
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['service'] = get_object_or_404(Service, pk=self.kwargs['service_id'])
-        master = get_object_or_404(Master, pk=self.kwargs['pk'])
-        schedule_dict = master.get_schedule_dict()
+        context['service'] = get_object_or_404(Service.objects.active(), pk=self.kwargs['service_id'])
+        master = get_object_or_404(Master.objects.active(), pk=self.kwargs['pk'])
+        date = parse_date(self.request.POST.get('date', ''))
+        if date is None or not in_horizon(date):
+            date = timezone.localdate()
+        schedule_dict = master.get_schedule_dict(service=context['service'], days=1, start_date=date)
         context['schedule_dict'] = schedule_dict
 
         # let's add time options for the time form field
-        available_times = []
-        for schedule in schedule_dict.values():
-            for time, status in schedule.items():
-                if status == 'available':
-                    available_times.append((time, time))
+        available_times = [
+            (time, time[:5])
+            for time, status in schedule_dict[str(date)].items()
+            if status == 'available'
+        ]
         context['form'].fields['time'].widget.choices = available_times
-        context['schedule'] = schedule_dict
         context['object'] = self.object
 
         return context
 
+
+# The SlotHoldView holds the time the client has selected in the booking form, so nobody else
+# can take it while the form is being filled in. The token of the hold is kept in the session
+# and replaced when another time is selected. Posting release=1 releases the hold.
+class SlotHoldView(View):
+
+    def post(self, request, *args, **kwargs):
+        previous_token = request.session.get(HOLD_SESSION_KEY)
+        if request.POST.get('release'):
+            if previous_token:
+                release_hold(previous_token)
+                request.session.pop(HOLD_SESSION_KEY, None)
+            return JsonResponse({'released': True})
+
+        master = get_object_or_404(Master.objects.active(), pk=self.kwargs['pk'])
+        service = get_object_or_404(Service.objects.active(), pk=self.kwargs['service_id'])
+        date = parse_date(request.POST.get('date', ''))
+        time = parse_time(request.POST.get('time', ''))
+        if date is None or time is None:
+            return JsonResponse({'error': 'Некорректные дата или время.'}, status=400)
+        try:
+            hold = hold_slot(master, service, date, time, previous_token=previous_token)
+        except SlotTaken:
+            # the failed replacement is rolled back, so the previous hold stays with its token in the session
+            return JsonResponse({'error': 'Это время уже занято.'}, status=409)
+        request.session[HOLD_SESSION_KEY] = hold.token
+        return JsonResponse({'date': str(hold.date), 'time': str(hold.time), 'expires_at': hold.expires_at})
+
+
+# Returns the version of the master's schedule as (etag, last_modified). It costs one query
+# and is remembered on the request, because the condition decorator asks for both values.
+def schedule_version(request, service_id, pk, date):
+    if not hasattr(request, '_schedule_version'):
+        changed_at = Master.objects.filter(pk=pk).values_list('schedule_changed_at', flat=True).first()
+        digest = hashlib.md5(f'{pk}:{service_id}:{date}:{changed_at}'.encode()).hexdigest()
+        request._schedule_version = (f'"{digest}"', changed_at)
+    return request._schedule_version
+
+
+# The AvailabilityView returns the availability of one master for one date as JSON:
+# {"date": "2023-04-10", "slots": {"09:00:00": "available", ...}, "available": ["09:00", ...]}.
+# The ETag and Last-Modified headers follow the last change of the master's bookings,
+# so the booking page fetches only the selected day and unchanged days come back as 304.
+@method_decorator(condition(
+    etag_func=lambda request, **kwargs: schedule_version(request, **kwargs)[0],
+    last_modified_func=lambda request, **kwargs: schedule_version(request, **kwargs)[1],
+), name='get')
+class AvailabilityView(View):
+
+    def get(self, request, *args, **kwargs):
+        master = get_object_or_404(Master.objects.active(), pk=self.kwargs['pk'])
+        service = get_object_or_404(Service.objects.active(), pk=self.kwargs['service_id'])
+        date = parse_date(self.kwargs['date'])
+        if date is None:
+            return JsonResponse({'error': 'Некорректная дата.'}, status=400)
+        if not in_horizon(date):
+            return JsonResponse({'error': 'Дата вне периода записи.'}, status=400)
+        slots = master.get_schedule_dict(service=service, days=1, start_date=date)[str(date)]
+        response = JsonResponse({
+            'date': str(date),
+            'slots': slots,
+            'available': [slot[:5] for slot, status in slots.items() if status == 'available'],
+        })
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+def calendar_version(request, pk, token):
+    if not hasattr(request, '_calendar_version'):
+        request._calendar_version = feed_version(pk, request.GET.get('from'), request.GET.get('to'), token)
+    return request._calendar_version
+
+
+# The MasterCalendarView streams the appointments of a master as an iCalendar (.ics) feed
+# for phone calendars, e.g. /appointments/masters/1/calendar/<token>.ics?from=2023-01-01&to=2023-12-31.
+# Calendar apps cannot log in, so the URL carries the secret calendar token of the master and
+# a wrong token is answered with 404. Calendar apps poll the feed, so it carries an ETag and Last-Modified
+# and an unchanged feed is answered with 304 before any appointment is read.
+@method_decorator(condition(
+    etag_func=lambda request, **kwargs: calendar_version(request, **kwargs)[0],
+    last_modified_func=lambda request, **kwargs: calendar_version(request, **kwargs)[1],
+), name='get')
+class MasterCalendarView(View):
+
+    def get(self, request, *args, **kwargs):
+        master = get_object_or_404(Master.objects.active(), pk=self.kwargs['pk'], calendar_token=self.kwargs['token'])
+        dates = []
+        for name in ('from', 'to'):
+            value = request.GET.get(name)
+            dates.append(parse_date(value) if value else None)
+            if value and dates[-1] is None:
+                return HttpResponseBadRequest('Некорректная дата.')
+        try:
+            feed = iter_feed(master, *dates, domain=request.get_host())
+        except ValueError:
+            return HttpResponseBadRequest('Некорректная дата.')
+        response = StreamingHttpResponse(feed, content_type='text/calendar; charset=utf-8')
+        response['Content-Disposition'] = f'inline; filename="master-{master.pk}.ics"'
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+# The live slot events of a master are served by the ASGI application (see appointments.live).
+# When the site runs under WSGI, this view answers the event stream with a long retry interval
+# instead of holding a worker, and the booking page keeps working without live updates.
+class LiveEventsFallbackView(View):
+
+    def get(self, request, *args, **kwargs):
+        response = HttpResponse('retry: 60000\n\n', content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+
+# The StaffGridView shows the bookings of all masters by slot for a day or a week
+# (/appointments/staff/grid/?date=2023-04-10&week=1). Staff only.
+class StaffGridView(StaffRequiredMixin, TemplateView):
+    template_name = 'staff_grid.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        date = parse_date(self.request.GET.get('date', '')) or timezone.localdate()
+        week = self.request.GET.get('week') == '1'
+        start = week_start(date) if week else date
+        days = 7 if week else 1
+        context.update({
+            'date': date,
+            'week': week,
+            'times': slot_times(),
+            'grids': staff_grid(start, days),
+            'previous_date': start - timedelta(days=days),
+            'next_date': start + timedelta(days=days),
+        })
+        return context
+
+
+# The BulkBookingView books many rows at once for receptionists. It takes a JSON body
+# {"rows": [{"master": 1, "service": 2, "date": "2023-04-10", "time": "10:00"}, ...]}
+# and answers with the accepted/rejected report of every row. Staff only.
+class BulkBookingView(StaffRequiredMixin, View):
+
+    def post(self, request, *args, **kwargs):
+        try:
+            rows = json.loads(request.body)['rows']
+        except (ValueError, KeyError, TypeError):
+            return JsonResponse({'error': 'Ожидается JSON с полем "rows".'}, status=400)
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            return JsonResponse({'error': '"rows" должен быть списком объектов.'}, status=400)
+        report = book_batch(rows)
+        accepted = sum(1 for line in report if line['status'] == ACCEPTED)
+        return JsonResponse({'accepted': accepted, 'rejected': len(report) - accepted, 'rows': report})
+
+
+# The StaffDashboardView shows the revenue and the occupancy of the masters for a date range
+# (/appointments/staff/dashboard/?from=2023-04-01&to=2023-04-30, the current month by default).
+# It reads only the daily rollups. Staff only.
+class StaffDashboardView(StaffRequiredMixin, TemplateView):
+    template_name = 'staff_dashboard.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        today = timezone.localdate()
+        start = parse_date(self.request.GET.get('from', '')) or today.replace(day=1)
+        end = parse_date(self.request.GET.get('to', ''))
+        if end is None:
+            # the last day of the month of start
+            end = (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+        context.update(dashboard(start, end))
+        context.update({'start': start, 'end': end})
+        return context
+
+
+# The StaffCapacityView simulates the weeks of the current roster of masters and of a planned one
+# (/appointments/staff/capacity/?without=3&new_masters=1&new_services=1&start_hour=8&end_hour=21)
+# and shows the expected utilization, lost bookings and revenue of both. Staff only.
+class StaffCapacityView(StaffRequiredMixin, TemplateView):
+    template_name = 'staff_capacity.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # the parameters left out of the query take their initial values, so the page opens with a simulation
+        data = self.request.GET.copy()
+        for name, field in CapacityPlanForm.base_fields.items():
+            if name not in data and field.initial is not None:
+                data[name] = field.initial
+        form = CapacityPlanForm(data)
+        context['form'] = form
+        if form.is_valid():
+            # imported here, so NumPy is not loaded with the other views
+            from .capacity import capacity_plan
+
+            context['plan'] = capacity_plan(**form.plan_kwargs())
+        return context
+
+
+# The AppointmentExportView streams the appointments of a date range for accounting
+# (/appointments/export/?from=2023-01-01&to=2023-12-31&format=xlsx). Staff only.
+class AppointmentExportView(StaffRequiredMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in EXPORTERS:
+            return HttpResponseBadRequest('Неизвестный формат.')
+        dates = []
+        for name in ('from', 'to'):
+            value = request.GET.get(name)
+            dates.append(parse_date(value) if value else None)
+            if value and dates[-1] is None:
+                return HttpResponseBadRequest('Некорректная дата.')
+        filters = {}
+        if dates[0]:
+            filters['date__gte'] = dates[0]
+        if dates[1]:
+            filters['date__lte'] = dates[1]
+        # the archived appointments are exported together with the current ones
+        return export_response(history(EXPORT_FIELDS, **filters), export_format, *dates)
+
+
+# The MyAppointmentsView lists the bookings of the logged-in client with "upcoming" and "past" tabs
+# (/appointments/mine/?tab=past&after=<cursor>). The pages use keyset pagination over (client, start).
+class MyAppointmentsView(LoginRequiredMixin, TemplateView):
+    template_name = 'my_appointments.html'
+    paginate_by = 20
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        tab = 'past' if self.request.GET.get('tab') == 'past' else 'upcoming'
+        now = timezone.now()
+        if tab == 'past':
+            # the old bookings may have been moved to the archive
+            appointments = [
+                queryset.select_related('service', 'master')
+                for queryset in history_querysets(client=self.request.user, start__lt=now)
+            ]
+        else:
+            appointments = Appointment.objects.filter(
+                client=self.request.user, start__gte=now,
+            ).select_related('service', 'master')
+        rows, next_cursor = keyset_page(
+            appointments, self.request.GET.get('after'), descending=tab == 'past', size=self.paginate_by,
+        )
+        context.update({
+            'tab': tab,
+            'appointments': rows,
+            'next_cursor': next_cursor,
+            'first_page': not self.request.GET.get('after'),
+        })
+        return context
+
+
+# The AppointmentCancelView cancels an upcoming booking of the logged-in client.
+class AppointmentCancelView(LoginRequiredMixin, View):
+
+    def post(self, request, *args, **kwargs):
+        appointment = get_object_or_404(
+            Appointment, pk=self.kwargs['pk'], client=request.user, start__gte=timezone.now(),
+        )
+        appointment.delete()
+        messages.success(request, 'Запись отменена.')
+        return redirect('my_appointments')
+
+
 # The AppointmentCreateSuccessView simply renders the success template
 class AppointmentCreateSuccessView(TemplateView):
     template_name = 'appointment_create_success.html'
 
+
+# The PackageSearchView looks for back-to-back appointments for several services booked together,
+# e.g. /appointments/packages/search/?services=1&services=2&date=2023-04-10.
+# It returns the chains as JSON: one master for all services or masters handing the client off.
+class PackageSearchView(View):
+
+    def get(self, request, *args, **kwargs):
+        try:
+            service_ids = [int(value) for value in request.GET.getlist('services')]
+            days = min(max(int(request.GET.get('days', DEFAULT_PACKAGE_DAYS)), 1), 60)
+            start_date = parse_date(request.GET['date']) if request.GET.get('date') else None
+        except ValueError:
+            return JsonResponse({'error': 'Некорректные параметры запроса.'}, status=400)
+        if request.GET.get('date') and start_date is None:
+            return JsonResponse({'error': 'Некорректная дата.'}, status=400)
+        first, last = horizon_dates()
+        start_date = start_date or first
+        if not first <= start_date <= last:
+            return JsonResponse({'error': 'Дата вне периода записи.'}, status=400)
+        # the search window ends with the booking horizon
+        days = min(days, (last - start_date).days + 1)
+        if not service_ids:
+            return JsonResponse({'error': 'Не выбраны услуги.'}, status=400)
+
+        services = Service.objects.active().in_bulk(service_ids)
+        if len(services) != len(set(service_ids)):
+            raise Http404('Услуга не найдена.')
+        chains = find_package_chains([services[pk] for pk in service_ids], start_date=start_date, days=days)
+        return JsonResponse({'services': service_ids, 'chains': chains})
@@ -0,0 +1,115 @@
+import json
+import logging
+from datetime import date as date_type
+from functools import lru_cache
+
+# Weekly working hours of a master are stored in Master.availability:
+#
+# {
+#     "weekly": {"mon": [["09:00", "19:00"]], "tue": [["09:00", "13:00"], ["14:00", "19:00"]], ...},
+#     "exceptions": {"2023-05-01": [], "2023-05-02": [["10:00", "14:00"]]}
+# }
+#
+# A weekday missing from "weekly" is a day off. An exception replaces the hours of one date:
+# an empty list is a day off, a shorter list is a shortened day. "weekly" is required, so a template
+# with only exceptions cannot close the master for good. An empty value means that the master works
+# the default hours every day.
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def _parse_time(value):
+    try:
+        hours, minutes = value.split(':')
+        hours, minutes = int(hours), int(minutes)
+    except (AttributeError, ValueError):
+        raise ValueError(f'Некорректное время "{value}", ожидается ЧЧ:ММ.')
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError(f'Некорректное время "{value}".')
+    return hours * 60 + minutes
+
+
+def _parse_intervals(value, where):
+    if not isinstance(value, list):
+        raise ValueError(f'{where}: ожидается список интервалов.')
+    intervals = []
+    for interval in value:
+        if not isinstance(interval, (list, tuple)) or len(interval) != 2:
+            raise ValueError(f'{where}: интервал должен быть парой ["ЧЧ:ММ", "ЧЧ:ММ"].')
+        start, end = _parse_time(interval[0]), _parse_time(interval[1])
+        if start >= end:
+            raise ValueError(f'{where}: начало интервала должно быть раньше конца.')
+        intervals.append((start, end))
+    intervals.sort()
+    for (_, previous_end), (start, _) in zip(intervals, intervals[1:]):
+        if start < previous_end:
+            raise ValueError(f'{where}: интервалы пересекаются.')
+    return tuple(intervals)
+
+
+# WorkingHours is the compiled weekly template: one tuple of intervals (minutes from midnight)
+# per weekday plus the exceptions by date. Looking up a date is O(1) and creates no rows.
+class WorkingHours:
+
+    def __init__(self, weekly, exceptions):
+        self.weekly = weekly
+        self.exceptions = exceptions
+
+    def intervals_for(self, day):
+        if day in self.exceptions:
+            return list(self.exceptions[day])
+        return list(self.weekly[day.weekday()])
+
+
+# Checks the value of Master.availability and compiles it. Returns None when the master has
+# no template (empty value). Raises ValueError with a readable message for a wrong value.
+def parse_working_hours(data):
+    if not data:
+        return None
+    if not isinstance(data, dict):
+        raise ValueError('Ожидается объект с ключами "weekly" и "exceptions".')
+    unknown = set(data) - {'weekly', 'exceptions'}
+    if unknown:
+        raise ValueError(f'Неизвестные ключи: {", ".join(sorted(unknown))}.')
+
+    if 'weekly' not in data:
+        raise ValueError('Не указан "weekly": рабочие часы по дням недели.')
+    weekly_data = data['weekly']
+    if not isinstance(weekly_data, dict):
+        raise ValueError('"weekly" должен быть объектом с днями недели.')
+    unknown = set(weekly_data) - set(WEEKDAYS)
+    if unknown:
+        raise ValueError(f'Неизвестные дни недели: {", ".join(sorted(unknown))}.')
+    weekly = tuple(_parse_intervals(weekly_data.get(day, []), day) for day in WEEKDAYS)
+
+    exceptions_data = data.get('exceptions', {})
+    if not isinstance(exceptions_data, dict):
+        raise ValueError('"exceptions" должен быть объектом с датами.')
+    exceptions = {}
+    for key, value in exceptions_data.items():
+        try:
+            day = date_type.fromisoformat(key)
+        except (TypeError, ValueError):
+            raise ValueError(f'Некорректная дата "{key}", ожидается ГГГГ-ММ-ДД.')
+        exceptions[day] = _parse_intervals(value, key)
+    return WorkingHours(weekly, exceptions)
+
+
+# A wrong stored template is logged (once per process, the result is cached) and read as no template.
+@lru_cache(maxsize=1024)
+def _compile(canonical):
+    try:
+        return parse_working_hours(json.loads(canonical))
+    except ValueError as error:
+        logger.error('Invalid working hours template %s: %s', canonical, error)
+        return None
+
+
+# Returns the compiled template of a Master.availability value, or None when there is no valid one.
+# Templates are cached by their content, so a master is compiled once until the template is edited.
+def compiled_working_hours(data):
+    if not data:
+        return None
+    return _compile(json.dumps(data, sort_keys=True))
@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from appointments.live import LIVE_PATH, live_events  # noqa: E402  (needs the configured settings)
+
+
+# The live slot events are long-lived streams, so they are served by a plain asyncio application
+# instead of going through the Django request cycle; everything else goes to Django.
+async def application(scope, receive, send):
+    if scope['type'] == 'http':
+        match = LIVE_PATH.match(scope['path'])
+        if match:
+            await live_events(scope, receive, send, int(match['master_id']))
+            return
+    await django_application(scope, receive, send)
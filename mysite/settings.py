@@ -94,6 +94,19 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The cache lives in the database, so every worker process sees the same entries and the staff grid
+# dropped by a booking in one worker is dropped for all. Create the table with
+# `python manage.py createcachetable` after migrating.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 